@@ -1,32 +1,64 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, colorchooser
-from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageFilter, ImageEnhance
+from PIL import Image, ImageEnhance, ImageTk
 import os
 import threading
+import time
 from queue import Queue
 import io
 import base64
-import numpy as np
-import matplotlib
-matplotlib.use('Agg')  # 在导入pyplot之前设置
-from matplotlib import pyplot as plt
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg
-try:
-    import emoji
-    EMOJI_SUPPORT = True
-except ImportError:
-    EMOJI_SUPPORT = False
+import importlib.util
+import multiprocessing
+
+# 只检查emoji模块是否已安装，不在启动时导入
+EMOJI_SUPPORT = importlib.util.find_spec("emoji") is not None
+if not EMOJI_SUPPORT:
     print("警告: emoji模块未安装，Emoji功能将受限")
 
-import svgwrite
-import warnings
-from io import BytesIO
-import cairosvg
-from svglib.svglib import svg2rlg
-from reportlab.graphics import renderPM
-import cssutils
-import re
+from animation import AnimatedIconSet, export_animation
+from atlas_export import export_atlas, icon_entries
+from font_index import FONT_INDEX
+import icon_render
+from effects import apply_effects, effect_names
+from icon_render import (apply_alpha, calculate_heart_points, calculate_star_points,
+                         composite_background, rasterize_svg, render_emoji, render_icon_set, render_text,
+                         render_unicode)
+from icon_import import best_entry, describe_entries, extract_entry, is_icon_file, read_icon_directory
+from icon_store import (DITHER_NAMES, ICO_DEPTH_POLICIES, IconSet, depths_for_sizes, write_ico,
+                        write_png)
+from input_limits import check_image, open_image
+from instrumentation import COUNTERS, MEMORY, memory_stage
+from mpl_sandbox import MPL_SANDBOX, SVG_SANDBOX
+from watch import Watcher
+
+# 实时预览按显示器刷新率节流 (Tk无法查询刷新率，按常见的60Hz处理)
+REALTIME_PREVIEW_FPS = 60
+
+# 按目标画质保存时的默认SSIM (与 quality_encode.DEFAULT_TARGET_SSIM 相同，quality_encode依赖NumPy，不在启动时导入)
+DEFAULT_TARGET_SSIM = 0.97
+
+# 实时预览中图表代码的超时 (秒)
+REALTIME_CHART_TIMEOUT = 3
+
+# 各标签页的生成按钮 (按标签页顺序)
+GENERATE_BUTTONS = (
+    "gen_preview_btn",              # 图片
+    "gen_text_preview_btn",         # 文字
+    "gen_svg_preview_btn",          # SVG
+    "gen_emoji_preview_btn",        # Emoji
+    "gen_unicode_preview_btn",      # Unicode
+    "gen_css_preview_btn",          # CSS
+    "gen_matplotlib_preview_btn",   # Matplotlib
+)
+
+# 较重的依赖在首次使用时才导入，窗口显示后在后台按顺序预先导入
+PREFETCH_MODULES = (
+    "numpy",
+    "css_engine",
+    "cairosvg",
+    "svglib.svglib",
+    "reportlab.graphics.renderPM",
+)
 
 class AdvancedIconGenerator:
     def __init__(self, root):
@@ -43,26 +75,9 @@ class AdvancedIconGenerator:
         # 主界面布局
         self.setup_main_layout()
         
-        # 图片转图标标签页
-        self.setup_image_tab()
-        
-        # 文字转图标标签页
-        self.setup_text_tab()
-        
-        # SVG转图标标签页
-        self.setup_svg_tab()
-        
-        # Emoji转图标标签页
-        self.setup_emoji_tab()
-        
-        # Unicode符号转图标标签页
-        self.setup_unicode_tab()
-        
-        # CSS样式转图标标签页
-        self.setup_css_tab()
-        
-        # Matplotlib绘图转图标标签页
-        self.setup_matplotlib_tab()
+        # 各标签页的内容在第一次切换到该页时才创建，之前只显示占位提示
+        # 图片标签页默认显示，立即创建 (其形状蒙版和质量设置也被其他标签页使用)
+        self.setup_lazy_tabs()
         
         # 预览和保存区域
         self.setup_preview_section()
@@ -74,8 +89,55 @@ class AdvancedIconGenerator:
         self.current_icon = None
         self.icon_previews = []
         self.progress_queue = Queue()
+        
+        # 源文件监视 (图片标签页的"监视变化"选项)
+        self.source_watcher = None
+        self._watch_changed_at = None
+        self._watch_rerun = None
         self.check_progress()
         
+        # 后台加载系统字体索引 (有缓存时很快)
+        threading.Thread(target=self.load_font_index, daemon=True).start()
+        
+        # 窗口显示后预热图表和SVG沙箱进程，并在后台预先导入较重的依赖
+        self.root.after(500, MPL_SANDBOX.start)
+        self.root.after(500, SVG_SANDBOX.start)
+        self.root.after(500, lambda: threading.Thread(target=self.prefetch_modules, daemon=True).start())
+        
+    def load_font_index(self):
+        """加载系统字体索引 (在后台线程中运行)"""
+        try:
+            FONT_INDEX.load()
+            self.progress_queue.put(("fonts_ready", len(FONT_INDEX.fonts)))
+        except Exception as e:
+            print(f"字体索引加载失败: {e}")
+    
+    def prefetch_modules(self):
+        """在后台预先导入较重的依赖 (在后台线程中运行)"""
+        for name in PREFETCH_MODULES:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                # 缺少的依赖在使用对应功能时再报错
+                print(f"预加载 {name} 失败: {e}")
+                continue
+            COUNTERS.incr(f"prefetch.{name}.ms", int((time.perf_counter() - start) * 1000))
+    
+    def update_font_choices(self):
+        """字体索引就绪后，字体下拉框只列出实际可加载的字体"""
+        families = FONT_INDEX.families()
+        if not families:
+            return
+        
+        for combo_name, var_name in (("font_combo", "font_family"),
+                                     ("unicode_font_combo", "unicode_font_family")):
+            combo = getattr(self, combo_name, None)
+            if combo is None:  # 所在标签页尚未创建
+                continue
+            current = getattr(self, var_name).get()
+            combo['values'] = families if current in families else [current] + families
+        
     def setup_styles(self):
         """初始化所有UI样式"""
         self.style = ttk.Style()
@@ -146,6 +208,57 @@ class AdvancedIconGenerator:
         self.status_bar = ttk.Label(self.root, text="准备就绪", relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.pack(fill=tk.X, side=tk.BOTTOM)
         
+    def setup_lazy_tabs(self):
+        """为各标签页登记创建方法，未创建的标签页显示占位提示"""
+        self.tab_builders = [
+            (self.image_tab, self.setup_image_tab),            # 图片转图标
+            (self.text_tab, self.setup_text_tab),              # 文字转图标
+            (self.svg_tab, self.setup_svg_tab),                # SVG转图标
+            (self.emoji_tab, self.setup_emoji_tab),            # Emoji转图标
+            (self.unicode_tab, self.setup_unicode_tab),        # Unicode符号转图标
+            (self.css_tab, self.setup_css_tab),                # CSS样式转图标
+            (self.matplotlib_tab, self.setup_matplotlib_tab),  # Matplotlib绘图转图标
+        ]
+        self._built_tabs = set()
+        self._tab_placeholders = {}
+        for index, (tab, _) in enumerate(self.tab_builders):
+            placeholder = ttk.Label(tab, text="正在加载...", anchor=tk.CENTER)
+            placeholder.pack(fill=tk.BOTH, expand=True)
+            self._tab_placeholders[index] = placeholder
+        
+        self.build_tab(0)
+        self.tab_control.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+    
+    def on_tab_changed(self, event=None):
+        """切换标签页时创建尚未创建的标签页"""
+        self.build_tab(self.tab_control.index("current"))
+    
+    def build_tab(self, index):
+        """创建指定标签页的内容 (只创建一次)"""
+        if index in self._built_tabs:
+            return
+        self._built_tabs.add(index)
+        
+        self._tab_placeholders.pop(index).destroy()
+        _, setup = self.tab_builders[index]
+        setup()
+        COUNTERS.incr("tabs.built")
+        
+        # 字体索引已就绪时，新建的字体下拉框同样只列出可加载的字体
+        if FONT_INDEX.ready:
+            self.update_font_choices()
+    
+    def is_tab_built(self, index):
+        """标签页是否已创建"""
+        return index in self._built_tabs
+    
+    def enable_generate_button(self):
+        """启用当前标签页的生成按钮 (标签页未创建或没有按钮时跳过)"""
+        current_tab = self.tab_control.index("current")
+        button = getattr(self, GENERATE_BUTTONS[current_tab], None)
+        if button is not None:
+            button['state'] = tk.NORMAL
+    
     def setup_image_tab(self):
         """设置图片转图标标签页 - 优化版"""
         # 主容器使用Frame+Canvas+Scrollbar实现可滚动区域
@@ -184,6 +297,13 @@ class AdvancedIconGenerator:
         self.browse_btn = ttk.Button(frame, text="浏览...", command=self.select_image, width=8)
         self.browse_btn.grid(row=0, column=1, padx=5, pady=2)
         
+        # 监视源文件，内容变化时自动重新生成
+        self.watch_source = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="监视变化", variable=self.watch_source,
+                        command=self.toggle_source_watch).grid(row=0, column=2, padx=2, pady=2)
+        self.image_path.trace_add('write', self.update_watched_path)
+        self.image_path.trace_add('write', self.describe_icon_source)
+        
         # 图片调整选项 - 使用Grid布局更紧凑
         adjust_frame = ttk.LabelFrame(scrollable_frame, text="图片调整", padding=5)
         adjust_frame.grid(row=1, column=0, sticky="nsew", padx=5, pady=2)
@@ -214,10 +334,9 @@ class AdvancedIconGenerator:
         
         # 效果
         ttk.Label(adjust_frame, text="效果:").grid(row=0, column=2, padx=5, pady=2, sticky=tk.W)
+        # 可直接输入效果链，例如 "棕褐色+像素化"
         self.effect_var = tk.StringVar()
-        effects = ["无", "模糊", "轮廓", "锐化", "浮雕", "边缘增强", "平滑", "细节增强", 
-                "反色", "黑白", "棕褐色", "油画", "像素化", "高斯模糊", "查找边缘"]
-        ttk.Combobox(adjust_frame, textvariable=self.effect_var, values=effects, width=12).grid(row=0, column=3, padx=5, pady=2)
+        ttk.Combobox(adjust_frame, textvariable=self.effect_var, values=effect_names(), width=12).grid(row=0, column=3, padx=5, pady=2)
         self.effect_var.trace_add('write', lambda *_: self.update_realtime_preview())
         
         # 压缩质量
@@ -226,6 +345,30 @@ class AdvancedIconGenerator:
         ttk.Scale(adjust_frame, from_=1, to=100, variable=self.quality,
                 orient=tk.HORIZONTAL, length=120).grid(row=1, column=3, padx=5, pady=2)
         
+        # ICO小尺寸条目的颜色深度和抖动方式
+        ttk.Label(adjust_frame, text="ICO位深:").grid(row=2, column=2, padx=5, pady=2, sticky=tk.W)
+        self.ico_depth = tk.StringVar(value=next(iter(ICO_DEPTH_POLICIES)))
+        ttk.Combobox(adjust_frame, textvariable=self.ico_depth, values=list(ICO_DEPTH_POLICIES),
+                     width=28, state="readonly").grid(row=2, column=3, padx=5, pady=2)
+        
+        ttk.Label(adjust_frame, text="抖动:").grid(row=3, column=2, padx=5, pady=2, sticky=tk.W)
+        self.ico_dither = tk.StringVar(value=next(iter(DITHER_NAMES)))
+        ttk.Combobox(adjust_frame, textvariable=self.ico_dither, values=list(DITHER_NAMES),
+                     width=16, state="readonly").grid(row=3, column=3, padx=5, pady=2)
+        
+        # 保存PNG和ICO时无损优化PNG数据
+        self.optimize_png = tk.BooleanVar(value=True)
+        ttk.Checkbutton(adjust_frame, text="无损优化PNG (体积更小，保存稍慢)",
+                        variable=self.optimize_png).grid(row=4, column=2, columnspan=2, padx=5, pady=2, sticky=tk.W)
+        
+        # JPG/WebP按目标画质 (SSIM) 自动选择压缩质量，代替固定的压缩质量
+        self.target_quality = tk.BooleanVar(value=False)
+        ttk.Checkbutton(adjust_frame, text="按目标SSIM压缩JPG/WebP:",
+                        variable=self.target_quality).grid(row=5, column=2, padx=5, pady=2, sticky=tk.W)
+        self.target_ssim = tk.DoubleVar(value=DEFAULT_TARGET_SSIM)
+        ttk.Spinbox(adjust_frame, from_=0.80, to=0.999, increment=0.005, format="%.3f",
+                    textvariable=self.target_ssim, width=8).grid(row=5, column=3, padx=5, pady=2, sticky=tk.W)
+        
         # 形状蒙版选项 - 更紧凑的布局
         shape_frame = ttk.LabelFrame(scrollable_frame, text="形状蒙版", padding=5)
         shape_frame.grid(row=1, column=1, sticky="nsew", padx=5, pady=2)
@@ -298,10 +441,75 @@ class AdvancedIconGenerator:
         # 实时预览绑定
         self.image_path.trace_add('write', self.check_image_input)
         
+    def toggle_source_watch(self):
+        """开关源文件监视"""
+        if not self.watch_source.get():
+            if self.source_watcher is not None:
+                self.source_watcher.stop()
+                self.source_watcher = None
+            self.status_bar["text"] = "已停止监视源文件"
+            return
+        
+        path = self.image_path.get()
+        if not path or not os.path.isfile(path):
+            messagebox.showerror("错误", "请选择有效的图片文件")
+            self.watch_source.set(False)
+            return
+        
+        self.source_watcher = Watcher([path], self.on_source_changed)
+        self.source_watcher.start()
+        self.status_bar["text"] = f"正在监视: {os.path.basename(path)}"
+    
+    def update_watched_path(self, *args):
+        """图片路径改变时改为监视新文件"""
+        path = self.image_path.get()
+        if self.source_watcher is not None and path and os.path.isfile(path):
+            self.source_watcher.set_paths([path])
+            self.status_bar["text"] = f"正在监视: {os.path.basename(path)}"
+    
+    def describe_icon_source(self, *args):
+        """选择ICO/ICNS作为源图时在状态栏列出其中的尺寸和位深 (只读取目录，不解码)"""
+        path = self.image_path.get()
+        if not path or not is_icon_file(path) or not os.path.isfile(path):
+            return
+        try:
+            fmt, entries = read_icon_directory(path)
+        except (OSError, ValueError) as e:
+            self.status_bar["text"] = f"无法读取图标文件: {e}"
+            return
+        self.status_bar["text"] = describe_entries(fmt, entries)
+    
+    def on_source_changed(self, paths, changed_at):
+        """源文件内容发生变化 (在监视线程中调用)"""
+        self.progress_queue.put(("watch_changed", paths, changed_at))
+    
+    def regenerate_watched_source(self, changed_at):
+        """监视到源文件变化后重新生成图片图标"""
+        if self._watch_changed_at is not None:
+            # 上一次自动生成尚未完成，完成后再生成一次
+            self._watch_rerun = changed_at
+            return
+        self._watch_changed_at = changed_at
+        self.start_image_preview_thread()
+    
+    def finish_watched_regeneration(self, ok):
+        """自动重新生成结束: 报告延迟，期间又有变化时再生成一次"""
+        if self._watch_changed_at is None:
+            return
+        latency = (time.monotonic() - self._watch_changed_at) * 1000
+        self._watch_changed_at = None
+        if ok:
+            COUNTERS.incr("watch.regenerated")
+            self.status_bar["text"] = f"源文件已变化，自动重新生成完成 (延迟 {latency:.0f} ms)"
+        
+        if self._watch_rerun is not None:
+            changed_at, self._watch_rerun = self._watch_rerun, None
+            self.regenerate_watched_source(changed_at)
+    
     def select_image(self):
         """打开文件对话框选择图片"""
         filetypes = [
-            ('图片文件', '*.png;*.jpg;*.jpeg;*.bmp;*.gif;*.svg'),
+            ('图片文件', '*.png;*.jpg;*.jpeg;*.bmp;*.gif;*.webp;*.svg;*.ico;*.icns'),
             ('所有文件', '*.*')
         ]
         filename = filedialog.askopenfilename(
@@ -485,10 +693,10 @@ class AdvancedIconGenerator:
             radius = self.radius.get()
             canvas.create_round_rectangle(5, 5, w-5, h-5, radius=radius, outline='black', width=2, fill='#e0e0e0')
         elif shape == "星形":
-            points = self.calculate_star_points(5, w//2, h//2, w//2-5, w//4)
+            points = calculate_star_points(5, w//2, h//2, w//2-5, w//4)
             canvas.create_polygon(points, outline='black', width=2, fill='#e0e0e0')
         elif shape == "心形":
-            points = self.calculate_heart_points(w//2, h//2, w//2-5)
+            points = calculate_heart_points(w//2, h//2, w//2-5)
             canvas.create_polygon(points, outline='black', width=2, fill='#e0e0e0', smooth=True)
         elif shape == "三角形":
             points = [w//2, 5, w-5, h-5, 5, h-5]
@@ -496,29 +704,6 @@ class AdvancedIconGenerator:
         else:  # 方形
             canvas.create_rectangle(5, 5, w-5, h-5, outline='black', width=2, fill='#e0e0e0')
     
-    def calculate_star_points(self, spikes, cx, cy, outer_radius, inner_radius):
-        """计算星形点坐标"""
-        points = []
-        step = 2 * np.pi / spikes
-        rot = np.pi / 2 * 3
-        
-        for i in range(spikes * 2):
-            r = outer_radius if i % 2 == 0 else inner_radius
-            x = cx + np.cos(i * step + rot) * r
-            y = cy + np.sin(i * step + rot) * r
-            points.extend([x, y])
-        
-        return points
-    
-    def calculate_heart_points(self, cx, cy, size):
-        """计算心形点坐标"""
-        points = []
-        for t in np.linspace(0, 2*np.pi, 30):
-            x = 16 * np.sin(t)**3
-            y = 13 * np.cos(t) - 5 * np.cos(2*t) - 2 * np.cos(3*t) - np.cos(4*t)
-            points.extend([cx + x*size/16, cy - y*size/16])
-        return points
-    
     def setup_text_tab(self):
         """设置文字转图标标签页"""
         container = ttk.Frame(self.text_tab)
@@ -573,9 +758,9 @@ class AdvancedIconGenerator:
         except:
             fonts = ["微软雅黑", "Arial", "Times New Roman", "Courier New"]
 
-        font_combo = ttk.Combobox(frame, textvariable=self.font_family, values=fonts, width=15)
-        font_combo.grid(row=0, column=1, padx=2)
-        font_combo.bind("<<ComboboxSelected>>", lambda e: self.update_realtime_preview())
+        self.font_combo = ttk.Combobox(frame, textvariable=self.font_family, values=fonts, width=15)
+        self.font_combo.grid(row=0, column=1, padx=2)
+        self.font_combo.bind("<<ComboboxSelected>>", lambda e: self.update_realtime_preview())
 
         # 字体大小
         ttk.Label(frame, text="大小:").grid(row=0, column=2, padx=2, sticky=tk.W)
@@ -726,6 +911,11 @@ class AdvancedIconGenerator:
         ttk.Scale(frame, from_=0.0, to=1.0, variable=self.svg_alpha,
                  orient=tk.HORIZONTAL, length=120).grid(row=1, column=3, padx=2)
         
+        # 光栅化之前精简文档 (删除元数据和未使用的定义、展开分组、舍入坐标)
+        self.svg_optimize = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="光栅化前精简SVG (设计工具导出的文件渲染更快)",
+                        variable=self.svg_optimize).grid(row=2, column=0, columnspan=4, padx=2, sticky=tk.W)
+        
         # 生成按钮
         self.gen_svg_preview_btn = ttk.Button(container, text="生成预览", command=self.start_svg_preview_thread)
         self.gen_svg_preview_btn.pack(pady=10)
@@ -901,9 +1091,9 @@ class AdvancedIconGenerator:
         except:
             fonts = ["Arial Unicode MS", "Segoe UI Symbol", "Symbola", "Noto Sans"]
             
-        font_combo = ttk.Combobox(frame, textvariable=self.unicode_font_family, values=fonts, width=15)
-        font_combo.grid(row=0, column=1, padx=2)
-        font_combo.bind("<<ComboboxSelected>>", lambda e: self.update_realtime_preview())
+        self.unicode_font_combo = ttk.Combobox(frame, textvariable=self.unicode_font_family, values=fonts, width=15)
+        self.unicode_font_combo.grid(row=0, column=1, padx=2)
+        self.unicode_font_combo.bind("<<ComboboxSelected>>", lambda e: self.update_realtime_preview())
         
         # 字体大小
         ttk.Label(frame, text="大小:").grid(row=0, column=2, padx=2, sticky=tk.W)
@@ -1136,6 +1326,15 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         self.realtime_preview = tk.Canvas(control_frame, width=60, height=60, bg='white')
         self.realtime_preview.pack(side=tk.LEFT, padx=5)
         
+        # 实时预览状态: 每种预览尺寸一个常驻PhotoImage，画布上只保留一个图像项
+        self._realtime_photos = {}
+        self._realtime_item = None
+        self._realtime_after_id = None
+        self._realtime_last_frame = 0.0
+        self._realtime_source = None
+        self._realtime_chart_busy = False
+        self._realtime_chart_pending = None
+        
         # 保存控件
         self.save_btn = ttk.Button(control_frame, text="保存图标", command=self.save_icon, state=tk.DISABLED)
         self.save_btn.pack(side=tk.LEFT, padx=5)
@@ -1146,8 +1345,9 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         # 输出格式选择
         ttk.Label(control_frame, text="输出格式:").pack(side=tk.LEFT, padx=(10, 2))
         self.output_format = tk.StringVar(value="ICO (多尺寸)")
-        formats = ["ICO (多尺寸)", "PNG", "JPG", "WebP"]
-        ttk.Combobox(control_frame, textvariable=self.output_format, values=formats, width=12).pack(side=tk.LEFT)
+        formats = ["ICO (多尺寸)", "PNG", "JPG", "WebP", "图集 (PNG+JSON+CSS)",
+                   "动画 WebP", "动画 PNG (APNG)", "动画 GIF", "动画光标 (ANI)"]
+        ttk.Combobox(control_frame, textvariable=self.output_format, values=formats, width=18).pack(side=tk.LEFT)
         
         # 尺寸显示
         self.sizes_label = ttk.Label(control_frame, text="包含尺寸: 无")
@@ -1229,221 +1429,64 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         )
         thread.start()
     
+    def image_settings(self):
+        """读取图片标签页的设置快照 (处理线程只使用快照，不再访问Tk变量)"""
+        size_settings = {}
+        if self.customize_sizes.get():
+            size_settings = {
+                size: {name: var.get() for name, var in settings.items()}
+                for size, settings in self.size_settings.items()
+            }
+        
+        return {
+            'brightness': self.brightness.get(),
+            'contrast': self.contrast.get(),
+            'saturation': self.saturation.get(),
+            'alpha': self.alpha.get(),
+            'effect': self.effect_var.get(),
+            'shape': self.shape_var.get(),
+            'radius': self.radius.get(),
+            'size_settings': size_settings,
+        }
+    
     def generate_image_preview(self, sizes):
         """生成图片预览 (在后台线程中运行)"""
         try:
-            # 加载原始图片
-            img = Image.open(self.image_path.get())
-            
-            # 应用全局调整
-            if self.brightness.get() != 1.0 or self.contrast.get() != 1.0 or self.saturation.get() != 1.0:
-                if self.brightness.get() != 1.0:
-                    enhancer = ImageEnhance.Brightness(img)
-                    img = enhancer.enhance(self.brightness.get())
-                if self.contrast.get() != 1.0:
-                    enhancer = ImageEnhance.Contrast(img)
-                    img = enhancer.enhance(self.contrast.get())
-                if self.saturation.get() != 1.0:
-                    enhancer = ImageEnhance.Color(img)
-                    img = enhancer.enhance(self.saturation.get())
-            
-            # 应用效果
-            effect = self.effect_var.get()
-            if effect == "模糊":
-                img = img.filter(ImageFilter.BLUR)
-            elif effect == "轮廓":
-                img = img.filter(ImageFilter.CONTOUR)
-            elif effect == "锐化":
-                img = img.filter(ImageFilter.SHARPEN)
-            elif effect == "浮雕":
-                img = img.filter(ImageFilter.EMBOSS)
-            elif effect == "边缘增强":
-                img = img.filter(ImageFilter.EDGE_ENHANCE)
-            elif effect == "平滑":
-                img = img.filter(ImageFilter.SMOOTH)
-            elif effect == "细节增强":
-                img = img.filter(ImageFilter.DETAIL)
-            elif effect == "反色":
-                img = ImageOps.invert(img)
-            elif effect == "黑白":
-                img = img.convert("L")
-            elif effect == "棕褐色":
-                img = self.apply_sepia(img)
-            elif effect == "油画":
-                img = self.apply_oil_painting(img)
-            elif effect == "像素化":
-                img = self.apply_pixelate(img)
-            elif effect == "高斯模糊":
-                img = img.filter(ImageFilter.GaussianBlur(radius=2))
-            elif effect == "查找边缘":
-                img = img.filter(ImageFilter.FIND_EDGES)
-            
-            # 生成图标
-            icons = []
-            for i, size in enumerate(sizes):
-                # 应用尺寸特定的调整
-                if self.customize_sizes.get() and size in self.size_settings:
-                    settings = self.size_settings[size]
-                    temp_img = img.copy()
-                    
-                    if settings['brightness'].get() != 1.0:
-                        enhancer = ImageEnhance.Brightness(temp_img)
-                        temp_img = enhancer.enhance(settings['brightness'].get())
-                    
-                    if settings['contrast'].get() != 1.0:
-                        enhancer = ImageEnhance.Contrast(temp_img)
-                        temp_img = enhancer.enhance(settings['contrast'].get())
-                    
-                    if settings['saturation'].get() != 1.0:
-                        enhancer = ImageEnhance.Color(temp_img)
-                        temp_img = enhancer.enhance(settings['saturation'].get())
-                    
-                    if settings['alpha'].get() < 1.0:
-                        temp_img = self.apply_alpha(temp_img, settings['alpha'].get())
-                    
-                    icon = temp_img.resize((size, size), Image.Resampling.LANCZOS)
-                else:
-                    # 应用全局透明度
-                    if self.alpha.get() < 1.0:
-                        temp_img = self.apply_alpha(img, self.alpha.get())
-                        icon = temp_img.resize((size, size), Image.Resampling.LANCZOS)
-                    else:
-                        icon = img.resize((size, size), Image.Resampling.LANCZOS)
-                
-                # 应用形状蒙版
-                icon = self.apply_shape_mask(icon)
-                
-                icons.append(icon)
-                
-                # 更新进度
-                self.progress_queue.put(i + 1)
-            
-            self.current_icon = icons
-            
-            # 完成处理
-            self.progress_queue.put("done")
+            spec = {
+                "type": "image",
+                "source": self.image_path.get(),
+                "sizes": sizes,
+                "settings": self.image_settings(),
+            }
+            self.render_preview(spec, "图片预览")
             
         except Exception as e:
             self.progress_queue.put(("error", str(e)))
     
-    def apply_sepia(self, img):
-        """应用棕褐色效果"""
-        width, height = img.size
-        pixels = img.load()
-        
-        for py in range(height):
-            for px in range(width):
-                r, g, b = img.getpixel((px, py))[:3]
-                
-                tr = int(0.393 * r + 0.769 * g + 0.189 * b)
-                tg = int(0.349 * r + 0.686 * g + 0.168 * b)
-                tb = int(0.272 * r + 0.534 * g + 0.131 * b)
-                
-                pixels[px, py] = (
-                    min(255, tr),
-                    min(255, tg),
-                    min(255, tb)
-                )
-        
-        return img
+    def render_preview(self, spec, name):
+        """渲染预览并统计任务的内存 (在后台线程中调用)，完成后在状态栏显示峰值"""
+        with MEMORY.job(name, type=spec["type"]) as job:
+            self.current_icon = render_icon_set(spec, progress=self.report_progress)
+        self.finish_preview(job)
     
-    def apply_oil_painting(self, img, brush_size=3, roughness=30):
-        """应用油画效果"""
-        img = img.convert("RGB")
-        width, height = img.size
-        pixels = img.load()
-        
-        for y in range(height):
-            for x in range(width):
-                # 获取画笔区域内的像素
-                x1 = max(0, x - brush_size)
-                y1 = max(0, y - brush_size)
-                x2 = min(width, x + brush_size + 1)
-                y2 = min(height, y + brush_size + 1)
-                
-                # 统计颜色出现频率
-                color_counts = {}
-                for i in range(x1, x2):
-                    for j in range(y1, y2):
-                        r, g, b = pixels[i, j]
-                        # 量化颜色以减少颜色数量
-                        r = r // roughness * roughness
-                        g = g // roughness * roughness
-                        b = b // roughness * roughness
-                        color = (r, g, b)
-                        color_counts[color] = color_counts.get(color, 0) + 1
-                
-                # 找到出现频率最高的颜色
-                if color_counts:
-                    most_common = max(color_counts.items(), key=lambda x: x[1])[0]
-                    pixels[x, y] = most_common
-        
-        return img
+    def finish_preview(self, job):
+        """通知界面预览已生成，随后附上内存统计"""
+        self.progress_queue.put("done")
+        summary = job.summary()
+        if summary:
+            self.progress_queue.put(("memory", summary))
     
-    def apply_pixelate(self, img, pixel_size=8):
-        """应用像素化效果"""
-        width, height = img.size
-        
-        # 缩小图像
-        small = img.resize(
-            (width // pixel_size, height // pixel_size),
-            resample=Image.Resampling.NEAREST
-        )
-        
-        # 放大回原始尺寸
-        result = small.resize(
-            (width, height),
-            resample=Image.Resampling.NEAREST
-        )
-        
-        return result
+    def report_progress(self, done, total):
+        """渲染进度回调 (在后台线程中调用)"""
+        self.progress_queue.put(("progress", done, total))
     
-    def apply_alpha(self, img, alpha):
-        """应用透明度到图像"""
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        
-        # 创建一个新的alpha通道
-        alpha_channel = img.split()[3]
-        alpha_channel = ImageEnhance.Brightness(alpha_channel).enhance(alpha)
-        
-        # 合并回图像
-        r, g, b, _ = img.split()
-        img = Image.merge('RGBA', (r, g, b, alpha_channel))
-        
-        return img
-    
-    def apply_shape_mask(self, img):
-        """应用形状蒙版到图像"""
-        shape = self.shape_var.get()
-        if shape == "方形":
-            return img
-        
-        # 创建蒙版
-        mask = Image.new('L', img.size, 0)
-        draw = ImageDraw.Draw(mask)
-        
-        if shape == "圆形":
-            draw.ellipse((0, 0, img.size[0], img.size[1]), fill=255)
-        elif shape == "圆角矩形":
+    def apply_shape_mask(self, img, shape=None, radius=None):
+        """应用形状蒙版到图像 (未指定形状和半径时使用当前设置)"""
+        if shape is None:
+            shape = self.shape_var.get()
+        if radius is None:
             radius = self.radius.get()
-            draw.rounded_rectangle((0, 0, img.size[0], img.size[1]), radius=radius, fill=255)
-        elif shape == "星形":
-            points = self.calculate_star_points(5, img.size[0]//2, img.size[1]//2, img.size[0]//2-5, img.size[0]//4)
-            draw.polygon(points, fill=255)
-        elif shape == "心形":
-            points = self.calculate_heart_points(img.size[0]//2, img.size[1]//2, img.size[0]//2-5)
-            draw.polygon(points, fill=255)
-        elif shape == "三角形":
-            points = [img.size[0]//2, 5, img.size[0]-5, img.size[1]-5, 5, img.size[1]-5]
-            draw.polygon(points, fill=255)
-        
-        # 应用蒙版
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-        
-        img.putalpha(mask)
-        return img
+        return icon_render.apply_shape_mask(img, shape, radius)
     
     def start_text_preview_thread(self):
         """启动文字预览线程"""
@@ -1471,65 +1514,27 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         )
         thread.start()
     
+    def text_settings(self):
+        """读取文字标签页的设置快照 (形状蒙版使用图片标签页的设置)"""
+        return {
+            'font_family': self.font_family.get(),
+            'font_style': self.font_style.get(),
+            'font_size': self.font_size.get(),
+            'text_color': self.text_color.get(),
+            'bg_type': self.bg_type.get(),
+            'bg_color': self.bg_color.get(),
+            'bg_color2': self.bg_color2.get(),
+            'gradient_dir': self.gradient_dir.get(),
+            'bg_alpha': self.bg_alpha.get(),
+            'shape': self.shape_var.get(),
+            'radius': self.radius.get(),
+        }
+    
     def generate_text_preview(self, sizes):
         """生成文字预览 (在后台线程中运行)"""
         try:
-            text = self.text_var.get()
-            icons = []
-            
-            for i, size in enumerate(sizes):
-                # 创建背景
-                if self.bg_type.get() == "透明":
-                    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-                elif self.bg_type.get() == "渐变":
-                    img = self.create_gradient_image(size)
-                else:  # 纯色
-                    img = Image.new("RGB", (size, size), self.bg_color.get())
-                
-                # 应用背景透明度
-                if self.bg_alpha.get() < 1.0 and img.mode == 'RGBA':
-                    alpha = img.split()[3]
-                    alpha = ImageEnhance.Brightness(alpha).enhance(self.bg_alpha.get())
-                    r, g, b, _ = img.split()
-                    img = Image.merge('RGBA', (r, g, b, alpha))
-                
-                draw = ImageDraw.Draw(img)
-                
-                # 获取字体
-                try:
-                    font_size = int(self.font_size.get() * (size/256))
-                    font = ImageFont.truetype(self.font_family.get(), font_size)
-                except:
-                    font = ImageFont.load_default()
-                
-                # 计算文字位置
-                try:
-                    # 新版Pillow使用textbbox
-                    bbox = draw.textbbox((0, 0), text, font=font)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                except AttributeError:
-                    try:
-                        # 旧版使用textsize
-                        text_width, text_height = draw.textsize(text, font=font)
-                    except AttributeError:
-                        # 如果都不支持，使用字体对象的getsize
-                        text_width, text_height = font.getsize(text)
-                
-                position = ((size - text_width) // 2, (size - text_height) // 2)
-                
-                # 绘制文字
-                draw.text(position, text, fill=self.text_color.get(), font=font)
-                
-                # 应用形状蒙版
-                icon = self.apply_shape_mask(img)
-                icons.append(icon)
-                
-                # 更新进度
-                self.progress_queue.put(i + 1)
-            
-            self.current_icon = icons
-            self.progress_queue.put("done")
+            spec = {"type": "text", "text": self.text_var.get(), "sizes": sizes, "settings": self.text_settings()}
+            self.render_preview(spec, "文字预览")
             
         except Exception as e:
             self.progress_queue.put(("error", str(e)))
@@ -1564,64 +1569,23 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
     def generate_svg_preview(self, svg_code, sizes):
         """生成SVG预览 (在后台线程中运行)"""
         try:
-            icons = []
-            
-            for i, size in enumerate(sizes):
-                try:
-                    # 方法1：使用cairosvg直接渲染
-                    output = BytesIO()
-                    cairosvg.svg2png(bytestring=svg_code.encode('utf-8'), 
-                                    write_to=output,
-                                    output_width=size,
-                                    output_height=size)
-                    img = Image.open(output)
-                except Exception as e:
-                    # 方法1失败，尝试方法2：使用reportlab的备用方法
-                    warnings.warn(f"使用cairosvg渲染失败，尝试备用方法: {str(e)}")
-                    try:
-                        # 将SVG代码保存到临时文件
-                        temp_svg = os.path.join(os.getcwd(), f"temp_{size}.svg")
-                        with open(temp_svg, "w", encoding="utf-8") as f:
-                            f.write(svg_code)
-                        
-                        # 转换为PNG
-                        drawing = svg2rlg(temp_svg)
-                        img = renderPM.drawToPIL(drawing, dpi=72 * size / drawing.width)
-                        os.remove(temp_svg)
-                    except Exception as e:
-                        # 方法2失败，尝试方法3：使用Pillow的简单SVG渲染
-                        warnings.warn(f"备用方法也失败，使用简单渲染: {str(e)}")
-                        img = Image.new("RGBA", (size, size), (255, 255, 255, 0))
-                        draw = ImageDraw.Draw(img)
-                        draw.text((10, 10), "SVG预览", fill="black")
-                        # 尝试简单解析SVG中的矩形和圆形
-                        try:
-                            if "<rect" in svg_code:
-                                draw.rectangle([10, 30, size-10, size-10], outline="red")
-                            if "<circle" in svg_code:
-                                draw.ellipse([10, 30, size-10, size-10], outline="blue")
-                        except:
-                            pass
-                
-                # 添加背景
-                if self.svg_bg_color.get() != "#FFFFFF" or self.svg_alpha.get() < 1.0:
-                    bg = Image.new("RGBA", img.size, self.svg_bg_color.get())
-                    if self.svg_alpha.get() < 1.0:
-                        alpha = int(255 * self.svg_alpha.get())
-                        bg.putalpha(alpha)
-                    img = Image.alpha_composite(bg, img.convert("RGBA"))
-                
-                icons.append(img)
-                # 更新进度
-                self.progress_queue.put(i + 1)
-            
-            self.current_icon = icons
-            self.progress_queue.put("done")
+            spec = {
+                "type": "svg",
+                "svg": svg_code,
+                "sizes": sizes,
+                "bg_color": self.svg_bg_color.get(),
+                "alpha": self.svg_alpha.get(),
+                "optimize_svg": self.svg_optimize.get(),
+            }
+            self.render_preview(spec, "SVG预览")
+            if spec["optimize_svg"]:
+                # 精简结果已缓存，这里只取统计显示在状态栏
+                from svg_optimize import optimize_svg
+                
+                self.progress_queue.put(("svg_optimized", optimize_svg(svg_code)[1]))
             
         except Exception as e:
             self.progress_queue.put(("error", str(e)))
-
-
     
     def start_emoji_preview_thread(self):
         """启动Emoji预览线程"""
@@ -1656,64 +1620,16 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
             self.progress_queue.put(("error", "需要安装emoji模块才能使用此功能"))
             return
         try:
-            icons = []
-            
-            for i, size in enumerate(sizes):
-                # 创建背景
-                if self.emoji_bg_color.get() == "透明":
-                    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-                else:
-                    img = Image.new("RGB", (size, size), self.emoji_bg_color.get())
-                
-                # 应用背景透明度
-                if self.emoji_alpha.get() < 1.0 and img.mode == 'RGBA':
-                    alpha = img.split()[3]
-                    alpha = ImageEnhance.Brightness(alpha).enhance(self.emoji_alpha.get())
-                    r, g, b, _ = img.split()
-                    img = Image.merge('RGBA', (r, g, b, alpha))
-                
-                draw = ImageDraw.Draw(img)
-                
-                # 获取字体
-                try:
-                    font_size = int(size * 0.8)  # Emoji通常占据大部分空间
-                    font = ImageFont.truetype("seguiemj.ttf", font_size)  # Windows Emoji字体
-                except:
-                    try:
-                        font = ImageFont.truetype("Apple Color Emoji.ttf", font_size)  # macOS
-                    except:
-                        try:
-                            font = ImageFont.truetype("NotoColorEmoji.ttf", font_size)  # Linux
-                        except:
-                            font = ImageFont.load_default()
-                
-                # 计算文字位置
-                try:
-                    bbox = draw.textbbox((0, 0), emoji_char, font=font)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                except AttributeError:
-                    try:
-                        text_width, text_height = draw.textsize(emoji_char, font=font)
-                    except AttributeError:
-                        text_width, text_height = font.getsize(emoji_char)
-                
-                position = ((size - text_width) // 2, (size - text_height) // 2)
-                
-                # 绘制Emoji
-                draw.text(position, emoji_char, font=font, embedded_color=True)
-                
-                icons.append(img)
-                
-                # 更新进度
-                self.progress_queue.put(i + 1)
-            
-            self.current_icon = icons
-            self.progress_queue.put("done")
+            spec = {"type": "emoji", "text": emoji_char, "sizes": sizes, "settings": self.emoji_settings()}
+            self.render_preview(spec, "Emoji预览")
             
         except Exception as e:
             self.progress_queue.put(("error", str(e)))
     
+    def emoji_settings(self):
+        """读取Emoji标签页的设置快照"""
+        return {'bg_color': self.emoji_bg_color.get(), 'alpha': self.emoji_alpha.get()}
+    
     def start_unicode_preview_thread(self):
         """启动Unicode符号预览线程"""
         unicode_char = self.unicode_var.get()
@@ -1741,57 +1657,20 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         )
         thread.start()
     
+    def unicode_settings(self):
+        """读取Unicode标签页的设置快照"""
+        return {
+            'font_family': self.unicode_font_family.get(),
+            'font_color': self.unicode_font_color.get(),
+            'bg_color': self.unicode_bg_color.get(),
+            'alpha': self.unicode_alpha.get(),
+        }
+    
     def generate_unicode_preview(self, unicode_char, sizes):
         """生成Unicode符号预览 (在后台线程中运行)"""
         try:
-            icons = []
-            
-            for i, size in enumerate(sizes):
-                # 创建背景
-                if self.unicode_bg_color.get() == "透明":
-                    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-                else:
-                    img = Image.new("RGB", (size, size), self.unicode_bg_color.get())
-                
-                # 应用背景透明度
-                if self.unicode_alpha.get() < 1.0 and img.mode == 'RGBA':
-                    alpha = img.split()[3]
-                    alpha = ImageEnhance.Brightness(alpha).enhance(self.unicode_alpha.get())
-                    r, g, b, _ = img.split()
-                    img = Image.merge('RGBA', (r, g, b, alpha))
-                
-                draw = ImageDraw.Draw(img)
-                
-                # 获取字体
-                try:
-                    font_size = int(size * 0.8)
-                    font = ImageFont.truetype(self.unicode_font_family.get(), font_size)
-                except:
-                    font = ImageFont.load_default()
-                
-                # 计算文字位置
-                try:
-                    bbox = draw.textbbox((0, 0), unicode_char, font=font)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                except AttributeError:
-                    try:
-                        text_width, text_height = draw.textsize(unicode_char, font=font)
-                    except AttributeError:
-                        text_width, text_height = font.getsize(unicode_char)
-                
-                position = ((size - text_width) // 2, (size - text_height) // 2)
-                
-                # 绘制Unicode符号
-                draw.text(position, unicode_char, fill=self.unicode_font_color.get(), font=font)
-                
-                icons.append(img)
-                
-                # 更新进度
-                self.progress_queue.put(i + 1)
-            
-            self.current_icon = icons
-            self.progress_queue.put("done")
+            spec = {"type": "unicode", "text": unicode_char, "sizes": sizes, "settings": self.unicode_settings()}
+            self.render_preview(spec, "Unicode预览")
             
         except Exception as e:
             self.progress_queue.put(("error", str(e)))
@@ -1826,102 +1705,12 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
     def generate_css_preview(self, css_code, sizes):
         """生成CSS样式预览 (在后台线程中运行)"""
         try:
-            icons = []
-            
-            # 解析CSS
-            styles = self.parse_css(css_code)
-            
-            for i, size in enumerate(sizes):
-                # 创建图像
-                img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-                draw = ImageDraw.Draw(img)
-                
-                # 应用背景颜色或渐变
-                if "background-color" in styles:
-                    bg_color = styles["background-color"]
-                    draw.rectangle([0, 0, size, size], fill=bg_color)
-                elif "background" in styles and "gradient" in styles["background"]:
-                    # 简单处理线性渐变
-                    colors = re.findall(r"rgb\((\d+),\s*(\d+),\s*(\d+)\)", styles["background"])
-                    if len(colors) >= 2:
-                        color1 = tuple(map(int, colors[0]))
-                        color2 = tuple(map(int, colors[1]))
-                        
-                        if "to right" in styles["background"]:
-                            # 水平渐变
-                            for x in range(size):
-                                ratio = x / size
-                                r = int(color1[0] + (color2[0] - color1[0]) * ratio)
-                                g = int(color1[1] + (color2[1] - color1[1]) * ratio)
-                                b = int(color1[2] + (color2[2] - color1[2]) * ratio)
-                                draw.line([(x, 0), (x, size)], fill=(r, g, b))
-                        else:
-                            # 垂直渐变
-                            for y in range(size):
-                                ratio = y / size
-                                r = int(color1[0] + (color2[0] - color1[0]) * ratio)
-                                g = int(color1[1] + (color2[1] - color1[1]) * ratio)
-                                b = int(color1[2] + (color2[2] - color1[2]) * ratio)
-                                draw.line([(0, y), (size, y)], fill=(r, g, b))
-                
-                # 应用边框
-                if "border" in styles:
-                    border_parts = styles["border"].split()
-                    if len(border_parts) >= 3:
-                        border_width = int(border_parts[0].replace("px", ""))
-                        border_style = border_parts[1]
-                        border_color = border_parts[2]
-                        
-                        if border_style != "none":
-                            draw.rectangle([0, 0, size-1, size-1], outline=border_color, width=border_width)
-                
-                # 应用圆角
-                if "border-radius" in styles:
-                    radius = int(styles["border-radius"].replace("px", "").replace("%", ""))
-                    if "%" in styles["border-radius"]:
-                        radius = int(size * radius / 100)
-                    
-                    # 创建圆角蒙版
-                    mask = Image.new("L", (size, size), 0)
-                    mask_draw = ImageDraw.Draw(mask)
-                    mask_draw.rounded_rectangle([0, 0, size, size], radius=radius, fill=255)
-                    
-                    # 应用蒙版
-                    img.putalpha(mask)
-                
-                icons.append(img)
-                
-                # 更新进度
-                self.progress_queue.put(i + 1)
-            
-            self.current_icon = icons
-            self.progress_queue.put("done")
+            spec = {"type": "css", "css": css_code, "sizes": sizes}
+            self.render_preview(spec, "CSS预览")
             
         except Exception as e:
             self.progress_queue.put(("error", str(e)))
     
-    #def parse_css(self, css_code):
-    #    """解析CSS代码为字典"""
-    #    styles = {}
-    #    sheet = cssutils.parseString(css_code)
-    #    
-    #    for rule in sheet:
-    #        if rule.type == rule.STYLE_RULE:
-    #            for property in rule.style:
-    #                styles[property.name] = property.value
-    #    
-    #    return styles
-
-    def parse_css(self, css_code):
-        """简单的CSS属性解析器"""
-        styles = {}
-        for line in css_code.split(';'):
-            line = line.strip()
-            if ':' in line:
-                prop, value = line.split(':', 1)
-                styles[prop.strip()] = value.strip()
-        return styles
-    
     def start_matplotlib_preview_thread(self):
         """启动Matplotlib预览线程"""
         code = self.matplotlib_data.get("1.0", tk.END).strip()
@@ -1952,115 +1741,23 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
     def generate_matplotlib_preview(self, code, sizes):
         """生成Matplotlib预览 (在后台线程中运行)"""
         try:
-            icons = []
-            
-            # 准备绘图环境
-            plt.style.use('ggplot')
-            plt.rcParams['axes.facecolor'] = self.matplotlib_bg_color.get()
-            
-            # 执行用户代码
-            local_vars = {}
-            exec(code, globals(), local_vars)
-            
-            # 获取数据
-            x = local_vars.get('x', [1, 2, 3, 4, 5])
-            y = local_vars.get('y', [2, 3, 5, 7, 11])
-            y1 = local_vars.get('y1', None)
-            y2 = local_vars.get('y2', None)
-            
-            for i, size in enumerate(sizes):
-                # 创建图表
-                fig, ax = plt.subplots(figsize=(size/100, size/100), dpi=100)
-                
-                # 根据类型绘制图表
-                chart_type = self.matplotlib_type.get()
-                if chart_type == "折线图":
-                    ax.plot(x, y, marker='o')
-                    if y1 is not None:
-                        ax.plot(x, y1, marker='o')
-                elif chart_type == "柱状图":
-                    ax.bar(x, y)
-                    if y1 is not None:
-                        ax.bar(x, y1, bottom=y)
-                elif chart_type == "饼图":
-                    ax.pie(y, labels=x, autopct='%1.1f%%')
-                elif chart_type == "散点图":
-                    ax.scatter(x, y)
-                elif chart_type == "雷达图":
-                    theta = np.linspace(0, 2*np.pi, len(x), endpoint=False)
-                    ax.plot(theta, y)
-                    ax.fill(theta, y, alpha=0.25)
-                    ax.set_xticks(theta)
-                    ax.set_xticklabels(x)
-                elif chart_type == "面积图":
-                    ax.stackplot(x, y)
-                
-                # 调整图表
-                ax.set_facecolor(self.matplotlib_bg_color.get())
-                fig.patch.set_alpha(self.matplotlib_alpha.get())
-                
-                # 转换为PIL图像
-                canvas = FigureCanvasAgg(fig)
-                canvas.draw()
-                
-                buf = canvas.buffer_rgba()
-                img = Image.fromarray(np.asarray(buf))
-                
-                icons.append(img)
-                
-                # 关闭图表释放内存
-                plt.close(fig)
-                
-                # 更新进度
-                self.progress_queue.put(i + 1)
-            
-            self.current_icon = icons
-            self.progress_queue.put("done")
+            with MEMORY.job("图表预览", type="matplotlib") as job:
+                # 用户代码在沙箱子进程中执行，超时或超出内存上限时会被终止 (子进程的内存峰值记为一个阶段)
+                images = MPL_SANDBOX.render(
+                    code,
+                    self.matplotlib_type.get(),
+                    sizes,
+                    bg_color=self.matplotlib_bg_color.get(),
+                    alpha=self.matplotlib_alpha.get(),
+                    progress=self.progress_queue.put
+                )
+                with memory_stage("存储"):
+                    self.current_icon = IconSet(images)
+            self.finish_preview(job)
             
         except Exception as e:
             self.progress_queue.put(("error", str(e)))
     
-    def create_gradient_image(self, size):
-        """创建渐变背景图像"""
-        img = Image.new("RGB", (size, size))
-        draw = ImageDraw.Draw(img)
-        
-        color1 = self.bg_color.get()
-        color2 = self.bg_color2.get()
-        
-        def hex_to_rgb(hex_color):
-            hex_color = hex_color.lstrip('#')
-            return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        
-        r1, g1, b1 = hex_to_rgb(color1)
-        r2, g2, b2 = hex_to_rgb(color2)
-        
-        direction = self.gradient_dir.get()
-        if direction == "水平":
-            for x in range(size):
-                ratio = x / size
-                r = int(r1 + (r2 - r1) * ratio)
-                g = int(g1 + (g2 - g1) * ratio)
-                b = int(b1 + (b2 - b1) * ratio)
-                draw.line([(x, 0), (x, size)], fill=(r, g, b))
-        elif direction == "垂直":
-            for y in range(size):
-                ratio = y / size
-                r = int(r1 + (r2 - r1) * ratio)
-                g = int(g1 + (g2 - g1) * ratio)
-                b = int(b1 + (b2 - b1) * ratio)
-                draw.line([(0, y), (size, y)], fill=(r, g, b))
-        else:  # 对角
-            for y in range(size):
-                for x in range(size):
-                    ratio = (x + y) / (size * 2)
-                    r = int(r1 + (r2 - r1) * ratio)
-                    g = int(g1 + (g2 - g1) * ratio)
-                    b = int(b1 + (b2 - b1) * ratio)
-                    draw.point((x, y), fill=(r, g, b))
-        
-        return img
-    
     def check_progress(self):
         """检查进度队列更新UI"""
         try:
@@ -2072,27 +1769,17 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
                     self.show_final_preview()
                     self.save_btn['state'] = tk.NORMAL
                     
-                    sizes = [str(img.size[0]) for img in self.current_icon]
+                    sizes = [str(width) for width, _ in self.current_icon.sizes]
                     self.sizes_label.config(text=f"包含尺寸: {', '.join(sizes)}")
                     
                     # 根据当前标签页启用相应的生成按钮
-                    current_tab = self.tab_control.index("current")
-                    if current_tab == 0:  # 图片标签页
-                        self.gen_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 1:  # 文字标签页
-                        self.gen_text_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 2:  # SVG标签页
-                        self.gen_svg_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 3:  # Emoji标签页
-                        self.gen_emoji_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 4:  # Unicode标签页
-                        self.gen_unicode_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 5:  # CSS标签页
-                        self.gen_css_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 6:  # Matplotlib标签页
-                        self.gen_matplotlib_preview_btn['state'] = tk.NORMAL
+                    self.enable_generate_button()
                     
-                    self.status_bar["text"] = "预览生成完成"
+                    if isinstance(self.current_icon, AnimatedIconSet):
+                        self.status_bar["text"] = f"预览生成完成 (动画，共 {len(self.current_icon.frames)} 帧)"
+                    else:
+                        self.status_bar["text"] = "预览生成完成"
+                    self.finish_watched_regeneration(True)
                 
                 elif isinstance(msg, tuple) and msg[0] == "error":
                     self.progress_bar.pack_forget()
@@ -2101,21 +1788,52 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
                     self.status_bar["text"] = f"错误: {msg[1]}"
                     
                     # 根据当前标签页启用相应的生成按钮
-                    current_tab = self.tab_control.index("current")
-                    if current_tab == 0:  # 图片标签页
-                        self.gen_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 1:  # 文字标签页
-                        self.gen_text_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 2:  # SVG标签页
-                        self.gen_svg_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 3:  # Emoji标签页
-                        self.gen_emoji_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 4:  # Unicode标签页
-                        self.gen_unicode_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 5:  # CSS标签页
-                        self.gen_css_preview_btn['state'] = tk.NORMAL
-                    elif current_tab == 6:  # Matplotlib标签页
-                        self.gen_matplotlib_preview_btn['state'] = tk.NORMAL
+                    self.enable_generate_button()
+                    self.finish_watched_regeneration(False)
+                
+                elif isinstance(msg, tuple) and msg[0] == "memory":
+                    self.status_bar["text"] += f"，{msg[1]}"
+                
+                elif isinstance(msg, tuple) and msg[0] == "svg_optimized":
+                    from svg_optimize import describe_stats
+                    
+                    self.status_bar["text"] += f"，{describe_stats(msg[1])}"
+                
+                elif isinstance(msg, tuple) and msg[0] == "watch_changed":
+                    self.regenerate_watched_source(msg[2])
+                
+                elif isinstance(msg, tuple) and msg[0] == "progress":
+                    self.progress_bar['maximum'] = msg[2]
+                    self.progress_bar['value'] = msg[1]
+                
+                elif isinstance(msg, tuple) and msg[0] == "save_progress":
+                    self.progress_bar['value'] = msg[1]
+                    self.status_bar["text"] = f"正在保存动画... ({msg[1]}/{self.progress_bar['maximum']})"
+                
+                elif isinstance(msg, tuple) and msg[0] == "saved":
+                    self.progress_bar.grid_remove()
+                    self.save_btn['state'] = tk.NORMAL
+                    self.status_bar["text"] = f"图标已保存到: {msg[1][0]}"
+                    messagebox.showinfo("成功", "图标已成功保存到:\n" + "\n".join(msg[1]))
+                
+                elif isinstance(msg, tuple) and msg[0] == "save_error":
+                    self.progress_bar.grid_remove()
+                    self.save_btn['state'] = tk.NORMAL
+                    messagebox.showerror("错误", f"保存图标时出错:\n{msg[1]}")
+                    self.status_bar["text"] = f"错误: {msg[1]}"
+                
+                elif isinstance(msg, tuple) and msg[0] == "realtime_chart":
+                    self._realtime_chart_busy = False
+                    if self._realtime_chart_pending is not None:
+                        # 运行期间代码又有变化，直接渲染最新的代码
+                        job, self._realtime_chart_pending = self._realtime_chart_pending, None
+                        self.request_realtime_chart(job)
+                    elif msg[1] is not None and self.tab_control.index("current") == 6:
+                        self.show_realtime_image(msg[1])
+                
+                elif isinstance(msg, tuple) and msg[0] == "fonts_ready":
+                    self.update_font_choices()
+                    self.status_bar["text"] = f"字体索引已就绪 (共 {msg[1]} 个字体)"
                 
                 else:  # 更新进度
                     self.progress_bar['value'] = msg
@@ -2127,23 +1845,74 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         self.root.after(100, self.check_progress)
     
     def update_realtime_preview(self, *args):
-        """更新实时预览小窗口"""
+        """请求更新实时预览小窗口 (按显示器刷新率合并高频请求)"""
         if not hasattr(self, 'realtime_preview'):
             return
         
-        # 清除旧预览
-        self.realtime_preview.delete("all")
+        if self._realtime_after_id is not None:
+            # 已有待绘制的帧，本次请求合并到该帧中
+            COUNTERS.incr("realtime_preview.coalesced")
+            return
+        
+        frame_interval = 1.0 / REALTIME_PREVIEW_FPS
+        delay = self._realtime_last_frame + frame_interval - time.perf_counter()
+        self._realtime_after_id = self.root.after(max(0, int(delay * 1000)), self.render_realtime_preview)
+    
+    def get_realtime_source(self, path):
+        """获取实时预览用的源图缩略图 (按路径和修改时间缓存)"""
+        key = (path, os.path.getmtime(path))
+        if self._realtime_source is None or self._realtime_source[0] != key:
+            if is_icon_file(path):
+                # ICO/ICNS只解码不小于预览尺寸的最小条目，缩放比例仍相对于生成时使用的最大条目
+                _, entries = read_icon_directory(path)
+                width = best_entry(entries).width
+                img = extract_entry(path, best_entry(entries, 80))
+            else:
+                img = check_image(open_image(path))
+                width = img.width
+            img.thumbnail((80, 80))
+            self._realtime_source = (key, img, img.width / width)
+        # 返回副本和缩略图相对原图的比例，部分效果会原地修改像素
+        return self._realtime_source[1].copy(), self._realtime_source[2]
+    
+    def show_realtime_image(self, img):
+        """将图像显示到实时预览画布，复用同尺寸的PhotoImage原地更新"""
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        
+        photo = self._realtime_photos.get(img.size)
+        if photo is None:
+            photo = ImageTk.PhotoImage('RGBA', img.size)
+            self._realtime_photos[img.size] = photo
+            COUNTERS.incr("realtime_preview.photoimage_alloc")
+        photo.paste(img)
+        
+        if self._realtime_item is None:
+            self._realtime_item = self.realtime_preview.create_image(40, 40, image=photo)
+        else:
+            self.realtime_preview.itemconfigure(self._realtime_item, image=photo, state=tk.NORMAL)
+    
+    def render_realtime_preview(self):
+        """绘制一帧实时预览"""
+        self._realtime_after_id = None
+        self._realtime_last_frame = time.perf_counter()
+        COUNTERS.incr("realtime_preview.frames")
+        
+        # 隐藏旧预览 (输入为空时保持空白)
+        if self._realtime_item is not None:
+            self.realtime_preview.itemconfigure(self._realtime_item, state=tk.HIDDEN)
         
         try:
             current_tab = self.tab_control.index("current")
+            if not self.is_tab_built(current_tab):
+                return
             
             if current_tab == 0:  # 图片标签页
                 if not self.image_path.get() or not os.path.isfile(self.image_path.get()):
                     return
                 
                 # 创建缩小的预览图
-                img = Image.open(self.image_path.get())
-                img.thumbnail((80, 80))
+                img, scale = self.get_realtime_source(self.image_path.get())
                 
                 # 应用调整
                 if self.brightness.get() != 1.0:
@@ -2159,38 +1928,10 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
                     img = enhancer.enhance(self.saturation.get())
                 
                 if self.alpha.get() < 1.0:
-                    img = self.apply_alpha(img, self.alpha.get())
+                    img = apply_alpha(img, self.alpha.get())
                 
-                # 应用效果
-                effect = self.effect_var.get()
-                if effect == "模糊":
-                    img = img.filter(ImageFilter.BLUR)
-                elif effect == "轮廓":
-                    img = img.filter(ImageFilter.CONTOUR)
-                elif effect == "锐化":
-                    img = img.filter(ImageFilter.SHARPEN)
-                elif effect == "浮雕":
-                    img = img.filter(ImageFilter.EMBOSS)
-                elif effect == "边缘增强":
-                    img = img.filter(ImageFilter.EDGE_ENHANCE)
-                elif effect == "平滑":
-                    img = img.filter(ImageFilter.SMOOTH)
-                elif effect == "细节增强":
-                    img = img.filter(ImageFilter.DETAIL)
-                elif effect == "反色":
-                    img = ImageOps.invert(img)
-                elif effect == "黑白":
-                    img = img.convert("L")
-                elif effect == "棕褐色":
-                    img = self.apply_sepia(img)
-                elif effect == "油画":
-                    img = self.apply_oil_painting(img)
-                elif effect == "像素化":
-                    img = self.apply_pixelate(img)
-                elif effect == "高斯模糊":
-                    img = img.filter(ImageFilter.GaussianBlur(radius=2))
-                elif effect == "查找边缘":
-                    img = img.filter(ImageFilter.FIND_EDGES)
+                # 应用效果 (依赖分辨率的效果按缩略图比例缩放参数，与生成结果的观感一致)
+                img = apply_effects(img, self.effect_var.get(), scale)
                 
                 # 应用形状蒙版
                 img = self.apply_shape_mask(img)
@@ -2200,309 +1941,84 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
                     return
                 
                 # 创建文字预览
-                size = 80
-                if self.bg_type.get() == "透明":
-                    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-                elif self.bg_type.get() == "渐变":
-                    img = self.create_gradient_image(size)
-                else:  # 纯色
-                    img = Image.new("RGB", (size, size), self.bg_color.get())
-                
-                # 应用背景透明度
-                if self.bg_alpha.get() < 1.0 and img.mode == 'RGBA':
-                    alpha = img.split()[3]
-                    alpha = ImageEnhance.Brightness(alpha).enhance(self.bg_alpha.get())
-                    r, g, b, _ = img.split()
-                    img = Image.merge('RGBA', (r, g, b, alpha))
-                
-                draw = ImageDraw.Draw(img)
-                
-                # 获取字体
-                try:
-                    font_size = int(self.font_size.get() * (size/256))
-                    font = ImageFont.truetype(self.font_family.get(), font_size)
-                except:
-                    font = ImageFont.load_default()
-                
-                # 计算文字位置
-                try:
-                    bbox = draw.textbbox((0, 0), self.text_var.get(), font=font)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                except AttributeError:
-                    try:
-                        text_width, text_height = draw.textsize(self.text_var.get(), font=font)
-                    except AttributeError:
-                        text_width, text_height = font.getsize(self.text_var.get())
-                
-                position = ((size - text_width) // 2, (size - text_height) // 2)
-                
-                # 绘制文字
-                draw.text(position, self.text_var.get(), fill=self.text_color.get(), font=font)
-                
-                # 应用形状蒙版
-                img = self.apply_shape_mask(img)
+                img = render_text(self.text_var.get(), 80, self.text_settings())
             
             elif current_tab == 2:  # SVG标签页
                 svg_code = self.svg_text.get("1.0", tk.END).strip()
                 if not svg_code:
                     return
                 
-                try:
-                    # 使用 cairosvg 直接渲染
-                    import cairosvg
-                    from io import BytesIO
-                    
-                    output = BytesIO()
-                    cairosvg.svg2png(
-                        bytestring=svg_code.encode('utf-8'),
-                        write_to=output,
-                        output_width=80,
-                        output_height=80
-                    )
-                    img = Image.open(output)
+                # 实时预览在界面线程中光栅化 (超出限制的文档直接拒绝)，结果按文档缓存
+                img = rasterize_svg(svg_code, [80], sandbox=False, optimize=self.svg_optimize.get())[0]
                 
-                    # 添加背景
-                    if self.svg_bg_color.get() != "#FFFFFF" or self.svg_alpha.get() < 1.0:
-                        bg = Image.new("RGBA", img.size, self.svg_bg_color.get())
-                        if self.svg_alpha.get() < 1.0:
-                            alpha = int(255 * self.svg_alpha.get())
-                            bg.putalpha(alpha)
-                        img = Image.alpha_composite(bg, img.convert("RGBA"))
-                except Exception as e:
-                    print(f"SVG渲染错误: {e}")
-                    # 渲染失败时显示错误提示
-                    img = Image.new("RGBA", (80, 80), (255, 255, 255, 0))
-                    draw = ImageDraw.Draw(img)
-                    draw.text((10, 10), "SVG渲染失败", fill="red")
+                # 添加背景 (修改背景色或透明度时不重新光栅化)
+                img = composite_background(img, self.svg_bg_color.get(), self.svg_alpha.get())
             
             elif current_tab == 3:  # Emoji标签页
                 emoji_char = self.emoji_var.get()
                 if not emoji_char:
                     return
                 
-                size = 80
-                if self.emoji_bg_color.get() == "透明":
-                    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-                else:
-                    img = Image.new("RGB", (size, size), self.emoji_bg_color.get())
-                
-                # 应用背景透明度
-                if self.emoji_alpha.get() < 1.0 and img.mode == 'RGBA':
-                    alpha = img.split()[3]
-                    alpha = ImageEnhance.Brightness(alpha).enhance(self.emoji_alpha.get())
-                    r, g, b, _ = img.split()
-                    img = Image.merge('RGBA', (r, g, b, alpha))
-                
-                draw = ImageDraw.Draw(img)
-                
-                # 获取字体
-                try:
-                    font_size = int(size * 0.8)
-                    font = ImageFont.truetype("seguiemj.ttf", font_size)
-                except:
-                    try:
-                        font = ImageFont.truetype("Apple Color Emoji.ttf", font_size)
-                    except:
-                        try:
-                            font = ImageFont.truetype("NotoColorEmoji.ttf", font_size)
-                        except:
-                            font = ImageFont.load_default()
-                
-                # 计算文字位置
-                try:
-                    bbox = draw.textbbox((0, 0), emoji_char, font=font)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                except AttributeError:
-                    try:
-                        text_width, text_height = draw.textsize(emoji_char, font=font)
-                    except AttributeError:
-                        text_width, text_height = font.getsize(emoji_char)
-                
-                position = ((size - text_width) // 2, (size - text_height) // 2)
-                
-                # 绘制Emoji
-                draw.text(position, emoji_char, font=font, embedded_color=True)
+                img = render_emoji(emoji_char, 80, self.emoji_settings())
             
             elif current_tab == 4:  # Unicode标签页
                 unicode_char = self.unicode_var.get()
                 if not unicode_char:
                     return
                 
-                size = 80
-                if self.unicode_bg_color.get() == "透明":
-                    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-                else:
-                    img = Image.new("RGB", (size, size), self.unicode_bg_color.get())
-                
-                # 应用背景透明度
-                if self.unicode_alpha.get() < 1.0 and img.mode == 'RGBA':
-                    alpha = img.split()[3]
-                    alpha = ImageEnhance.Brightness(alpha).enhance(self.unicode_alpha.get())
-                    r, g, b, _ = img.split()
-                    img = Image.merge('RGBA', (r, g, b, alpha))
-                
-                draw = ImageDraw.Draw(img)
-                
-                # 获取字体
-                try:
-                    font_size = int(size * 0.8)
-                    font = ImageFont.truetype(self.unicode_font_family.get(), font_size)
-                except:
-                    font = ImageFont.load_default()
-                
-                # 计算文字位置
-                try:
-                    bbox = draw.textbbox((0, 0), unicode_char, font=font)
-                    text_width = bbox[2] - bbox[0]
-                    text_height = bbox[3] - bbox[1]
-                except AttributeError:
-                    try:
-                        text_width, text_height = draw.textsize(unicode_char, font=font)
-                    except AttributeError:
-                        text_width, text_height = font.getsize(unicode_char)
-                
-                position = ((size - text_width) // 2, (size - text_height) // 2)
-                
-                # 绘制Unicode符号
-                draw.text(position, unicode_char, fill=self.unicode_font_color.get(), font=font)
+                img = render_unicode(unicode_char, 80, self.unicode_settings())
             
             elif current_tab == 5:  # CSS标签页
                 css_code = self.css_text.get("1.0", tk.END).strip()
                 if not css_code:
                     return
                 
-                size = 80
-                img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
-                draw = ImageDraw.Draw(img)
+                # 使用编译后的渲染计划 (按CSS文本缓存)
+                from css_engine import compile_css
                 
-                # 解析CSS
-                styles = self.parse_css(css_code)
-                
-                # 应用背景颜色或渐变
-                if "background-color" in styles:
-                    bg_color = styles["background-color"]
-                    draw.rectangle([0, 0, size, size], fill=bg_color)
-                elif "background" in styles and "gradient" in styles["background"]:
-                    # 简单处理线性渐变
-                    colors = re.findall(r"rgb\((\d+),\s*(\d+),\s*(\d+)\)", styles["background"])
-                    if len(colors) >= 2:
-                        color1 = tuple(map(int, colors[0]))
-                        color2 = tuple(map(int, colors[1]))
-                        
-                        if "to right" in styles["background"]:
-                            # 水平渐变
-                            for x in range(size):
-                                ratio = x / size
-                                r = int(color1[0] + (color2[0] - color1[0]) * ratio)
-                                g = int(color1[1] + (color2[1] - color1[1]) * ratio)
-                                b = int(color1[2] + (color2[2] - color1[2]) * ratio)
-                                draw.line([(x, 0), (x, size)], fill=(r, g, b))
-                        else:
-                            # 垂直渐变
-                            for y in range(size):
-                                ratio = y / size
-                                r = int(color1[0] + (color2[0] - color1[0]) * ratio)
-                                g = int(color1[1] + (color2[1] - color1[1]) * ratio)
-                                b = int(color1[2] + (color2[2] - color1[2]) * ratio)
-                                draw.line([(0, y), (size, y)], fill=(r, g, b))
-                
-                # 应用边框
-                if "border" in styles:
-                    border_parts = styles["border"].split()
-                    if len(border_parts) >= 3:
-                        border_width = int(border_parts[0].replace("px", ""))
-                        border_style = border_parts[1]
-                        border_color = border_parts[2]
-                        
-                        if border_style != "none":
-                            draw.rectangle([0, 0, size-1, size-1], outline=border_color, width=border_width)
-                
-                # 应用圆角
-                if "border-radius" in styles:
-                    radius = int(styles["border-radius"].replace("px", "").replace("%", ""))
-                    if "%" in styles["border-radius"]:
-                        radius = int(size * radius / 100)
-                    
-                    # 创建圆角蒙版
-                    mask = Image.new("L", (size, size), 0)
-                    mask_draw = ImageDraw.Draw(mask)
-                    mask_draw.rounded_rectangle([0, 0, size, size], radius=radius, fill=255)
-                    
-                    # 应用蒙版
-                    img.putalpha(mask)
+                img = compile_css(css_code).render(80)
             
             elif current_tab == 6:  # Matplotlib标签页
                 code = self.matplotlib_data.get("1.0", tk.END).strip()
                 if not code:
                     return
                 
-                size = 80
-                
-                # 准备绘图环境
-                plt.style.use('ggplot')
-                plt.rcParams['axes.facecolor'] = self.matplotlib_bg_color.get()
-                
-                # 执行用户代码
-                local_vars = {}
-                exec(code, globals(), local_vars)
-                
-                # 获取数据
-                x = local_vars.get('x', [1, 2, 3, 4, 5])
-                y = local_vars.get('y', [2, 3, 5, 7, 11])
-                y1 = local_vars.get('y1', None)
-                y2 = local_vars.get('y2', None)
-                
-                # 创建图表
-                fig, ax = plt.subplots(figsize=(size/100, size/100), dpi=100)
-                
-                # 根据类型绘制图表
-                chart_type = self.matplotlib_type.get()
-                if chart_type == "折线图":
-                    ax.plot(x, y, marker='o')
-                    if y1 is not None:
-                        ax.plot(x, y1, marker='o')
-                elif chart_type == "柱状图":
-                    ax.bar(x, y)
-                    if y1 is not None:
-                        ax.bar(x, y1, bottom=y)
-                elif chart_type == "饼图":
-                    ax.pie(y, labels=x, autopct='%1.1f%%')
-                elif chart_type == "散点图":
-                    ax.scatter(x, y)
-                elif chart_type == "雷达图":
-                    theta = np.linspace(0, 2*np.pi, len(x), endpoint=False)
-                    ax.plot(theta, y)
-                    ax.fill(theta, y, alpha=0.25)
-                    ax.set_xticks(theta)
-                    ax.set_xticklabels(x)
-                elif chart_type == "面积图":
-                    ax.stackplot(x, y)
-                
-                # 调整图表
-                ax.set_facecolor(self.matplotlib_bg_color.get())
-                fig.patch.set_alpha(self.matplotlib_alpha.get())
-                
-                # 转换为PIL图像
-                canvas = FigureCanvasAgg(fig)
-                canvas.draw()
-                
-                buf = canvas.buffer_rgba()
-                img = Image.fromarray(np.asarray(buf))
-                
-                # 关闭图表释放内存
-                plt.close(fig)
+                # 图表代码在沙箱子进程中执行，完成后经进度队列回到界面线程显示
+                self.request_realtime_chart((
+                    code,
+                    self.matplotlib_type.get(),
+                    self.matplotlib_bg_color.get(),
+                    self.matplotlib_alpha.get()
+                ))
+                return
             
             # 显示预览
-            from PIL import ImageTk
-            img_tk = ImageTk.PhotoImage(img)
-            self.realtime_preview.image = img_tk  # 保持引用
-            self.realtime_preview.create_image(40, 40, image=img_tk)
+            self.show_realtime_image(img)
             
         except Exception as e:
             print(f"实时预览错误: {e}")
     
+    def request_realtime_chart(self, job):
+        """提交实时预览图表任务，同一时间只运行一个，期间的请求只保留最新一个"""
+        if self._realtime_chart_busy:
+            self._realtime_chart_pending = job
+            return
+        
+        self._realtime_chart_busy = True
+        threading.Thread(target=self.render_realtime_chart, args=job, daemon=True).start()
+    
+    def render_realtime_chart(self, code, chart_type, bg_color, alpha):
+        """在沙箱中渲染实时预览图表 (在后台线程中运行)"""
+        img = None
+        try:
+            img = MPL_SANDBOX.render(code, chart_type, [80], bg_color=bg_color, alpha=alpha,
+                                     timeout=REALTIME_CHART_TIMEOUT)[0]
+        except Exception as e:
+            print(f"实时预览错误: {e}")
+        finally:
+            # 任何情况下都通知界面线程清除 _realtime_chart_busy，否则之后的图表实时预览不再更新
+            self.progress_queue.put(("realtime_chart", img))
+    
     def show_final_preview(self):
         """显示最终预览"""
         if not self.current_icon:
@@ -2518,7 +2034,7 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
             canvas_width = 700
         
         icon_count = len(self.current_icon)
-        max_icon_size = max(icon.size[0] for icon in self.current_icon)
+        max_icon_size = max(width for width, _ in self.current_icon.sizes)
         icons_per_row = max(1, min(icon_count, canvas_width // (max_icon_size + 20)))
         
         # 在画布上排列图标
@@ -2527,7 +2043,6 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         
         for i, icon in enumerate(self.current_icon):
             # 转换为PhotoImage
-            from PIL import ImageTk
             img_tk = ImageTk.PhotoImage(icon)
             self.icon_previews.append(img_tk)  # 保持引用
             
@@ -2563,7 +2078,12 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
             "ICO (多尺寸)": ("ico", ".ico"),
             "PNG": ("png", ".png"),
             "JPG": ("jpeg", ".jpg"),
-            "WebP": ("webp", ".webp")
+            "WebP": ("webp", ".webp"),
+            "图集 (PNG+JSON+CSS)": ("atlas", ".png"),
+            "动画 WebP": ("anim_webp", ".webp"),
+            "动画 PNG (APNG)": ("anim_apng", ".png"),
+            "动画 GIF": ("anim_gif", ".gif"),
+            "动画光标 (ANI)": ("anim_ani", ".ani")
         }
         
         format_name = self.output_format.get()
@@ -2574,6 +2094,10 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         
         format_type, ext = format_map[format_name]
         
+        if format_type.startswith("anim_") and not isinstance(self.current_icon, AnimatedIconSet):
+            messagebox.showerror("错误", "当前图标不是动画，请先用动画GIF/WebP图片生成预览")
+            return
+        
         filepath = filedialog.asksaveasfilename(
             title="保存图标文件",
             defaultextension=ext,
@@ -2583,18 +2107,51 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         if not filepath:
             return
         
+        if format_type.startswith("anim_"):
+            # 动画逐帧写出，帧数多时耗时较长，在后台线程中进行
+            self.start_animation_export(filepath, format_type[len("anim_"):])
+            return
+        
         try:
-            if format_type == "ico":
-                # 保存为ICO格式 (多尺寸)
-                self.current_icon[0].save(
-                    filepath,
-                    format="ICO",
-                    append_images=self.current_icon[1:],
-                    quality=self.quality.get()
-                )
+            if format_type == "atlas":
+                # 所有尺寸打包进一张图集，并输出同名的JSON和CSS坐标表
+                name = os.path.splitext(os.path.basename(filepath))[0]
+                export_atlas(icon_entries(self.current_icon, name), filepath, padding=2)
+            elif format_type == "ico":
+                # 保存为ICO格式 (多尺寸，32位条目直接写出已存储的PNG数据，小尺寸可按位深策略量化)
+                rules, palette_format = ICO_DEPTH_POLICIES[self.ico_depth.get()]
+                report = write_ico(self.current_icon, filepath,
+                                   depths=depths_for_sizes(rules, self.current_icon.sizes),
+                                   dither=DITHER_NAMES[self.ico_dither.get()],
+                                   palette_format=palette_format,
+                                   optimize=self.optimize_png.get())
+                if rules or self.optimize_png.get():
+                    summary = self.describe_ico_report(report)
+                    self.status_bar["text"] = f"图标已保存到: {filepath} ({summary.splitlines()[-1]})"
+                    messagebox.showinfo("成功", f"图标已成功保存到:\n{filepath}\n\n{summary}")
+                    return
+            elif format_type == "png":
+                # PNG写出最大尺寸已存储的PNG数据，勾选优化时无损重新编码为最小的结果
+                write_png(self.current_icon, filepath, optimize=self.optimize_png.get())
             else:
                 # 保存为其他格式 (单尺寸，使用最大尺寸)
-                largest = max(self.current_icon, key=lambda img: img.size[0])
+                largest = self.current_icon[self.current_icon.largest_index()]
+                
+                if self.target_quality.get():
+                    from quality_encode import encode_for_quality
+
+                    # 二分查找满足目标SSIM的最低质量
+                    target = self.target_ssim.get()
+                    data, quality, score = encode_for_quality(largest, format_type, target)
+                    with open(filepath, "wb") as f:
+                        f.write(data)
+                    quality_text = "无损" if quality is None else f"质量 {quality}"
+                    self.status_bar["text"] = (f"图标已保存到: {filepath} "
+                                               f"({quality_text}，SSIM {score:.4f}，{len(data)} 字节)")
+                    messagebox.showinfo("成功", f"图标已成功保存到:\n{filepath}\n\n"
+                                              f"目标SSIM {target:.3f}: {quality_text}，"
+                                              f"SSIM {score:.4f}，{len(data)} 字节")
+                    return
                 
                 # 转换为目标格式
                 if format_type == "jpeg" and largest.mode == 'RGBA':
@@ -2605,9 +2162,6 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
                     'quality': self.quality.get()
                 }
                 
-                if format_type == "png":
-                    save_kwargs['compress_level'] = 9 - int(self.quality.get() / 11.1)  # 0-9
-                
                 largest.save(filepath, **save_kwargs)
             
             self.status_bar["text"] = f"图标已保存到: {filepath}"
@@ -2617,10 +2171,51 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
             messagebox.showerror("错误", f"保存图标时出错:\n{str(e)}")
             self.status_bar["text"] = f"错误: {str(e)}"
     
+    def describe_ico_report(self, report):
+        """ICO各条目的大小和量化耗时说明，最后一行为总计"""
+        lines = []
+        for entry in report:
+            if entry['bits'] < 32:
+                lines.append(f"{entry['size']}px: {entry['bits']}位 {entry['bytes']} 字节 "
+                             f"(32位 {entry['png_bytes']} 字节，{entry['ms']:.1f} ms)")
+        total = sum(entry['bytes'] for entry in report)
+        baseline = sum(entry['png_bytes'] for entry in report)
+        change = (baseline - total) / baseline * 100 if baseline else 0
+        if change >= 0:
+            lines.append(f"共 {total} 字节，比全部32位 ({baseline} 字节) 小 {change:.1f}%")
+        else:
+            lines.append(f"共 {total} 字节，比全部32位 ({baseline} 字节) 大 {-change:.1f}%")
+        return "\n".join(lines)
+    
+    def start_animation_export(self, filepath, format_name):
+        """启动动画导出线程"""
+        anim = self.current_icon
+        self.save_btn['state'] = tk.DISABLED
+        self.progress_bar.grid(row=2, column=0, sticky="ew", pady=5)
+        self.progress_bar['maximum'] = len(anim.frames)
+        self.progress_bar['value'] = 0
+        
+        thread = threading.Thread(
+            target=self.export_animation,
+            args=(anim, filepath, format_name),
+            daemon=True
+        )
+        thread.start()
+    
+    def export_animation(self, anim, filepath, format_name):
+        """逐帧导出动画 (在后台线程中运行)"""
+        try:
+            paths = export_animation(anim, filepath, format_name,
+                                     progress=lambda n: self.progress_queue.put(("save_progress", n)))
+            self.progress_queue.put(("saved", paths))
+        except Exception as e:
+            self.progress_queue.put(("save_error", str(e)))
+    
     def clear_preview(self):
         """清除当前预览"""
         self.preview_canvas.delete("all")
         self.realtime_preview.delete("all")
+        self._realtime_item = None
         self.icon_previews = []
         self.current_icon = None
         self.save_btn['state'] = tk.DISABLED
@@ -2641,6 +2236,7 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
    - 设置需要的图标尺寸
    - 使用"单独定制尺寸"为不同尺寸设置不同参数
    - 选择形状蒙版 (圆形/圆角矩形/星形/心形等)
+   - 动画GIF/WebP会逐帧处理，可保存为动画WebP/APNG/GIF或动画光标(ANI)
    - 点击"生成预览"查看效果
    - 选择输出格式和质量后点击"保存图标"
 
@@ -2683,6 +2279,7 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
 7. 图表转图标:
    - 选择图表类型(折线图、柱状图、饼图等)
    - 输入图表数据或使用示例
+   - 代码在独立进程中运行，超时(10秒)会被自动终止
    - 设置背景颜色和透明度
    - 设置需要的图标尺寸
    - 点击"生成预览"查看效果
@@ -2696,6 +2293,9 @@ y = np.sin(x) + np.random.normal(0, 0.1, 100)"""
         messagebox.showinfo("帮助", help_text)
 
 if __name__ == "__main__":
+    # 打包为exe时，图表沙箱子进程需要
+    multiprocessing.freeze_support()
+    
     # 创建圆形和圆角矩形的绘制方法
     def _create_round_rect(self, x1, y1, x2, y2, radius=25, **kwargs):
         points = [
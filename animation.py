@@ -0,0 +1,409 @@
+"""
+动画图标
+
+GIF/WebP/APNG等动画源逐帧流式处理: 帧按顺序读取，交给线程池并行处理
+(调整、效果、缩放、形状蒙版等Pillow操作会释放GIL)，同时在处理中的帧数有上限，
+处理结果按帧压缩存储 (每帧一个IconSet)。
+
+导出时逐帧解码并增量写入动画WebP、APNG、GIF或动画光标 (ANI)，
+内存占用只与少数几帧有关，与动画总帧数无关。
+"""
+import io
+import os
+from abc import ABC, abstractmethod
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import ImageSequence
+
+from icon_store import write_ico
+
+# 源文件未指定帧时长时使用的默认值 (毫秒)
+DEFAULT_FRAME_DURATION = 100
+
+# 同时在处理中的帧数 = 线程数 × 该系数
+FRAMES_IN_FLIGHT_FACTOR = 2
+
+# ANI帧时长的单位 (1/60秒)
+JIFFY_MS = 1000 / 60
+
+
+def is_animated(img):
+    """图像是否包含多帧"""
+    return getattr(img, "n_frames", 1) > 1
+
+
+def iter_frames(img):
+    """逐帧读取动画，产出 (RGBA帧, 时长毫秒)，不一次性解码所有帧"""
+    for frame in ImageSequence.Iterator(img):
+        duration = frame.info.get("duration") or DEFAULT_FRAME_DURATION
+        # convert会复制一份像素，后续读取下一帧不会影响已产出的帧
+        yield frame.convert("RGBA"), duration
+
+
+def process_frames(items, func, workers=None):
+    """用线程池并行处理，按输入顺序产出结果
+
+    同时提交的任务数有上限，输入是惰性迭代器时只会提前读取少数几帧。
+    """
+    workers = workers or os.cpu_count() or 1
+    limit = workers * FRAMES_IN_FLIGHT_FACTOR
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= limit:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class AnimatedIconSet:
+    """逐帧存储的多尺寸动画图标
+
+    作为图标集使用时 (预览、ICO/PNG导出) 代表第一帧。
+    """
+
+    def __init__(self, loop=0):
+        self.frames = []
+        self.durations = []
+        self.loop = loop
+
+    def append(self, frame_set, duration):
+        """追加一帧 (包含所有尺寸的IconSet)"""
+        self.frames.append(frame_set)
+        self.durations.append(duration)
+
+    @property
+    def first_frame(self):
+        return self.frames[0]
+
+    def __len__(self):
+        return len(self.first_frame) if self.frames else 0
+
+    def __iter__(self):
+        return iter(self.first_frame)
+
+    def __getitem__(self, index):
+        return self.first_frame[index]
+
+    @property
+    def sizes(self):
+        return self.first_frame.sizes
+
+    @property
+    def modes(self):
+        return self.first_frame.modes
+
+    def largest_index(self):
+        return self.first_frame.largest_index()
+
+    def png_bytes(self, index):
+        return self.first_frame.png_bytes(index)
+
+
+def make_chunk(chunk_type, data):
+    """PNG数据块"""
+    return (struct.pack(">I", len(data)) + chunk_type + data
+            + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+
+def read_png_chunks(data):
+    """解析PNG字节，产出 (类型, 数据)"""
+    pos = 8
+    while pos < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        yield chunk_type, data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+
+def riff_chunk(fourcc, data):
+    """RIFF数据块 (奇数长度补齐一个字节)"""
+    return fourcc + struct.pack("<I", len(data)) + data + (b"\0" if len(data) % 2 else b"")
+
+
+def read_riff_chunks(data, pos):
+    """从指定位置起解析RIFF数据块，产出 (FourCC, 数据)"""
+    while pos + 8 <= len(data):
+        fourcc, length = struct.unpack("<4sI", data[pos:pos + 8])
+        yield fourcc, data[pos + 8:pos + 8 + length]
+        pos += 8 + length + (length % 2)
+
+
+class AnimationWriter(ABC):
+    """增量动画写入器的基类: add() 逐帧写入，close() 补写文件头中的长度等信息"""
+
+    def __init__(self, path, size, loop=0):
+        self.path = path
+        self.size = size
+        self.loop = loop
+        self.frame_count = 0
+        self.fp = open(path, "wb")
+        try:
+            self.write_header()
+        except Exception:
+            self.fp.close()
+            raise
+
+    @abstractmethod
+    def write_header(self):
+        """写入文件头 (构造时调用)"""
+
+    @abstractmethod
+    def add(self, frame, duration):
+        """写入一帧，duration 为显示时间 (毫秒)"""
+
+    @abstractmethod
+    def finish(self):
+        """写入文件尾并补写文件头中的长度等信息"""
+
+    def close(self):
+        try:
+            self.finish()
+        finally:
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class WebPAnimationWriter(AnimationWriter):
+    """动画WebP: 每帧单独编码为WebP，再封装为ANMF帧"""
+
+    def __init__(self, path, size, loop=0, lossless=True, quality=90):
+        self.lossless = lossless
+        self.quality = quality
+        super().__init__(path, size, loop)
+
+    def write_header(self):
+        width, height = self.size
+        self.fp.write(b"RIFF\0\0\0\0WEBP")
+        # VP8X: 动画 + 透明，画布尺寸按 (值-1) 存储为24位
+        flags = 0x02 | 0x10
+        self.fp.write(riff_chunk(b"VP8X", struct.pack("<I", flags)
+                                 + (width - 1).to_bytes(3, "little")
+                                 + (height - 1).to_bytes(3, "little")))
+        # ANIM: 背景色 (透明) 和循环次数
+        self.fp.write(riff_chunk(b"ANIM", struct.pack("<IH", 0, self.loop)))
+
+    def add(self, frame, duration):
+        buffer = io.BytesIO()
+        frame.save(buffer, format="WEBP", lossless=self.lossless, quality=self.quality)
+        data = buffer.getvalue()
+
+        # 只保留图像数据块 (透明通道和VP8/VP8L)
+        payload = b"".join(riff_chunk(fourcc, chunk)
+                           for fourcc, chunk in read_riff_chunks(data, 12)
+                           if fourcc in (b"ALPH", b"VP8 ", b"VP8L"))
+        width, height = frame.size
+        header = (b"\0" * 6
+                  + (width - 1).to_bytes(3, "little")
+                  + (height - 1).to_bytes(3, "little")
+                  + min(duration, 0xFFFFFF).to_bytes(3, "little")
+                  + b"\x02")  # 不与上一帧混合，显示后不清除
+        self.fp.write(riff_chunk(b"ANMF", header + payload))
+        self.frame_count += 1
+
+    def finish(self):
+        end = self.fp.tell()
+        self.fp.seek(4)
+        self.fp.write(struct.pack("<I", end - 8))
+        self.fp.seek(end)
+
+
+class APNGWriter(AnimationWriter):
+    """APNG: 每帧单独编码为PNG，第一帧写为IDAT，之后的帧写为fdAT"""
+
+    def write_header(self):
+        width, height = self.size
+        self.sequence = 0
+        self.fp.write(b"\x89PNG\r\n\x1a\n")
+        self.fp.write(make_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        # acTL的帧数在结束时补写
+        self.actl_offset = self.fp.tell()
+        self.fp.write(make_chunk(b"acTL", struct.pack(">II", 0, self.loop)))
+
+    def add(self, frame, duration):
+        if frame.mode != "RGBA":
+            frame = frame.convert("RGBA")
+        buffer = io.BytesIO()
+        frame.save(buffer, format="PNG", compress_level=6)
+
+        width, height = frame.size
+        self.fp.write(make_chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB", self.sequence, width, height, 0, 0,
+            min(duration, 0xFFFF), 1000, 0, 0)))
+        self.sequence += 1
+
+        for chunk_type, data in read_png_chunks(buffer.getvalue()):
+            if chunk_type != b"IDAT":
+                continue
+            if self.frame_count == 0:
+                self.fp.write(make_chunk(b"IDAT", data))
+            else:
+                self.fp.write(make_chunk(b"fdAT", struct.pack(">I", self.sequence) + data))
+                self.sequence += 1
+        self.frame_count += 1
+
+    def finish(self):
+        self.fp.write(make_chunk(b"IEND", b""))
+        end = self.fp.tell()
+        self.fp.seek(self.actl_offset)
+        self.fp.write(make_chunk(b"acTL", struct.pack(">II", self.frame_count, self.loop)))
+        self.fp.seek(end)
+
+
+def quantize_frame(frame):
+    """把RGBA帧转换为最多256色的调色板图像，透明像素使用单独的颜色索引"""
+    alpha = frame.getchannel("A")
+    if alpha.getextrema()[0] >= 128:
+        return frame.convert("RGB").quantize(colors=256), None
+
+    indexed = frame.convert("RGB").quantize(colors=255)
+    indexed.paste(255, mask=alpha.point(lambda a: 255 if a < 128 else 0))
+    return indexed, 255
+
+
+def read_gif_frame(data):
+    """解析单帧GIF，返回 (调色板, 透明索引, 图像描述符, LZW数据)"""
+    packed = data[10]
+    pos = 13
+    palette = b""
+    if packed & 0x80:
+        length = 3 << ((packed & 7) + 1)
+        palette = data[pos:pos + length]
+        pos += length
+
+    transparency = None
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x21:  # 扩展块
+            label = data[pos + 1]
+            pos += 2
+            if label == 0xF9 and data[pos + 1] & 1:
+                transparency = data[pos + 4]
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        elif block == 0x2C:  # 图像描述符
+            descriptor = data[pos + 1:pos + 10]
+            pos += 10
+            if descriptor[8] & 0x80:
+                length = 3 << ((descriptor[8] & 7) + 1)
+                palette = data[pos:pos + length]
+                pos += length
+            start = pos
+            pos += 1  # LZW最小码长
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+            return palette, transparency, descriptor, data[start:pos]
+        else:
+            break
+    raise ValueError("无法解析GIF帧数据")
+
+
+class GIFWriter(AnimationWriter):
+    """动画GIF: 每帧使用自己的局部调色板，帧显示后恢复为背景 (透明)"""
+
+    def write_header(self):
+        width, height = self.size
+        self.fp.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0, 0, 0))
+        # NETSCAPE2.0扩展: 循环次数
+        self.fp.write(b"\x21\xFF\x0BNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\0")
+
+    def add(self, frame, duration):
+        indexed, transparency = quantize_frame(frame.convert("RGBA"))
+        buffer = io.BytesIO()
+        if transparency is None:
+            indexed.save(buffer, format="GIF")
+        else:
+            indexed.save(buffer, format="GIF", transparency=transparency)
+        palette, transparency, descriptor, lzw = read_gif_frame(buffer.getvalue())
+
+        # 图形控制扩展: 处置方式2 (恢复背景)，时长单位为1/100秒
+        flags = (2 << 2) | (1 if transparency is not None else 0)
+        delay = max(2, round(duration / 10))
+        self.fp.write(b"\x21\xF9\x04" + struct.pack("<BHB", flags, delay, transparency or 0) + b"\0")
+
+        # 调色板补齐到2的幂，作为局部调色板写入 (保留隔行扫描标志)
+        entries = max(2, len(palette) // 3)
+        bits = max(1, (entries - 1).bit_length())
+        palette = palette.ljust(3 << bits, b"\0")
+        packed = 0x80 | (descriptor[8] & 0x40) | (bits - 1)
+        self.fp.write(b"\x2C" + descriptor[:8] + bytes([packed]) + palette + lzw)
+        self.frame_count += 1
+
+    def finish(self):
+        self.fp.write(b"\x3B")
+
+
+def write_ani(anim, path, progress=None):
+    """写出动画光标 (ANI)，每帧是包含所有尺寸的ICO数据，直接使用已存储的PNG"""
+    with open(path, "wb") as fp:
+        count = len(anim.frames)
+        rates = [max(1, round(duration / JIFFY_MS)) for duration in anim.durations]
+
+        fp.write(b"RIFF\0\0\0\0ACON")
+        # anih: 结构大小、帧数、步数、宽高/位数/平面数 (使用图标数据)、默认速率、标志 (AF_ICON)
+        fp.write(riff_chunk(b"anih", struct.pack("<9I", 36, count, count, 0, 0, 0, 0, rates[0], 1)))
+        fp.write(riff_chunk(b"rate", struct.pack(f"<{count}I", *rates)))
+
+        list_offset = fp.tell()
+        fp.write(b"LIST\0\0\0\0fram")
+        for i, frame_set in enumerate(anim.frames):
+            buffer = io.BytesIO()
+            write_ico(frame_set, buffer)
+            fp.write(riff_chunk(b"icon", buffer.getvalue()))
+            if progress:
+                progress(i + 1)
+
+        end = fp.tell()
+        fp.seek(list_offset + 4)
+        fp.write(struct.pack("<I", end - list_offset - 8))
+        fp.seek(4)
+        fp.write(struct.pack("<I", end - 8))
+    return [path]
+
+
+def export_animation(anim, filepath, format_name, progress=None):
+    """导出动画，返回写出的文件路径列表
+
+    WebP/APNG/GIF每个尺寸写一个文件 (多个尺寸时文件名追加 _宽x高)，ANI所有尺寸写入同一文件。
+    所有尺寸的写入器同时打开，每帧只从存储中解码一次。
+    """
+    writer_class, _ = ANIMATION_FORMATS[format_name]
+    if writer_class is None:
+        return write_ani(anim, filepath, progress)
+
+    base, ext = os.path.splitext(filepath)
+    sizes = anim.sizes
+    paths = [filepath if len(sizes) == 1 else f"{base}_{w}x{h}{ext}" for w, h in sizes]
+
+    writers = []
+    try:
+        for path, size in zip(paths, sizes):
+            writers.append(writer_class(path, size, anim.loop))
+        for i, (frame_set, duration) in enumerate(zip(anim.frames, anim.durations)):
+            for index, writer in enumerate(writers):
+                writer.add(frame_set.decode(index), duration)
+            if progress:
+                progress(i + 1)
+    finally:
+        for writer in writers:
+            writer.close()
+    return paths
+
+
+# 导出格式 -> (写入器, 扩展名)，ANI由write_ani单独处理
+ANIMATION_FORMATS = {
+    "webp": (WebPAnimationWriter, ".webp"),
+    "apng": (APNGWriter, ".png"),
+    "gif": (GIFWriter, ".gif"),
+    "ani": (None, ".ani"),
+}
@@ -0,0 +1,309 @@
+"""
+性能基准
+
+用法:
+    python benchmark.py startup [--repeat N] [--top N]
+    python benchmark.py tiles [--effect 名称] [--megapixels N] [--max-workers N] [--repeat N]
+    python benchmark.py svg [文件.svg ...] [--sizes 16,32,256] [--repeat N]
+    python benchmark.py atlas [--entries N] [--repeat N]
+
+startup: 统计导入耗时 (同 python -X importtime，按模块汇总)
+         并测量从启动进程到主窗口显示的时间，与目标值比较。
+tiles:   在合成的大图上测量邻域效果单进程处理和分块多进程处理 (1..N个进程) 的耗时，
+         输出加速比和并行效率，并校验分块结果与单进程结果一致。
+svg:     比较原始文档和精简后 (见 svg_optimize) 的文档的解析加光栅化耗时，输出元素数量、加速比
+         和两者渲染结果的最大像素误差。不指定文件时使用合成的设计工具导出文档。
+atlas:   测量图集打包 (见 atlas_export.pack_rects) 数千个条目的耗时和填充率，与目标值比较。
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# 仓库目录 (基准在子进程中从这里启动程序)
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 主窗口显示时间的目标值 (秒，含解释器启动)
+FIRST_WINDOW_TARGET = 1.0
+
+# 图集打包的目标耗时 (秒，数千个条目)
+ATLAS_TARGET = 0.5
+
+# 图集基准中每个图标的尺寸 (与批量导出图标集时相同)
+ATLAS_ICON_SIZES = (16, 24, 32, 48, 64, 128, 256)
+
+# 启动程序并在窗口第一次绘制后立即退出，不需要修改程序本身
+FIRST_WINDOW_SCRIPT = """
+import runpy
+import tkinter as tk
+
+def mainloop(self, n=0):
+    self.update()
+    print("window-shown", flush=True)
+    self.destroy()
+
+tk.Tk.mainloop = mainloop
+runpy.run_path("AdvancedIconGenerator.py", run_name="__main__")
+"""
+
+
+def import_report(module="AdvancedIconGenerator", top=15):
+    """在干净的子进程中导入模块，返回 (总耗时秒, [(累计微秒, 自身微秒, 模块名)])
+
+    只统计被主模块直接导入的模块 (第一层)。
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    entries = []
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0 and name.strip() == module:
+            total = int(cumulative_us)
+        elif depth == 1:
+            entries.append((int(cumulative_us), int(self_us), name.strip()))
+    entries.sort(reverse=True)
+    return total / 1e6, entries[:top]
+
+
+def first_window_time(timeout=60):
+    """启动程序，返回主窗口显示所需的秒数"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", FIRST_WINDOW_SCRIPT],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    for line in process.stdout:
+        if line.strip() == "window-shown":
+            elapsed = time.perf_counter() - start
+            process.wait(timeout)
+            return elapsed
+    process.wait(timeout)
+    errors = process.stderr.read().strip().splitlines()
+    raise RuntimeError(errors[-1] if errors else "程序未显示窗口")
+
+
+def run_startup(args):
+    total, entries = import_report(top=args.top)
+    print(f"导入 AdvancedIconGenerator: {total * 1000:.1f} ms")
+    print(f"{'累计(ms)':>10} {'自身(ms)':>10}  模块")
+    for cumulative_us, self_us, name in entries:
+        print(f"{cumulative_us / 1000:>10.1f} {self_us / 1000:>10.1f}  {name}")
+
+    print()
+    try:
+        times = [first_window_time() for _ in range(args.repeat)]
+    except RuntimeError as e:
+        print(f"无法测量窗口显示时间: {e}")
+        return 1
+
+    median = statistics.median(times)
+    status = "达标" if median <= FIRST_WINDOW_TARGET else "未达标"
+    print(f"主窗口显示: 中位数 {median * 1000:.0f} ms，最快 {min(times) * 1000:.0f} ms "
+          f"(目标 {FIRST_WINDOW_TARGET * 1000:.0f} ms，{status})")
+    return 0 if median <= FIRST_WINDOW_TARGET else 1
+
+
+def benchmark_image(megapixels):
+    """生成测试用的大图 (分形 + 噪声，颜色分布接近照片扫描件)"""
+    import numpy as np
+    from PIL import Image
+
+    side = int((megapixels * 1e6) ** 0.5)
+    fractal = Image.effect_mandelbrot((side, side), (-2.0, -1.5, 1.0, 1.5), 64)
+    noise = np.random.default_rng(0).integers(0, 64, (side, side), dtype=np.uint8)
+    base = np.asarray(fractal)
+    return Image.fromarray(np.stack([base, base // 2 + noise, 255 - base], axis=-1), "RGB")
+
+
+def benchmark_svg(shapes=60):
+    """生成模拟设计工具导出的SVG: 编辑器元数据和命名空间、未使用的渐变、多层分组、十位小数的坐标"""
+    import random
+
+    rng = random.Random(0)
+
+    def number():
+        return f"{rng.uniform(0, 256):.10f}"
+
+    defs = "".join(
+        f'<linearGradient id="unused{i}" inkscape:collect="always">'
+        f'<stop offset="0" style="stop-color:#{rng.randrange(0x1000000):06x}"/></linearGradient>'
+        for i in range(shapes // 2)
+    )
+    body = []
+    for i in range(shapes):
+        points = " ".join(f"L {number()},{number()}" for _ in range(8))
+        shape = (f'<path d="M {number()},{number()} {points} Z" fill="#{rng.randrange(0x1000000):06x}" '
+                 f'stroke="#000000" stroke-width="{rng.uniform(0.5, 2):.10f}" inkscape:connector-curvature="0"/>')
+        # 每个图形套三层分组 (图层、编组、剪贴组)
+        body.append(f'<g inkscape:label="Layer {i}" inkscape:groupmode="layer" id="layer{i}"><g><g>'
+                    f'{shape}</g></g></g>')
+        if i % 10 == 0:
+            body.append(f'<rect x="{number()}" y="{number()}" width="10" height="10" display="none"/>')
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" '
+        'xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd" '
+        'xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" width="256" height="256" viewBox="0 0 256 256">'
+        '<sodipodi:namedview pagecolor="#ffffff" inkscape:zoom="1.4142136" inkscape:cx="128.00000001"/>'
+        f'<defs>{defs}</defs>'
+        '<metadata><rdf:RDF><rdf:Description about="benchmark"/></rdf:RDF></metadata>'
+        f'{"".join(body)}</svg>'
+    )
+
+
+def best_time(func, repeat):
+    """多次运行取最短耗时，返回 (秒, 最后一次的结果)"""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def run_tiles(args):
+    import numpy as np
+
+    from effects import EFFECTS
+    from tiled_filter import apply_tiled, shutdown_pool, tile_pool
+
+    effect = EFFECTS.get(args.effect)
+    if effect is None or effect.halo is None:
+        names = "、".join(name for name, e in EFFECTS.items() if e.halo is not None)
+        print(f"不支持分块的效果: {args.effect} (可选: {names})")
+        return 1
+
+    img = benchmark_image(args.megapixels)
+    print(f"效果: {effect.name}，图像 {img.width}x{img.height} "
+          f"({img.width * img.height / 1e6:.1f} MP)，重叠区 {effect.tile_halo()} 像素")
+
+    baseline, expected = best_time(lambda: effect.apply(img, 1.0), args.repeat)
+    print(f"{'进程数':>6} {'耗时(ms)':>10} {'加速比':>8} {'效率':>8}")
+    print(f"{'单进程':>6} {baseline * 1000:>10.0f} {1.0:>8.2f} {'-':>8}")
+
+    expected = np.asarray(expected)
+    try:
+        for workers in range(1, args.max_workers + 1):
+            # 启动进程池不计入耗时
+            pool = tile_pool(workers)
+            for _ in pool.map(abs, range(workers)):
+                pass
+            elapsed, result = best_time(lambda: apply_tiled(img, effect, 1.0, workers=workers), args.repeat)
+            if not np.array_equal(np.asarray(result), expected):
+                print(f"{workers}个进程的分块结果与单进程结果不一致")
+                return 1
+            speedup = baseline / elapsed
+            print(f"{workers:>6} {elapsed * 1000:>10.0f} {speedup:>8.2f} {speedup / workers:>8.0%}")
+    finally:
+        shutdown_pool()
+    return 0
+
+
+def run_svg(args):
+    import numpy as np
+
+    from icon_render import SvgDocument, render_svg
+    from svg_optimize import describe_stats, optimize_svg
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    documents = []
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as f:
+            documents.append((os.path.basename(path), f.read()))
+    if not documents:
+        documents.append(("合成文档", benchmark_svg()))
+    if SvgDocument(documents[0][1]).tree is None:
+        print("注意: cairosvg不可用，测得的是备用渲染器的耗时")
+
+    def rasterize(code):
+        doc = SvgDocument(code)
+        return [render_svg(doc, size).convert("RGBA") for size in sizes]
+
+    print(f"尺寸: {', '.join(map(str, sizes))}")
+    print(f"{'文档':<16} {'原始(ms)':>10} {'精简(ms)':>10} {'优化(ms)':>10} {'加速比':>8} {'最大误差':>8}")
+    for name, code in documents:
+        optimize_svg.cache_clear()
+        optimized, stats = optimize_svg(code)
+        original_time, expected = best_time(lambda: rasterize(code), args.repeat)
+        optimized_time, result = best_time(lambda: rasterize(optimized), args.repeat)
+        error = max(int(np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).max())
+                    if a.size == b.size else 255 for a, b in zip(expected, result))
+        print(f"{name:<16} {original_time * 1000:>10.1f} {optimized_time * 1000:>10.1f} {stats['ms']:>10.1f} "
+              f"{original_time / optimized_time:>8.2f} {error:>8}")
+        print(f"{'':<16} {describe_stats(stats)}")
+    return 0
+
+
+def atlas_workloads(entries):
+    """图集打包的测试数据: 批量图标集的各尺寸、随机大小的矩形、窄而高的矩形 (天际线最碎)"""
+    import random
+
+    rng = random.Random(0)
+    icons = [(size, size) for size in ATLAS_ICON_SIZES] * (entries // len(ATLAS_ICON_SIZES) + 1)
+    return [
+        ("图标集", icons[:entries]),
+        ("随机矩形", [(rng.randint(8, 200), rng.randint(8, 200)) for _ in range(entries)]),
+        ("窄高矩形", [(rng.randint(4, 30), rng.randint(4, 300)) for _ in range(entries)]),
+    ]
+
+
+def run_atlas(args):
+    from atlas_export import pack_rects
+
+    print(f"{'数据':<10} {'条目':>6} {'耗时(ms)':>10} {'图集尺寸':>12} {'填充率':>8}")
+    slowest = 0.0
+    for name, sizes in atlas_workloads(args.entries):
+        elapsed, (width, height, _) = best_time(lambda: pack_rects(sizes), args.repeat)
+        slowest = max(slowest, elapsed)
+        fill = sum(w * h for w, h in sizes) / (width * height)
+        print(f"{name:<10} {len(sizes):>6} {elapsed * 1000:>10.0f} {f'{width}x{height}':>12} {fill:>8.0%}")
+
+    status = "达标" if slowest <= ATLAS_TARGET else "未达标"
+    print(f"最长耗时 {slowest * 1000:.0f} ms (目标 {ATLAS_TARGET * 1000:.0f} ms，{status})")
+    return 0 if slowest <= ATLAS_TARGET else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="高级图标生成工具性能基准")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    startup = commands.add_parser("startup", help="导入耗时和主窗口显示时间")
+    startup.add_argument("--repeat", type=int, default=5, help="测量窗口显示的次数")
+    startup.add_argument("--top", type=int, default=15, help="列出耗时最多的模块数量")
+    startup.set_defaults(func=run_startup)
+
+    tiles = commands.add_parser("tiles", help="分块多进程滤镜的多核扩展性")
+    tiles.add_argument("--effect", default="油画", help="测试的效果名称")
+    tiles.add_argument("--megapixels", type=float, default=16, help="测试图像的像素数 (百万)")
+    tiles.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="最多使用的进程数")
+    tiles.add_argument("--repeat", type=int, default=3, help="每种配置的测量次数 (取最短)")
+    tiles.set_defaults(func=run_tiles)
+
+    svg = commands.add_parser("svg", help="SVG预优化对光栅化耗时的影响")
+    svg.add_argument("files", nargs="*", help="SVG文件 (默认使用合成的设计工具导出文档)")
+    svg.add_argument("--sizes", default="16,32,48,256", help="光栅化的尺寸 (逗号分隔)")
+    svg.add_argument("--repeat", type=int, default=3, help="每个文档的测量次数 (取最短)")
+    svg.set_defaults(func=run_svg)
+
+    atlas = commands.add_parser("atlas", help="图集打包数千个条目的耗时")
+    atlas.add_argument("--entries", type=int, default=3000, help="条目数量")
+    atlas.add_argument("--repeat", type=int, default=3, help="每组数据的测量次数 (取最短)")
+    atlas.set_defaults(func=run_atlas)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
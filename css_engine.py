@@ -0,0 +1,484 @@
+"""
+CSS渲染引擎
+
+用cssutils把CSS文本解析一次，编译成与尺寸无关的渲染计划 (CssRenderPlan)，
+每个图标尺寸只需执行计划即可。渲染计划按CSS文本的哈希缓存。
+
+支持的属性:
+- width / height (设计尺寸，默认100px，用于确定各长度的相对比例)
+- background / background-color / background-image
+  (纯色、多色标及带角度的 linear-gradient / repeating-linear-gradient)
+- border / border-width / border-style / border-color
+- border-radius (px 或 %)
+- box-shadow (多重阴影，inset阴影暂不支持)
+- opacity (数值或百分比)
+"""
+import hashlib
+import logging
+import math
+import re
+import threading
+from collections import OrderedDict
+
+import cssutils
+import numpy as np
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFilter
+
+# cssutils会把不认识的属性写入日志，这里只关心能渲染的部分
+cssutils.log.setLevel(logging.CRITICAL)
+
+# 计划缓存上限
+PLAN_CACHE_SIZE = 64
+
+# 默认设计尺寸 (px)
+DEFAULT_BOX_SIZE = 100.0
+
+# 边框宽度关键字
+BORDER_WIDTH_KEYWORDS = {"thin": 1.0, "medium": 3.0, "thick": 5.0}
+
+# 不绘制的边框样式
+BORDER_NONE_STYLES = ("none", "hidden")
+
+# 方向关键字 -> (水平方向, 垂直方向)
+GRADIENT_SIDES = {"left": (-1, 0), "right": (1, 0), "top": (0, -1), "bottom": (0, 1)}
+
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def split_top_level(value, sep=None):
+    """按分隔符拆分CSS值，忽略括号内的分隔符 (sep为None时按空白拆分)"""
+    parts = []
+    depth = 0
+    current = []
+    for ch in value:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth = max(0, depth - 1)
+
+        is_sep = ch.isspace() if sep is None else ch == sep
+        if is_sep and depth == 0:
+            if current:
+                parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+    if current and "".join(current).strip():
+        parts.append("".join(current).strip())
+    return parts
+
+
+def parse_color(value):
+    """把CSS颜色解析为RGBA元组"""
+    value = value.strip().lower()
+    if value == "transparent":
+        return (0, 0, 0, 0)
+
+    match = re.fullmatch(r"rgba?\(([^)]*)\)", value)
+    if match:
+        parts = [p.strip() for p in re.split(r"[,\s/]+", match.group(1)) if p.strip()]
+        if len(parts) in (3, 4):
+            channels = []
+            for p in parts[:3]:
+                if p.endswith("%"):
+                    channels.append(round(float(p[:-1]) * 2.55))
+                else:
+                    channels.append(round(float(p)))
+            alpha = 1.0
+            if len(parts) == 4:
+                alpha = float(parts[3][:-1]) / 100 if parts[3].endswith("%") else float(parts[3])
+            channels.append(round(max(0.0, min(1.0, alpha)) * 255))
+            return tuple(max(0, min(255, c)) for c in channels)
+
+    try:
+        color = ImageColor.getrgb(value)
+    except ValueError:
+        raise ValueError(f"无法解析颜色: {value}")
+    if len(color) == 3:
+        color = color + (255,)
+    return color
+
+
+def is_color(token):
+    """判断一个值片段是否为颜色"""
+    try:
+        parse_color(token)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_length(token, reference=None):
+    """把CSS长度解析为px (百分比相对reference计算)"""
+    token = token.strip().lower()
+    if token.endswith("%"):
+        if reference is None:
+            raise ValueError(f"此处不支持百分比: {token}")
+        return float(token[:-1]) * reference / 100
+    for unit, factor in (("px", 1.0), ("rem", 16.0), ("em", 16.0), ("pt", 4.0 / 3.0)):
+        if token.endswith(unit):
+            return float(token[:-len(unit)]) * factor
+    return float(token)
+
+
+def is_length(token):
+    """判断一个值片段是否为长度"""
+    try:
+        parse_length(token, 0)
+        return True
+    except ValueError:
+        return False
+
+
+def read_declarations(css_text):
+    """用cssutils解析CSS，按层叠顺序返回 [(属性名, 值)]
+
+    既支持带选择器的完整样式表 (多个规则按顺序合并)，
+    也支持示例中那种只有声明列表的写法。
+    """
+    declarations = []
+    if "{" in css_text:
+        sheet = cssutils.parseString(css_text)
+        styles = [rule.style for rule in sheet if rule.type == rule.STYLE_RULE]
+    else:
+        styles = [cssutils.parseStyle(css_text)]
+
+    for style in styles:
+        for prop in style:
+            declarations.append((prop.name.lower(), prop.value))
+    return declarations
+
+
+def parse_gradient(value):
+    """解析 linear-gradient(...) 或 repeating-linear-gradient(...)，返回 (方向, 色标列表, 是否重复)
+
+    方向为角度 (deg) 或 ("corner", 水平方向, 垂直方向)；
+    色标为 (位置或None, RGBA)，位置为百分比/px字符串。
+    """
+    match = re.fullmatch(r"(repeating-)?linear-gradient\((.*)\)", value.strip(), re.S)
+    if not match:
+        return None
+
+    repeating = match.group(1) is not None
+    args = split_top_level(match.group(2), ",")
+    direction = 180.0  # 默认 to bottom
+    first = args[0].strip().lower()
+    if first.startswith("to "):
+        sx, sy = 0, 0
+        for word in first[3:].split():
+            dx, dy = GRADIENT_SIDES.get(word, (0, 0))
+            sx, sy = sx + dx, sy + dy
+        if sx and sy:
+            direction = ("corner", sx, sy)
+        else:
+            direction = math.degrees(math.atan2(sx, -sy)) % 360
+        args = args[1:]
+    elif re.fullmatch(r"-?[\d.]+(deg|rad|turn|grad)", first):
+        number, unit = re.fullmatch(r"(-?[\d.]+)(deg|rad|turn|grad)", first).groups()
+        factor = {"deg": 1.0, "rad": 180 / math.pi, "turn": 360.0, "grad": 0.9}[unit]
+        direction = float(number) * factor
+        args = args[1:]
+
+    stops = []
+    for arg in args:
+        tokens = split_top_level(arg)
+        if not tokens:
+            continue
+        color = parse_color(tokens[0])
+        positions = tokens[1:] or [None]
+        for pos in positions:
+            stops.append((pos, color))
+    if len(stops) < 2:
+        raise ValueError(f"渐变至少需要两个颜色: {value}")
+    return direction, stops, repeating
+
+
+class CssRenderPlan:
+    """编译后的CSS渲染计划，所有长度均为设计尺寸下的px，执行时按比例缩放"""
+
+    def __init__(self, declarations):
+        self.width = DEFAULT_BOX_SIZE
+        self.height = None
+        self.background_color = None
+        self.gradient = None
+        self.border_width = 0.0
+        self.border_style = "none"
+        self.border_color = (0, 0, 0, 255)
+        self.radius_value = None
+        self.shadows = []
+        self.opacity = 1.0
+
+        shadow_value = None
+        for name, value in declarations:
+            if name == "width":
+                self.width = parse_length(value, DEFAULT_BOX_SIZE)
+            elif name == "height":
+                self.height = parse_length(value, DEFAULT_BOX_SIZE)
+            elif name == "background":
+                self.background_color = None
+                self.gradient = None
+                self.read_background(value)
+            elif name == "background-color":
+                self.background_color = parse_color(value)
+            elif name == "background-image":
+                self.gradient = None
+                self.read_background(value, images_only=True)
+            elif name == "border":
+                self.read_border(value)
+            elif name == "border-width":
+                self.border_width = self.read_border_width(split_top_level(value)[0])
+            elif name == "border-style":
+                self.border_style = split_top_level(value)[0].lower()
+            elif name == "border-color":
+                self.border_color = parse_color(split_top_level(value)[0])
+            elif name == "border-radius":
+                self.radius_value = split_top_level(value.split("/")[0])[0]
+            elif name == "box-shadow":
+                shadow_value = value
+            elif name == "opacity":
+                value = value.strip()
+                number = float(value[:-1]) / 100 if value.endswith("%") else float(value)
+                self.opacity = max(0.0, min(1.0, number))
+
+        if self.height is None:
+            self.height = self.width
+        self.width = max(1.0, self.width)
+        self.height = max(1.0, self.height)
+
+        # 圆角相对盒子较短边计算百分比
+        self.radius = 0.0
+        if self.radius_value:
+            self.radius = parse_length(self.radius_value, min(self.width, self.height))
+            self.radius = max(0.0, min(self.radius, min(self.width, self.height) / 2))
+
+        if shadow_value and shadow_value.strip().lower() != "none":
+            for item in split_top_level(shadow_value, ","):
+                shadow = self.read_shadow(item)
+                if shadow:
+                    self.shadows.append(shadow)
+
+        self.gradient_stops = None
+        if self.gradient:
+            self.gradient_stops = self.resolve_stops(self.gradient[1])
+
+        self.layout()
+
+    def read_background(self, value, images_only=False):
+        """解析background简写中的颜色和渐变"""
+        for token in split_top_level(value):
+            if "gradient(" in token:
+                self.gradient = parse_gradient(token)
+            elif not images_only and is_color(token):
+                self.background_color = parse_color(token)
+
+    def read_border_width(self, token):
+        token = token.lower()
+        if token in BORDER_WIDTH_KEYWORDS:
+            return BORDER_WIDTH_KEYWORDS[token]
+        return max(0.0, parse_length(token))
+
+    def read_border(self, value):
+        """解析border简写"""
+        self.border_width = BORDER_WIDTH_KEYWORDS["medium"]
+        self.border_style = "none"
+        self.border_color = (0, 0, 0, 255)
+        for token in split_top_level(value):
+            lower = token.lower()
+            if lower in BORDER_WIDTH_KEYWORDS or is_length(lower):
+                self.border_width = self.read_border_width(lower)
+            elif is_color(lower):
+                self.border_color = parse_color(lower)
+            else:
+                self.border_style = lower
+
+    def read_shadow(self, value):
+        """解析单个阴影，返回 (dx, dy, blur, spread, RGBA)"""
+        tokens = split_top_level(value)
+        if any(t.lower() == "inset" for t in tokens):
+            return None
+
+        lengths = []
+        color = (0, 0, 0, 255)
+        for token in tokens:
+            if is_length(token):
+                lengths.append(parse_length(token))
+            else:
+                color = parse_color(token)
+        if len(lengths) < 2:
+            return None
+        lengths += [0.0] * (4 - len(lengths))
+        dx, dy, blur, spread = lengths[:4]
+        return (dx, dy, max(0.0, blur), spread, color)
+
+    def resolve_stops(self, stops):
+        """把色标位置统一为0-1之间的数值，缺省位置按CSS规则均分"""
+        direction = self.gradient_angle()
+        rad = math.radians(direction)
+        line_length = abs(self.width * math.sin(rad)) + abs(self.height * math.cos(rad))
+
+        positions = []
+        for pos, _ in stops:
+            if pos is None:
+                positions.append(None)
+            else:
+                positions.append(parse_length(pos, line_length) / line_length)
+
+        if positions[0] is None:
+            positions[0] = 0.0
+        if positions[-1] is None:
+            positions[-1] = 1.0
+
+        # 位置不能小于前一个色标
+        last = positions[0]
+        for i, pos in enumerate(positions):
+            if pos is not None:
+                last = max(last, pos)
+                positions[i] = last
+
+        # 均分缺省位置
+        i = 0
+        while i < len(positions):
+            if positions[i] is None:
+                start = i - 1
+                end = i
+                while positions[end] is None:
+                    end += 1
+                step = (positions[end] - positions[start]) / (end - start)
+                for k in range(start + 1, end):
+                    positions[k] = positions[start] + step * (k - start)
+                i = end
+            i += 1
+
+        colors = np.array([color for _, color in stops], dtype=np.float32)
+        return np.array(positions, dtype=np.float32), colors
+
+    def gradient_angle(self):
+        """渐变方向对应的角度 (0deg指向上方，顺时针)"""
+        direction = self.gradient[0]
+        if isinstance(direction, tuple):
+            # 角落方向: 渐变线垂直于相邻两角的对角线
+            _, sx, sy = direction
+            return math.degrees(math.atan2(sx * self.height, -sy * self.width)) % 360
+        return direction % 360
+
+    def layout(self):
+        """计算盒子和阴影在画布中的位置 (设计尺寸下)"""
+        left = top = right = bottom = 0.0
+        for dx, dy, blur, spread, _ in self.shadows:
+            extent = blur + spread
+            left = max(left, extent - dx)
+            right = max(right, extent + dx)
+            top = max(top, extent - dy)
+            bottom = max(bottom, extent + dy)
+
+        content_w = self.width + left + right
+        content_h = self.height + top + bottom
+        self.extent = max(content_w, content_h)
+
+        # 盒子居中放置
+        x0 = left + (self.extent - content_w) / 2
+        y0 = top + (self.extent - content_h) / 2
+        self.box = (x0, y0, x0 + self.width, y0 + self.height)
+
+    def render(self, size):
+        """按给定尺寸执行渲染计划，返回RGBA图像"""
+        scale = size / self.extent
+        img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+        box = [v * scale for v in self.box]
+        radius = self.radius * scale
+
+        # 阴影 (先声明的阴影在最上层)
+        for dx, dy, blur, spread, color in reversed(self.shadows):
+            shadow_box = [
+                box[0] + (dx - spread) * scale, box[1] + (dy - spread) * scale,
+                box[2] + (dx + spread) * scale, box[3] + (dy + spread) * scale,
+            ]
+            mask = self.shape_mask(size, shadow_box, max(0.0, radius + spread * scale))
+            if blur > 0:
+                mask = mask.filter(ImageFilter.GaussianBlur(blur * scale / 2))
+            layer = Image.new("RGBA", (size, size), color[:3] + (0,))
+            layer.putalpha(ImageChops.multiply(mask, Image.new("L", (size, size), color[3])))
+            img = Image.alpha_composite(img, layer)
+
+        # 背景 (背景色在下，渐变在上)
+        box_mask = self.shape_mask(size, box, radius)
+        fills = []
+        if self.background_color is not None:
+            fills.append(Image.new("RGBA", (size, size), self.background_color))
+        if self.gradient_stops is not None:
+            fills.append(self.render_gradient(size, box))
+        for fill in fills:
+            fill.putalpha(ImageChops.multiply(fill.getchannel("A"), box_mask))
+            img = Image.alpha_composite(img, fill)
+
+        # 边框
+        if self.border_width > 0 and self.border_style not in BORDER_NONE_STYLES:
+            width = max(1, round(self.border_width * scale))
+            layer = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+            ImageDraw.Draw(layer).rounded_rectangle(
+                [box[0], box[1], box[2] - 1, box[3] - 1],
+                radius=radius, outline=self.border_color, width=width
+            )
+            img = Image.alpha_composite(img, layer)
+
+        # 整体透明度
+        if self.opacity < 1.0:
+            alpha = img.getchannel("A").point(lambda a: round(a * self.opacity))
+            img.putalpha(alpha)
+
+        return img
+
+    def shape_mask(self, size, box, radius):
+        """盒子形状的蒙版 (支持圆角)"""
+        mask = Image.new("L", (size, size), 0)
+        draw = ImageDraw.Draw(mask)
+        if box[2] - box[0] < 1 or box[3] - box[1] < 1:
+            return mask
+        draw.rounded_rectangle(box, radius=radius, fill=255)
+        return mask
+
+    def render_gradient(self, size, box):
+        """用numpy按渐变线一次性计算整块渐变"""
+        positions, colors = self.gradient_stops
+        rad = math.radians(self.gradient_angle())
+        sin_a, cos_a = math.sin(rad), math.cos(rad)
+
+        w = max(1e-6, box[2] - box[0])
+        h = max(1e-6, box[3] - box[1])
+        cx = (box[0] + box[2]) / 2
+        cy = (box[1] + box[3]) / 2
+        line_length = abs(w * sin_a) + abs(h * cos_a)
+
+        coords = np.arange(size, dtype=np.float32) + 0.5
+        xs = (coords - cx)[np.newaxis, :]
+        ys = (coords - cy)[:, np.newaxis]
+        t = (xs * sin_a - ys * cos_a) / line_length + 0.5
+        if self.gradient[2]:
+            # 重复渐变: 以第一个到最后一个色标的距离为周期平铺
+            start, period = positions[0], positions[-1] - positions[0]
+            if period > 0:
+                t = start + np.mod(t - start, period)
+
+        pixels = np.empty((size, size, 4), dtype=np.float32)
+        for channel in range(4):
+            pixels[..., channel] = np.interp(t, positions, colors[:, channel])
+        return Image.fromarray(np.clip(pixels + 0.5, 0, 255).astype(np.uint8), "RGBA")
+
+
+def compile_css(css_text):
+    """把CSS文本编译为渲染计划 (按文本哈希缓存)"""
+    key = hashlib.sha1(css_text.encode("utf-8")).hexdigest()
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+            return plan
+
+    plan = CssRenderPlan(read_declarations(css_text))
+
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
@@ -0,0 +1,282 @@
+"""
+图像效果注册表
+
+每个效果声明:
+- 实现: 普通效果为函数 apply(img, scale)；逐像素颜色变换 (反色、黑白、棕褐色) 声明为3×4仿射颜色矩阵
+- 是否依赖分辨率: 效果的观感与像素尺寸有关 (模糊、像素化、油画等)，在缩略图上预览时需要按比例缩放参数
+- 成本估计: 每百万像素的相对耗时，用于决定效果在原图上还是在缩小后的图标上执行
+- 是否可融合: 相邻的颜色矩阵效果合并为一个矩阵，只遍历一次像素；
+  只在前一个矩阵的结果不会超出0~255时融合 (否则分步执行时的截断会改变结果)
+- 邻域半径 (halo): 邻域滤镜每个输出像素依赖的周围像素范围，声明后超大图像可以分块多进程处理 (见 tiled_filter)
+- 内存估计: 每像素需要的临时内存，预计超出软内存上限时邻域效果改为分块处理 (见 instrumentation)
+
+效果可以叠加为效果链，例如 "棕褐色+像素化"，按顺序执行。
+"""
+import math
+
+from PIL import Image, ImageFilter
+
+from instrumentation import MEMORY
+
+# 表示不应用效果的名称
+EFFECT_NONE = "无"
+
+# 效果链中分隔各效果的符号
+EFFECT_SEPARATOR = "+"
+
+# 效果每像素临时内存的默认估计 (字节，约为两份RGBA图像)
+EFFECT_MEMORY = 8
+
+# 判断颜色矩阵结果是否超出 0~255 时允许的浮点误差
+MATRIX_TOLERANCE = 1e-6
+
+
+class Effect:
+    """一个已注册的效果
+
+    apply:  函数 apply(img, scale)，scale 为图像相对于原图的缩放比例
+    matrix: 3×4仿射颜色矩阵 (每行为 R、G、B 系数和偏移)，提供时效果可与相邻的颜色矩阵效果融合
+    halo:   邻域半径 (像素)，或按缩放比例计算半径的函数 halo(scale)；为None时不能分块处理
+    memory: 每像素需要的临时内存估计 (字节)
+    """
+
+    def __init__(self, name, apply=None, matrix=None, resolution_dependent=False, cost=1.0, halo=None,
+                 memory=EFFECT_MEMORY):
+        if (apply is None) == (matrix is None):
+            raise ValueError("效果必须提供 apply 或 matrix 之一")
+        self.name = name
+        self.apply = apply
+        self.matrix = None if matrix is None else tuple(tuple(float(v) for v in row) for row in matrix)
+        self.resolution_dependent = resolution_dependent
+        self.cost = cost
+        self.halo = halo
+        self.memory = memory
+
+    @property
+    def fusable(self):
+        return self.matrix is not None
+
+    def tile_halo(self, scale=1.0):
+        """分块处理时每块需要向外扩展的像素数"""
+        return self.halo(scale) if callable(self.halo) else self.halo
+
+    def __repr__(self):
+        return f"Effect({self.name!r})"
+
+
+# 名称 -> 效果，按注册顺序 (即界面中的顺序)
+EFFECTS = {}
+
+
+def register_effect(effect):
+    """注册效果 (同名效果会被替换)"""
+    EFFECTS[effect.name] = effect
+    return effect
+
+
+def effect_names():
+    """界面中可选的效果名称 (第一项为 "无")"""
+    return [EFFECT_NONE] + list(EFFECTS)
+
+
+def parse_chain(chain):
+    """把效果链 (字符串 "棕褐色+像素化" 或名称列表) 解析为效果列表，忽略 "无" 和空项
+
+    未知的名称 (通常是拼写错误) 抛出 ValueError，而不是生成没有效果的图标。
+    """
+    if not chain:
+        return []
+    if isinstance(chain, str):
+        chain = chain.split(EFFECT_SEPARATOR)
+    effects = []
+    for name in chain:
+        name = name.strip()
+        if not name or name == EFFECT_NONE:
+            continue
+        if name not in EFFECTS:
+            raise ValueError(f"未知的效果: {name}")
+        effects.append(EFFECTS[name])
+    return effects
+
+
+def compose_matrices(first, second):
+    """先应用first再应用second的等效仿射颜色矩阵 (只有3×4，不需要NumPy)"""
+    return tuple(
+        tuple(sum(row[k] * first[k][j] for k in range(3)) for j in range(3))
+        + (sum(row[k] * first[k][3] for k in range(3)) + row[3],)
+        for row in second
+    )
+
+
+def stays_in_range(matrix):
+    """颜色矩阵把 0~255 的输入映射后是否仍在 0~255 内 (是则其后的矩阵可以直接融合，不需要中间截断)"""
+    for row in matrix:
+        low = row[3] + 255 * sum(min(c, 0) for c in row[:3])
+        high = row[3] + 255 * sum(max(c, 0) for c in row[:3])
+        if low < -MATRIX_TOLERANCE or high > 255 + MATRIX_TOLERANCE:
+            return False
+    return True
+
+
+def plan_chain(effects):
+    """把相邻的可融合效果合并为一步，返回 [(名称元组, 效果)]
+
+    前一步的结果可能超出 0~255 时不融合，按顺序分步执行 (每步截断)，与逐个应用的结果一致。
+    """
+    steps = []
+    for effect in effects:
+        if (effect.fusable and steps and steps[-1][1].fusable
+                and stays_in_range(steps[-1][1].matrix)):
+            names, previous = steps[-1]
+            fused = Effect("+".join(names + (effect.name,)),
+                           matrix=compose_matrices(previous.matrix, effect.matrix),
+                           cost=max(previous.cost, effect.cost))
+            steps[-1] = (names + (effect.name,), fused)
+        else:
+            steps.append(((effect.name,), effect))
+    return steps
+
+
+def apply_color_matrix(img, matrix):
+    """应用3×4仿射颜色矩阵 (Pillow的C实现，结果四舍五入并截断到0~255)，保留透明通道"""
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA")
+    # 矩阵转换只接受RGB输入
+    rgb = img.convert("RGB") if img.mode == "RGBA" else img
+    result = rgb.convert("RGB", tuple(v for row in matrix for v in row))
+    if img.mode == "RGBA":
+        result.putalpha(img.getchannel("A"))
+    return result
+
+
+def apply_effects(img, chain, scale=1.0):
+    """按顺序应用效果链
+
+    scale: 图像相对于原图的缩放比例，依赖分辨率的效果按该比例缩放参数 (用于缩略图预览)
+    """
+    for _, effect in plan_chain(parse_chain(chain)):
+        if effect.fusable:
+            img = apply_color_matrix(img, effect.matrix)
+            continue
+        if effect.halo is not None:
+            # 分块处理依赖NumPy和多进程，只有可以分块的效果才导入 (颜色效果和实时预览不需要)
+            from tiled_filter import TILED_MEMORY, apply_tiled, should_tile
+
+            if should_tile(img, effect):
+                # 超大图像上的邻域滤镜分块多进程处理
+                img = apply_tiled(img, effect, scale)
+                continue
+            if effect.memory > TILED_MEMORY and MEMORY.under_pressure(img.width * img.height * effect.memory):
+                # 整幅处理的临时内存会超出软内存上限，改为分块处理 (每块的临时内存很小)
+                MEMORY.downgrade(f"{effect.name}分块处理")
+                img = apply_tiled(img, effect, scale)
+                continue
+        img = effect.apply(img, scale)
+    return img
+
+
+def chain_cost(chain, pixels):
+    """效果链处理指定像素数的估计成本 (相对值)"""
+    return sum(effect.cost for effect in parse_chain(chain)) * pixels / 1e6
+
+
+def split_chain(chain):
+    """拆分效果链: (前段, 末尾不依赖分辨率的效果)
+
+    末尾的效果可以先缩小再执行，结果与在原图上执行基本一致。
+    """
+    effects = parse_chain(chain)
+    split = len(effects)
+    while split and not effects[split - 1].resolution_dependent:
+        split -= 1
+    return [e.name for e in effects[:split]], [e.name for e in effects[split:]]
+
+
+def scaled(value, scale, minimum=1):
+    """按缩放比例调整像素参数"""
+    return max(minimum, int(round(value * scale)))
+
+
+def kernel_filter(kernel):
+    """固定卷积核的滤镜 (核大小固定，缩略图上无法等比缩放)"""
+    return lambda img, scale: img.filter(kernel)
+
+
+def box_sum(values, radius):
+    """每个像素周围 (2*radius+1)² 窗口内的和 (越界部分按0计算)"""
+    import numpy as np
+
+    h, w = values.shape
+    padded = np.zeros((h + 2 * radius + 1, w + 2 * radius + 1), dtype=np.int32)
+    padded[radius + 1:radius + 1 + h, radius + 1:radius + 1 + w] = values
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    size = 2 * radius + 1
+    return (integral[size:, size:] - integral[:-size, size:]
+            - integral[size:, :-size] + integral[:-size, :-size])
+
+
+def apply_oil_painting(img, scale=1.0, brush_size=3, roughness=30):
+    """油画效果: 每个像素取周围画笔区域内出现最多的量化颜色
+
+    按颜色逐个用积分图统计窗口内的出现次数，对整幅图像向量化计算。
+    """
+    import numpy as np
+
+    radius = scaled(brush_size, scale)
+    rgba = np.asarray(img.convert("RGBA"))
+    levels = 255 // roughness + 1
+    quantized = rgba[..., :3] // roughness
+    ids = (quantized[..., 0].astype(np.int32) * levels + quantized[..., 1]) * levels + quantized[..., 2]
+
+    best_count = np.zeros(ids.shape, dtype=np.int32)
+    best_id = np.zeros(ids.shape, dtype=np.int32)
+    for color in np.unique(ids):
+        counts = box_sum(ids == color, radius)
+        better = counts > best_count
+        best_count[better] = counts[better]
+        best_id[better] = color
+
+    rgb = np.stack([best_id // (levels * levels), best_id // levels % levels, best_id % levels], axis=-1)
+    result = Image.fromarray((rgb * roughness).astype(np.uint8), "RGB")
+    if img.mode == "RGBA":
+        result.putalpha(img.getchannel("A"))
+    return result
+
+
+def apply_pixelate(img, scale=1.0, pixel_size=8):
+    """像素化效果: 最近邻缩小再放大"""
+    block = scaled(pixel_size, scale)
+    width, height = img.size
+    small = img.resize((max(1, width // block), max(1, height // block)), resample=Image.Resampling.NEAREST)
+    return small.resize((width, height), resample=Image.Resampling.NEAREST)
+
+
+def apply_gaussian_blur(img, scale=1.0, radius=2):
+    """高斯模糊"""
+    return img.filter(ImageFilter.GaussianBlur(radius=radius * scale))
+
+
+for _name, _kernel in (
+    ("模糊", ImageFilter.BLUR),
+    ("轮廓", ImageFilter.CONTOUR),
+    ("锐化", ImageFilter.SHARPEN),
+    ("浮雕", ImageFilter.EMBOSS),
+    ("边缘增强", ImageFilter.EDGE_ENHANCE),
+    ("平滑", ImageFilter.SMOOTH),
+    ("细节增强", ImageFilter.DETAIL),
+):
+    register_effect(Effect(_name, kernel_filter(_kernel), resolution_dependent=True, cost=3.0,
+                           halo=_kernel.filterargs[0][0] // 2))
+
+register_effect(Effect("反色", matrix=[[-1, 0, 0, 255], [0, -1, 0, 255], [0, 0, -1, 255]]))
+register_effect(Effect("黑白", matrix=[[0.299, 0.587, 0.114, 0]] * 3))
+register_effect(Effect("棕褐色", matrix=[[0.393, 0.769, 0.189, 0],
+                                         [0.349, 0.686, 0.168, 0],
+                                         [0.272, 0.534, 0.131, 0]]))
+register_effect(Effect("油画", apply_oil_painting, resolution_dependent=True, cost=40.0,
+                       halo=lambda scale: scaled(3, scale), memory=48))
+register_effect(Effect("像素化", apply_pixelate, resolution_dependent=True, cost=0.5))
+register_effect(Effect("高斯模糊", apply_gaussian_blur, resolution_dependent=True, cost=4.0,
+                       halo=lambda scale: math.ceil(3 * 2 * scale) + 1))
+register_effect(Effect("查找边缘", kernel_filter(ImageFilter.FIND_EDGES), resolution_dependent=True, cost=3.0,
+                       halo=1))
@@ -0,0 +1,150 @@
+"""
+Emoji位图渲染器
+
+彩色Emoji字体 (如NotoColorEmoji) 通常只有固定尺寸的位图 (多为109px)，
+按任意字号加载会失败或反复触发昂贵的加载。这里只按字体的原生尺寸加载一次，
+每个Emoji只光栅化一次并缓存RGBA位图，各图标尺寸从缓存位图高质量缩放得到。
+"""
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+from font_index import FONT_INDEX
+
+# 候选Emoji字体 (按平台常见顺序)
+EMOJI_FONT_CANDIDATES = [
+    "seguiemj.ttf",             # Windows
+    "Apple Color Emoji.ttc",    # macOS
+    "Apple Color Emoji.ttf",
+    "NotoColorEmoji.ttf",       # Linux
+]
+
+# 依次尝试的位图尺寸，109为NotoColorEmoji的原生尺寸，其余为Apple Color Emoji常见尺寸
+EMOJI_STRIKE_SIZES = (109, 160, 96, 64, 48, 40, 32, 20)
+
+# 矢量彩色字体 (如Segoe UI Emoji) 可任意缩放，按该尺寸光栅化以保证大图标清晰
+SCALABLE_STRIKE_SIZE = 256
+
+# 缓存的Emoji位图数量上限
+BITMAP_CACHE_SIZE = 256
+
+# Emoji在图标中所占比例
+EMOJI_SCALE = 0.8
+
+
+class EmojiRenderer:
+    """按原生尺寸加载Emoji字体并缓存每个Emoji的位图"""
+
+    def __init__(self, font_candidates=None):
+        self.font_candidates = list(font_candidates or EMOJI_FONT_CANDIDATES)
+        self._lock = threading.Lock()
+        self._fonts = {}
+        self._bitmaps = OrderedDict()
+
+    def load_font(self, path=None, index=0):
+        """加载Emoji字体 (每个字体只加载一次)，返回 (字体, 光栅化尺寸)
+
+        不指定路径时使用第一个可用的候选字体。
+        """
+        key = (path, index)
+        with self._lock:
+            if key not in self._fonts:
+                candidates = [path] if path else self.font_candidates
+                self._fonts[key] = self.find_font(candidates, index)
+            return self._fonts[key]
+
+    def find_font(self, candidates, index=0):
+        """找到第一个可用的Emoji字体及其可用尺寸"""
+        for name in candidates:
+            font = self.open_at_native_size(name, index)
+            if font:
+                return font
+
+        # 候选字体都不存在时，从字体索引中找Emoji字体
+        if FONT_INDEX.ready:
+            for family in FONT_INDEX.families():
+                if "emoji" in family.lower():
+                    record = FONT_INDEX.find(family)
+                    font = self.open_at_native_size(record["path"], record["index"])
+                    if font:
+                        return font
+
+        # 没有Emoji字体时退回默认字体
+        try:
+            return ImageFont.load_default(size=SCALABLE_STRIKE_SIZE), SCALABLE_STRIKE_SIZE
+        except TypeError:
+            return ImageFont.load_default(), 10
+
+    def open_at_native_size(self, name, index=0):
+        """按字体的原生尺寸打开字体，失败返回None"""
+        # 位图字体没有256px的尺寸，能加载说明是可缩放的矢量字体
+        try:
+            return ImageFont.truetype(name, SCALABLE_STRIKE_SIZE, index=index), SCALABLE_STRIKE_SIZE
+        except OSError:
+            pass
+
+        for strike in EMOJI_STRIKE_SIZES:
+            try:
+                return ImageFont.truetype(name, strike, index=index), strike
+            except OSError:
+                continue
+        return None
+
+    def font_for(self, emoji_char):
+        """选择能显示该Emoji的字体，默认字体缺字时从字体索引中找后备字体"""
+        font, strike = self.load_font()
+        if FONT_INDEX.ready:
+            record = FONT_INDEX.find_by_path(getattr(font, "path", None), getattr(font, "index", 0))
+            if record is None or not FONT_INDEX.covers(record, emoji_char):
+                fallback = FONT_INDEX.find_covering_font(emoji_char, prefer="emoji")
+                if fallback:
+                    return self.load_font(fallback["path"], fallback["index"])
+        return font, strike
+
+    def rasterize(self, emoji_char):
+        """把Emoji光栅化为裁掉空白的RGBA位图 (按Emoji序列和字体缓存)"""
+        font, strike = self.font_for(emoji_char)
+        key = (emoji_char, id(font))
+        with self._lock:
+            bitmap = self._bitmaps.get(key)
+            if bitmap is not None:
+                self._bitmaps.move_to_end(key)
+                return bitmap
+
+        # 画布留足余量，组合Emoji (如旗帜、家庭) 可能比一个字宽
+        canvas_size = strike * (2 + len(emoji_char))
+        canvas = Image.new("RGBA", (canvas_size, strike * 2), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(canvas)
+        draw.text((strike // 2, strike // 2), emoji_char, font=font, embedded_color=True)
+
+        bbox = canvas.getchannel("A").getbbox()
+        bitmap = canvas.crop(bbox) if bbox else Image.new("RGBA", (1, 1), (0, 0, 0, 0))
+
+        with self._lock:
+            self._bitmaps[key] = bitmap
+            while len(self._bitmaps) > BITMAP_CACHE_SIZE:
+                self._bitmaps.popitem(last=False)
+        return bitmap
+
+    def render(self, emoji_char, size, scale=EMOJI_SCALE):
+        """从缓存位图缩放得到指定尺寸的透明背景图标"""
+        bitmap = self.rasterize(emoji_char)
+        img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+
+        target = max(1, int(size * scale))
+        ratio = target / max(bitmap.size)
+        width = max(1, round(bitmap.size[0] * ratio))
+        height = max(1, round(bitmap.size[1] * ratio))
+
+        if (width, height) != bitmap.size:
+            glyph = bitmap.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        else:
+            glyph = bitmap
+
+        img.paste(glyph, ((size - width) // 2, (size - height) // 2), glyph)
+        return img
+
+
+# 全局共享的渲染器 (缓存在多次生成之间复用)
+EMOJI_RENDERER = EmojiRenderer()
@@ -0,0 +1,428 @@
+"""
+系统字体索引
+
+扫描系统字体目录一次，记录每个字体的家族名 (含本地化名称)、样式、路径和
+支持的码位区间，并保存到缓存文件。缓存按字体目录的修改时间失效，目录未变化时
+直接读取缓存，目录变化时只重新解析新增或修改过的字体文件。
+
+字体表直接用struct解析 (name/cmap)，无需额外依赖，也不需要加载整个字体。
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+
+# 缓存格式版本，解析逻辑变化时递增
+INDEX_VERSION = 1
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc", ".otc")
+
+# 样式别名 -> 标准样式名
+STYLE_ALIASES = {
+    "normal": "regular",
+    "roman": "regular",
+    "book": "regular",
+    "oblique": "italic",
+    "bold oblique": "bold italic",
+}
+
+# name表中的英语语言ID (Windows平台)
+LANG_ENGLISH_US = 0x409
+
+
+def default_font_dirs():
+    """当前平台的系统字体目录"""
+    home = os.path.expanduser("~")
+    if sys.platform == "win32":
+        windir = os.environ.get("WINDIR", r"C:\Windows")
+        dirs = [os.path.join(windir, "Fonts")]
+        local = os.environ.get("LOCALAPPDATA")
+        if local:
+            dirs.append(os.path.join(local, "Microsoft", "Windows", "Fonts"))
+    elif sys.platform == "darwin":
+        dirs = ["/System/Library/Fonts", "/Library/Fonts", os.path.join(home, "Library", "Fonts")]
+    else:
+        dirs = ["/usr/share/fonts", "/usr/local/share/fonts",
+                os.path.join(home, ".fonts"), os.path.join(home, ".local", "share", "fonts")]
+    return [d for d in dirs if os.path.isdir(d)]
+
+
+def default_cache_path():
+    """字体索引缓存文件位置"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "AdvancedIconGenerator", "font_index.json")
+
+
+def normalize_name(name):
+    """家族名/样式名统一为小写并去掉多余空白"""
+    return " ".join(name.lower().split())
+
+
+def normalize_style(style):
+    style = normalize_name(style or "regular")
+    return STYLE_ALIASES.get(style, style)
+
+
+def read_table_directory(data, offset):
+    """读取sfnt表目录，返回 {表名: (偏移, 长度)}"""
+    num_tables = struct.unpack_from(">H", data, offset + 4)[0]
+    tables = {}
+    for i in range(num_tables):
+        tag, _, table_offset, length = struct.unpack_from(">4sIII", data, offset + 12 + 16 * i)
+        tables[tag.decode("latin-1")] = (table_offset, length)
+    return tables
+
+
+def read_names(data, table):
+    """解析name表，返回 (家族名列表, 样式名)，第一个家族名为英文名"""
+    offset, _ = table
+    _, count, string_offset = struct.unpack_from(">HHH", data, offset)
+    families = {}
+    styles = {}
+    for i in range(count):
+        platform, encoding, language, name_id, length, str_offset = struct.unpack_from(
+            ">HHHHHH", data, offset + 6 + 12 * i)
+        if name_id not in (1, 2, 16, 17):
+            continue
+        raw = data[offset + string_offset + str_offset:offset + string_offset + str_offset + length]
+        if platform == 3 or platform == 0:
+            text = raw.decode("utf-16-be", errors="ignore")
+        elif platform == 1 and encoding == 0:
+            text = raw.decode("mac_roman", errors="ignore")
+        else:
+            continue
+        text = text.strip("\x00 ").strip()
+        if not text:
+            continue
+
+        # 英文名优先
+        priority = 0 if (platform == 3 and language == LANG_ENGLISH_US) or platform == 1 else 1
+        target = families if name_id in (1, 16) else styles
+        # 排版名 (16/17) 优先于旧式名 (1/2)
+        rank = (0 if name_id in (16, 17) else 1, priority)
+        target.setdefault(text, rank)
+        target[text] = min(target[text], rank)
+
+    family_names = sorted(families, key=lambda n: families[n])
+    style = min(styles, key=lambda n: styles[n]) if styles else "Regular"
+    return family_names, style
+
+
+def read_format4(data, offset):
+    """解析cmap格式4子表的码位区间"""
+    seg_count = struct.unpack_from(">H", data, offset + 6)[0] // 2
+    end_codes = struct.unpack_from(f">{seg_count}H", data, offset + 14)
+    start_pos = offset + 16 + seg_count * 2
+    start_codes = struct.unpack_from(f">{seg_count}H", data, start_pos)
+    range_pos = start_pos + seg_count * 4
+    range_offsets = struct.unpack_from(f">{seg_count}H", data, range_pos)
+
+    ranges = []
+    for i in range(seg_count):
+        start, end = start_codes[i], end_codes[i]
+        if start == 0xFFFF:
+            continue
+        if range_offsets[i] == 0:
+            ranges.append((start, end))
+            continue
+
+        # 经glyphIdArray映射的区段，只保留有字形的码位
+        run_start = None
+        for code in range(start, end + 1):
+            pos = range_pos + i * 2 + range_offsets[i] + (code - start) * 2
+            glyph = struct.unpack_from(">H", data, pos)[0] if pos + 2 <= len(data) else 0
+            if glyph:
+                if run_start is None:
+                    run_start = code
+            elif run_start is not None:
+                ranges.append((run_start, code - 1))
+                run_start = None
+        if run_start is not None:
+            ranges.append((run_start, end))
+    return ranges
+
+
+def read_format12(data, offset):
+    """解析cmap格式12子表的码位区间"""
+    num_groups = struct.unpack_from(">I", data, offset + 12)[0]
+    ranges = []
+    for i in range(num_groups):
+        start, end, _ = struct.unpack_from(">III", data, offset + 16 + 12 * i)
+        ranges.append((start, end))
+    return ranges
+
+
+def read_cmap(data, table):
+    """解析cmap表，返回合并后的码位区间 [[起始, 结束], ...]"""
+    offset, _ = table
+    num_tables = struct.unpack_from(">H", data, offset + 2)[0]
+    subtables = {}
+    for i in range(num_tables):
+        platform, encoding, sub_offset = struct.unpack_from(">HHI", data, offset + 4 + 8 * i)
+        sub_format = struct.unpack_from(">H", data, offset + sub_offset)[0]
+        subtables.setdefault((platform, encoding, sub_format), offset + sub_offset)
+
+    # 优先完整Unicode的格式12，其次BMP的格式4
+    ranges = []
+    for key in ((3, 10, 12), (0, 4, 12), (0, 6, 12), (0, 3, 12)):
+        if key in subtables:
+            ranges = read_format12(data, subtables[key])
+            break
+    else:
+        for key in ((3, 1, 4), (0, 3, 4), (0, 1, 4), (3, 0, 4)):
+            if key in subtables:
+                ranges = read_format4(data, subtables[key])
+                break
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def read_font_file(path):
+    """解析字体文件 (含TTC集合)，返回字体记录列表"""
+    # 用mmap只读取用到的表，大型CJK字体无需整个读入内存
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return read_font_data(data, path)
+
+
+def read_font_data(data, path):
+    """从字体数据中读取字体记录"""
+    if data[:4] == b"ttcf":
+        num_fonts = struct.unpack_from(">I", data, 8)[0]
+        offsets = struct.unpack_from(f">{num_fonts}I", data, 12)
+    else:
+        offsets = (0,)
+
+    records = []
+    for index, font_offset in enumerate(offsets):
+        tables = read_table_directory(data, font_offset)
+        if "name" not in tables:
+            continue
+        families, style = read_names(data, tables["name"])
+        if not families:
+            continue
+        ranges = read_cmap(data, tables["cmap"]) if "cmap" in tables else []
+        records.append({
+            "path": path,
+            "index": index,
+            "family": families[0],
+            "aliases": families,
+            "style": style,
+            "ranges": ranges,
+        })
+    return records
+
+
+class FontIndex:
+    """系统字体索引 (线程安全，加载后只读)"""
+
+    def __init__(self, cache_path=None, font_dirs=None):
+        self.cache_path = cache_path or default_cache_path()
+        self.font_dirs = font_dirs
+        self.ready = False
+        self._lock = threading.Lock()
+        self.fonts = []
+        self._by_family = {}
+        self._by_path = {}
+        self._by_block = {}
+        self._coverage_cache = {}
+
+    def load(self):
+        """从缓存加载索引，字体目录变化时增量重新扫描"""
+        with self._lock:
+            if self.ready:
+                return self
+
+            font_dirs = self.font_dirs if self.font_dirs is not None else default_font_dirs()
+            dir_mtimes = self.scan_dir_mtimes(font_dirs)
+
+            cache = self.read_cache()
+            if cache and cache.get("dirs") == dir_mtimes:
+                fonts = cache["fonts"]
+                files = cache["files"]
+            else:
+                files, fonts = self.scan_fonts(font_dirs, cache or {})
+                self.write_cache({"version": INDEX_VERSION, "dirs": dir_mtimes,
+                                  "files": files, "fonts": fonts})
+
+            self.build_lookup(fonts)
+            self.ready = True
+            return self
+
+    def scan_dir_mtimes(self, font_dirs):
+        """记录所有字体目录 (含子目录) 的修改时间"""
+        mtimes = {}
+        for root_dir in font_dirs:
+            for dirpath, _, _ in os.walk(root_dir):
+                try:
+                    mtimes[dirpath] = os.path.getmtime(dirpath)
+                except OSError:
+                    continue
+        return mtimes
+
+    def scan_fonts(self, font_dirs, cache):
+        """扫描字体文件，未变化的文件直接沿用缓存中的记录"""
+        old_files = cache.get("files", {}) if cache.get("version") == INDEX_VERSION else {}
+        old_fonts = {}
+        for record in cache.get("fonts", []) if old_files else []:
+            old_fonts.setdefault(record["path"], []).append(record)
+
+        files = {}
+        fonts = []
+        for root_dir in font_dirs:
+            for dirpath, _, filenames in os.walk(root_dir):
+                for filename in filenames:
+                    if not filename.lower().endswith(FONT_EXTENSIONS):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    signature = [stat.st_mtime, stat.st_size]
+                    files[path] = signature
+
+                    if old_files.get(path) == signature and path in old_fonts:
+                        fonts.extend(old_fonts[path])
+                        continue
+                    try:
+                        fonts.extend(read_font_file(path))
+                    except (OSError, struct.error, ValueError):
+                        # 损坏或不支持的字体文件
+                        continue
+        return files, fonts
+
+    def read_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get("version") != INDEX_VERSION:
+            return None
+        return cache
+
+    def write_cache(self, cache):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = self.cache_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            print(f"字体索引缓存写入失败: {e}")
+
+    def build_lookup(self, fonts):
+        """建立家族名和码位块 (256个码位一块) 的查找表"""
+        self.fonts = fonts
+        self._by_family = {}
+        self._by_path = {}
+        self._by_block = {}
+        self._coverage_cache = {}
+        for font_id, record in enumerate(fonts):
+            record["starts"] = [r[0] for r in record["ranges"]]
+            self._by_path.setdefault((os.path.normcase(record["path"]), record["index"]), font_id)
+            for name in record["aliases"]:
+                styles = self._by_family.setdefault(normalize_name(name), {})
+                styles.setdefault(normalize_style(record["style"]), font_id)
+
+            blocks = set()
+            for start, end in record["ranges"]:
+                blocks.update(range(start >> 8, (end >> 8) + 1))
+            for block in blocks:
+                self._by_block.setdefault(block, []).append(font_id)
+
+    def families(self):
+        """所有字体的家族名 (含本地化名称)"""
+        names = set()
+        for record in self.fonts:
+            names.update(record["aliases"])
+        return sorted(names)
+
+    def find(self, family, style="regular"):
+        """按家族名和样式查找字体记录"""
+        styles = self._by_family.get(normalize_name(family))
+        if not styles:
+            return None
+        style = normalize_style(style)
+        font_id = styles.get(style)
+        if font_id is None:
+            font_id = styles.get("regular", next(iter(styles.values())))
+        return self.fonts[font_id]
+
+    def find_by_path(self, path, index=0):
+        """按字体文件路径查找字体记录"""
+        if not isinstance(path, str):
+            return None
+        font_id = self._by_path.get((os.path.normcase(path), index))
+        return self.fonts[font_id] if font_id is not None else None
+
+    def has_codepoint(self, record, codepoint):
+        """字体是否包含某个码位"""
+        i = bisect.bisect_right(record["starts"], codepoint) - 1
+        return i >= 0 and record["ranges"][i][1] >= codepoint
+
+    def covers(self, record, text):
+        """字体是否包含文本中所有 (可见) 字符"""
+        return all(self.has_codepoint(record, ord(ch)) for ch in text if not is_ignorable(ch))
+
+    def find_covering_font(self, text, prefer=None):
+        """找到能显示整段文本的字体记录 (结果缓存)"""
+        key = (text, prefer)
+        if key in self._coverage_cache:
+            return self._coverage_cache[key]
+
+        codepoints = [ord(ch) for ch in text if not is_ignorable(ch)]
+        result = None
+        if codepoints:
+            candidates = self._by_block.get(codepoints[0] >> 8, [])
+            matches = [self.fonts[i] for i in candidates
+                       if all(self.has_codepoint(self.fonts[i], cp) for cp in codepoints)]
+            if prefer:
+                preferred = [r for r in matches if prefer.lower() in r["family"].lower()]
+                matches = preferred or matches
+            if matches:
+                # 同等条件下优先常规样式
+                matches.sort(key=lambda r: normalize_style(r["style"]) != "regular")
+                result = matches[0]
+
+        self._coverage_cache[key] = result
+        return result
+
+    def resolve(self, family, style="regular", text=""):
+        """把家族名解析为 (字体路径, TTC索引)
+
+        选中的字体不能显示文本时改用能覆盖文本的后备字体；
+        索引未就绪或找不到时原样返回家族名，交给Pillow自行查找。
+        """
+        if not self.ready:
+            return family, 0
+
+        record = self.find(family, style)
+        if text and (record is None or not self.covers(record, text)):
+            record = self.find_covering_font(text) or record
+        if record is None:
+            return family, 0
+        return record["path"], record["index"]
+
+
+def is_ignorable(ch):
+    """变体选择符、零宽连接符等不需要字形的字符"""
+    code = ord(ch)
+    return (code in (0x200D, 0x20E3) or 0xFE00 <= code <= 0xFE0F
+            or 0xE0020 <= code <= 0xE007F or ch.isspace())
+
+
+# 全局字体索引 (在后台线程中加载)
+FONT_INDEX = FontIndex()
@@ -0,0 +1,307 @@
+"""
+金标准图像回归检查
+
+用固定的样例 (合成的源图、文字、SVG、CSS、图表等) 经过每种生成方式渲染，与保存的参考图逐像素比较，
+防止性能优化 (效果、渐变背景、形状蒙版、缩放路径等) 悄悄改变输出。
+每个样例的各尺寸图标横向拼成一张图保存和比较，比较指标全部向量化计算:
+- 各通道 (R、G、B、A) 的最大误差
+- PSNR (所有通道)
+- SSIM (见 quality_encode.ssim)
+每个样例有各自的容差；不通过时在 golden/diff 中写出参考图、当前结果和放大后的差异图。
+
+参考图提交在 golden 目录中，缺少参考图的样例算作不通过。参考图与字体、SVG后端和Pillow版本有关，
+换了环境 (例如安装了cairosvg) 时先在检查通过的提交上重新生成，再检查修改:
+    python golden.py --update          # 用当前实现生成参考图
+    python golden.py                   # 渲染所有样例并与参考图比较，有不通过或缺少参考图的样例时返回1
+    python golden.py --only 图片 效果   # 只检查名称包含这些文字的样例
+    python golden.py --list            # 列出所有样例
+"""
+import argparse
+import io
+import math
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import icon_render
+from effects import EFFECTS
+from icon_import import decode_entry, read_icon_data
+from icon_store import DITHER_FLOYD_STEINBERG, IconSet, write_ico
+from quality_encode import ssim
+
+# 仓库目录
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 参考图的目录 (差异图写在其中的 diff 子目录)
+GOLDEN_DIR = os.path.join(ROOT, "golden")
+
+# 样例渲染的尺寸 (包含需要缩小很多倍的小尺寸和接近源图的大尺寸)
+GOLDEN_SIZES = (16, 32, 48, 128)
+
+# 默认容差: 各通道最大误差、最低PSNR (dB)、最低SSIM
+DEFAULT_TOLERANCE = {"max_error": 2, "psnr": 45.0, "ssim": 0.995}
+
+# 差异图的放大倍数
+DIFF_GAIN = 8
+
+# 示例源图的尺寸 (非正方形，覆盖缩放时的宽高比变化)
+SOURCE_SIZE = (320, 240)
+
+SAMPLE_SVG = """<svg width="100" height="100" xmlns="http://www.w3.org/2000/svg">
+  <defs><linearGradient id="g"><stop offset="0" stop-color="#36c"/><stop offset="1" stop-color="#fc3"/></linearGradient></defs>
+  <rect x="8" y="8" width="84" height="84" rx="16" fill="url(#g)"/>
+  <circle cx="50" cy="50" r="24" fill="none" stroke="#fff" stroke-width="6"/>
+  <polygon points="50,30 56,46 72,46 59,56 64,72 50,62 36,72 41,56 28,46 44,46" fill="#c33"/>
+</svg>"""
+
+SAMPLE_CSS = """width: 100px;
+height: 100px;
+background: linear-gradient(45deg, #ff0000, #ffff00);
+border: 4px solid #333333;
+border-radius: 20%;
+box-shadow: 3px 3px 6px rgba(0,0,0,0.5);"""
+
+SAMPLE_CHART = """x = [1, 2, 3, 4, 5]
+y = [2, 4, 1, 5, 3]"""
+
+
+class Fixture:
+    """一个样例: render() 返回各尺寸的图像列表，tolerance 覆盖默认容差的部分指标
+
+    容差中的最大误差为None时不检查 (例如量化类效果，个别像素可能整体跳到另一个颜色)。
+    """
+
+    def __init__(self, name, render, **tolerance):
+        self.name = name
+        self.render = render
+        self.tolerance = dict(DEFAULT_TOLERANCE, **tolerance)
+
+
+def make_source():
+    """合成的示例源图: 平滑渐变、硬边缘、细线和半透明区域"""
+    width, height = SOURCE_SIZE
+    y, x = np.mgrid[0:height, 0:width]
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    rgba[..., 0] = x * 255 // (width - 1)
+    rgba[..., 1] = y * 255 // (height - 1)
+    rgba[..., 2] = ((x + y) * 4 % 256)
+    rgba[..., 3] = 255
+    # 右侧为透明度渐变
+    rgba[:, width * 3 // 4:, 3] = np.linspace(255, 64, width - width * 3 // 4).astype(np.uint8)
+    img = Image.fromarray(rgba, "RGBA")
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((40, 40, 160, 160), fill=(250, 250, 240, 255), outline=(20, 20, 20, 255), width=6)
+    draw.rectangle((180, 60, 230, 200), fill=(30, 120, 60, 255))
+    for i in range(0, width, 12):
+        draw.line((i, height - 30, i + 6, height - 2), fill=(0, 0, 0, 255), width=1)
+    return img
+
+
+_source = None
+
+
+def source_image():
+    global _source
+    if _source is None:
+        _source = make_source()
+    return _source.copy()
+
+
+def image_fixture(**settings):
+    """图片源 (全部处理流程: 调整、效果、缩放、形状蒙版)"""
+    spec = {"type": "image", "sizes": list(GOLDEN_SIZES), "settings": settings}
+    return lambda: icon_images(icon_render.render_icon_set(dict(spec, image=source_image())))
+
+
+def spec_fixture(spec):
+    return lambda: icon_images(icon_render.render_icon_set(dict(spec, sizes=list(GOLDEN_SIZES))))
+
+
+def icon_images(icons):
+    return [icons[i] for i in range(len(icons))]
+
+
+def gradient_fixture(direction):
+    return lambda: [icon_render.create_gradient_image(size, "#3366CC", "#FFCC33", direction)
+                    for size in GOLDEN_SIZES]
+
+
+def ico_palette_fixture():
+    """低位深ICO条目 (调色板量化和抖动)，写入ICO后再读回"""
+    buffer = io.BytesIO()
+    write_ico(IconSet(image_fixture()()), buffer, depths={16: 4, 32: 8, 48: 8}, dither=DITHER_FLOYD_STEINBERG)
+    data = buffer.getvalue()
+    fmt, entries = read_icon_data(data)
+    return [decode_entry(data, fmt, entry) for entry in entries]
+
+
+def fixtures():
+    """所有样例"""
+    items = [
+        Fixture("图片/默认", image_fixture()),
+        Fixture("图片/调整", image_fixture(brightness=1.2, contrast=0.8, saturation=1.5, alpha=0.8)),
+        Fixture("图片/分尺寸调整", image_fixture(size_settings={
+            16: {"brightness": 1.3, "contrast": 1.2, "saturation": 1.0, "alpha": 1.0},
+            48: {"brightness": 1.0, "contrast": 1.0, "saturation": 0.5, "alpha": 0.6},
+        })),
+        Fixture("图片/效果链", image_fixture(effect="棕褐色+像素化")),
+    ]
+    for name, effect in EFFECTS.items():
+        # 油画取窗口内最多的量化颜色，计数相同时的选择变化会使个别像素整体变色
+        tolerance = {"max_error": None, "psnr": 30.0, "ssim": 0.97} if name == "油画" else {}
+        items.append(Fixture(f"效果/{name}", image_fixture(effect=name), **tolerance))
+    for shape in ("圆形", "圆角矩形", "星形", "心形", "三角形"):
+        items.append(Fixture(f"形状/{shape}", image_fixture(shape=shape, radius=12)))
+    for direction in ("水平", "垂直", "对角"):
+        items.append(Fixture(f"渐变/{direction}", gradient_fixture(direction)))
+    items += [
+        Fixture("文字/纯色", spec_fixture({"type": "text", "text": "Ab", "settings": {
+            "bg_color": "#2255AA", "text_color": "#FFFFFF", "shape": "圆角矩形"}})),
+        Fixture("文字/渐变", spec_fixture({"type": "text", "text": "图", "settings": {
+            "bg_type": "渐变", "bg_color": "#FF6600", "bg_color2": "#3300CC", "gradient_dir": "对角",
+            "shape": "圆形"}})),
+        Fixture("Unicode", spec_fixture({"type": "unicode", "text": "★", "settings": {"font_color": "#CC3300"}})),
+        Fixture("Emoji", spec_fixture({"type": "emoji", "text": "😀"})),
+        Fixture("SVG", spec_fixture({"type": "svg", "svg": SAMPLE_SVG, "bg_color": "#EEEEEE"})),
+        Fixture("CSS", spec_fixture({"type": "css", "css": SAMPLE_CSS})),
+        Fixture("图表", spec_fixture({"type": "matplotlib", "code": SAMPLE_CHART, "chart_type": "折线图"})),
+        Fixture("ICO/调色板", ico_palette_fixture),
+    ]
+    return items
+
+
+def contact_sheet(images):
+    """把各尺寸图像横向拼成一张RGBA图 (间隔透明)"""
+    images = [img.convert("RGBA") for img in images]
+    width = sum(img.width for img in images) + 2 * (len(images) - 1)
+    height = max(img.height for img in images)
+    sheet = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    x = 0
+    for img in images:
+        sheet.paste(img, (x, 0))
+        x += img.width + 2
+    return sheet
+
+
+def compare(expected, actual):
+    """比较两张RGBA图，返回 {"max_error": [R, G, B, A], "psnr", "ssim"}；尺寸不同时返回None"""
+    if expected.size != actual.size:
+        return None
+    a = np.asarray(expected.convert("RGBA"), dtype=np.int16)
+    b = np.asarray(actual.convert("RGBA"), dtype=np.int16)
+    diff = np.abs(a - b)
+    mse = float((diff.astype(np.float64) ** 2).mean())
+    return {
+        "max_error": diff.reshape(-1, 4).max(axis=0).tolist(),
+        "psnr": math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse),
+        "ssim": 1.0 if mse == 0 else ssim(expected, actual),
+    }
+
+
+def passes(metrics, tolerance):
+    if metrics is None:
+        return False
+    if tolerance["max_error"] is not None and max(metrics["max_error"]) > tolerance["max_error"]:
+        return False
+    return metrics["psnr"] >= tolerance["psnr"] and metrics["ssim"] >= tolerance["ssim"]
+
+
+def diff_image(expected, actual):
+    """放大后的逐像素差异 (RGB通道取各通道差异，alpha差异叠加为品红色)"""
+    a = np.asarray(expected.convert("RGBA"), dtype=np.int16)
+    b = np.asarray(actual.convert("RGBA"), dtype=np.int16)
+    diff = np.abs(a - b)
+    rgb = np.clip(diff[..., :3] * DIFF_GAIN, 0, 255)
+    alpha = np.clip(diff[..., 3] * DIFF_GAIN, 0, 255)
+    rgb[..., 0] = np.maximum(rgb[..., 0], alpha)
+    rgb[..., 2] = np.maximum(rgb[..., 2], alpha)
+    return Image.fromarray(rgb.astype(np.uint8), "RGB")
+
+
+def file_name(name):
+    return name.replace("/", "-")
+
+
+def write_diff(diff_dir, name, expected, actual):
+    """写出参考图、当前结果和差异图，返回差异图路径"""
+    os.makedirs(diff_dir, exist_ok=True)
+    base = os.path.join(diff_dir, file_name(name))
+    actual.save(base + "-actual.png")
+    if expected is not None:
+        expected.save(base + "-expected.png")
+        if expected.size == actual.size:
+            diff_image(expected, actual).save(base + "-diff.png")
+    return base + "-diff.png"
+
+
+def format_metrics(metrics):
+    if metrics is None:
+        return "尺寸不同"
+    psnr = "inf" if math.isinf(metrics["psnr"]) else f"{metrics['psnr']:.1f}"
+    return f"最大误差 {'/'.join(map(str, metrics['max_error']))}  PSNR {psnr}  SSIM {metrics['ssim']:.4f}"
+
+
+def run(selected, update=False, golden_dir=GOLDEN_DIR):
+    """渲染样例，更新参考图或与参考图比较，返回不通过的样例数"""
+    os.makedirs(golden_dir, exist_ok=True)
+    diff_dir = os.path.join(golden_dir, "diff")
+    failed = 0
+    start = time.perf_counter()
+    for fixture in selected:
+        path = os.path.join(golden_dir, file_name(fixture.name) + ".png")
+        t = time.perf_counter()
+        try:
+            sheet = contact_sheet(fixture.render())
+        except Exception as e:
+            print(f"错误  {fixture.name}: {e}")
+            failed += 1
+            continue
+        ms = (time.perf_counter() - t) * 1000
+
+        if update:
+            sheet.save(path)
+            print(f"更新  {fixture.name} ({ms:.0f} ms)")
+            continue
+        if not os.path.exists(path):
+            write_diff(diff_dir, fixture.name, None, sheet)
+            print(f"缺少  {fixture.name}: 没有参考图，请在检查通过的提交上运行 --update 生成")
+            failed += 1
+            continue
+
+        expected = Image.open(path)
+        expected.load()
+        metrics = compare(expected, sheet)
+        if passes(metrics, fixture.tolerance):
+            print(f"通过  {fixture.name}: {format_metrics(metrics)} ({ms:.0f} ms)")
+        else:
+            failed += 1
+            diff = write_diff(diff_dir, fixture.name, expected, sheet)
+            print(f"失败  {fixture.name}: {format_metrics(metrics)}，容差 {fixture.tolerance}\n"
+                  f"      差异图: {diff}")
+    print(f"共 {len(selected)} 个样例，{failed} 个不通过，用时 {time.perf_counter() - start:.1f} 秒")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="金标准图像回归检查")
+    parser.add_argument("--update", action="store_true", help="用当前实现重新生成参考图")
+    parser.add_argument("--only", nargs="+", metavar="文字", help="只处理名称包含这些文字的样例")
+    parser.add_argument("--list", action="store_true", help="列出所有样例")
+    parser.add_argument("--dir", default=GOLDEN_DIR, help=f"参考图目录 (默认 {GOLDEN_DIR})")
+    args = parser.parse_args(argv)
+
+    selected = fixtures()
+    if args.only:
+        selected = [f for f in selected if any(text in f.name for text in args.only)]
+    if args.list:
+        for fixture in selected:
+            print(fixture.name)
+        return 0
+    return 1 if run(selected, args.update, args.dir) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
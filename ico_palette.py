@@ -0,0 +1,223 @@
+"""
+ICO调色板条目
+
+小尺寸图标 (16/24/32px) 不必使用32位RGBA，可按位深策略写成1/4/8位调色板条目:
+- BMP条目 (含AND蒙版)，所有Windows版本都支持；未压缩，颜色较多时可能比32位PNG条目更大
+- PNG条目 (调色板PNG + tRNS)，通常是最小的，需要Vista及以上
+- 调色板由向量化的中位切分 (median-cut) 生成，颜色数不超过上限时直接使用原有颜色 (无损)
+- 可选有序 (Bayer) 抖动或 Floyd–Steinberg 抖动，只作用于不透明像素，透明边缘不产生噪点
+- 透明度按阈值生成1位AND蒙版 (1表示透明)，透明像素的颜色写为黑色，符合ICO的XOR/AND合成规则
+"""
+import io
+import struct
+
+import numpy as np
+from PIL import Image
+
+from icon_store import DITHER_MODES, DITHER_NONE, DITHER_ORDERED
+
+# 不透明度阈值: alpha不小于该值的像素视为不透明
+ALPHA_THRESHOLD = 128
+
+# 支持的调色板位深
+PALETTE_DEPTHS = (1, 4, 8)
+
+# 最近颜色查找时每批处理的像素数 (限制临时数组大小)
+NEAREST_CHUNK = 4096
+
+
+def bayer_matrix(n=8):
+    """n×n的Bayer阈值矩阵，取值范围 [-0.5, 0.5)"""
+    m = np.zeros((1, 1))
+    while m.shape[0] < n:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]])
+    return m / (n * n) - 0.5
+
+
+def median_cut(colors, counts, n):
+    """对 (颜色, 出现次数) 做中位切分，返回不超过n个颜色的调色板 (k, 3) uint8"""
+    if len(colors) <= n:
+        return colors.astype(np.uint8)
+
+    def box(c, w):
+        # (各通道范围, 颜色, 次数)
+        return np.ptp(c, axis=0), c, w
+
+    boxes = [box(colors.astype(np.int32), counts.astype(np.int64))]
+    ranges = [boxes[0][0].max()]
+    while len(boxes) < n:
+        # 选取颜色范围最大的盒子切分
+        index = int(np.argmax(ranges))
+        if ranges[index] <= 0:
+            break
+        spans, c, w = boxes.pop(index)
+        ranges.pop(index)
+        order = np.argsort(c[:, int(spans.argmax())], kind="stable")
+        c, w = c[order], w[order]
+        # 按像素数加权的中位数切分，两侧至少各保留一种颜色
+        split = int(np.searchsorted(np.cumsum(w), w.sum() / 2))
+        split = min(max(split, 1), len(c) - 1)
+        for part in (box(c[:split], w[:split]), box(c[split:], w[split:])):
+            boxes.append(part)
+            ranges.append(part[0].max())
+
+    palette = [np.average(c, axis=0, weights=w) for _, c, w in boxes]
+    return np.clip(np.rint(palette), 0, 255).astype(np.uint8)
+
+
+def nearest_indices(pixels, palette):
+    """每个像素在调色板中最近颜色的下标 (分批向量化计算)"""
+    pixels = pixels.astype(np.float32)
+    pal = palette.astype(np.float32)
+    result = np.empty(len(pixels), dtype=np.uint8)
+    for start in range(0, len(pixels), NEAREST_CHUNK):
+        chunk = pixels[start:start + NEAREST_CHUNK]
+        dist = ((chunk[:, None, :] - pal[None, :, :]) ** 2).sum(axis=2)
+        result[start:start + NEAREST_CHUNK] = dist.argmin(axis=1)
+    return result
+
+
+def fs_indices(rgb, palette):
+    """Floyd–Steinberg抖动映射到调色板 (使用Pillow的C实现)"""
+    pal = np.zeros((256, 3), dtype=np.uint8)
+    pal[:] = palette[0]
+    pal[:len(palette)] = palette
+    pal_img = Image.new("P", (1, 1))
+    pal_img.putpalette(pal.tobytes())
+    mapped = Image.fromarray(rgb, "RGB").quantize(palette=pal_img, dither=Image.Dither.FLOYDSTEINBERG)
+    indices = np.asarray(mapped, dtype=np.uint8)
+    # 填充的重复颜色映射回第一个颜色
+    return np.where(indices >= len(palette), 0, indices)
+
+
+def quantize(img, bits, dither=DITHER_NONE, exclusive=False):
+    """把图像量化为 2**bits 色调色板
+
+    返回 (调色板 (k, 3) uint8, 下标 (h, w) uint8, 透明蒙版 (h, w) bool)
+    有透明像素时调色板第0项固定为黑色，供透明像素使用。
+    exclusive 为真时第0项只给透明像素使用 (调色板PNG用tRNS把第0项标记为透明)；
+    BMP条目的透明度由AND蒙版决定，不透明像素也可以使用第0项的黑色。
+    """
+    if bits not in PALETTE_DEPTHS:
+        raise ValueError(f"不支持的调色板位深: {bits}")
+    if dither not in DITHER_MODES:
+        raise ValueError(f"不支持的抖动方式: {dither}")
+
+    rgba = np.asarray(img.convert("RGBA"))
+    rgb = rgba[..., :3]
+    transparent = rgba[..., 3] < ALPHA_THRESHOLD
+    opaque_pixels = rgb[~transparent]
+
+    max_colors = 1 << bits
+    reserve = 1 if transparent.any() else 0
+    if len(opaque_pixels):
+        colors, counts = np.unique(opaque_pixels, axis=0, return_counts=True)
+        palette = median_cut(colors, counts, max_colors - reserve)
+    else:
+        palette = np.zeros((0, 3), dtype=np.uint8)
+    if reserve:
+        palette = np.vstack([np.zeros((1, 3), dtype=np.uint8), palette])
+    if not len(palette):
+        palette = np.zeros((1, 3), dtype=np.uint8)
+
+    # 不透明像素可以使用的颜色，映射后的下标再加上跳过的项数
+    skip = reserve if exclusive else 0
+    opaque_palette = palette[skip:]
+    if not len(opaque_pixels):
+        indices = np.zeros(rgb.shape[:2], dtype=np.uint8)
+    elif len(palette) - reserve >= len(colors) or dither == DITHER_NONE:
+        indices = nearest_indices(rgb.reshape(-1, 3), opaque_palette).reshape(rgb.shape[:2])
+    elif dither == DITHER_ORDERED:
+        # 阈值幅度取调色板在每个通道上的平均间隔
+        spread = 256 / max(1.0, round(len(opaque_palette) ** (1 / 3)))
+        h, w = rgb.shape[:2]
+        matrix = bayer_matrix()
+        threshold = np.tile(matrix, (h // 8 + 1, w // 8 + 1))[:h, :w]
+        shifted = np.clip(rgb.astype(np.float32) + threshold[..., None] * spread, 0, 255)
+        indices = nearest_indices(shifted.reshape(-1, 3), opaque_palette).reshape(rgb.shape[:2])
+    else:
+        # 透明像素设为调色板中的一个颜色，误差为0，不会扩散到不透明的边缘
+        filled = rgb.copy()
+        filled[transparent] = opaque_palette[0]
+        indices = fs_indices(filled, opaque_palette)
+
+    indices = np.where(transparent, 0, indices + skip).astype(np.uint8)
+    return palette, indices, transparent
+
+
+def pack_rows(values, bits):
+    """把每行的像素值按位深打包，并按4字节对齐，返回自下而上的行数据"""
+    h, w = values.shape
+    if bits == 8:
+        packed = values.astype(np.uint8)
+    elif bits == 4:
+        padded = np.zeros((h, w + w % 2), dtype=np.uint8)
+        padded[:, :w] = values
+        packed = (padded[:, 0::2] << 4) | padded[:, 1::2]
+    else:
+        packed = np.packbits(values.astype(np.uint8), axis=1)
+    stride = (w * bits + 31) // 32 * 4
+    rows = np.zeros((h, stride), dtype=np.uint8)
+    rows[:, :packed.shape[1]] = packed
+    return rows[::-1].tobytes()
+
+
+def encode_palette_entry(img, bits, dither=DITHER_NONE):
+    """把图像编码为ICO中的调色板BMP条目 (BITMAPINFOHEADER + 调色板 + XOR像素 + AND蒙版)"""
+    palette, indices, transparent = quantize(img, bits, dither)
+    width, height = img.size
+
+    # 只写出实际使用的调色板项 (biClrUsed)，颜色少时条目明显更小
+    colors = np.zeros((len(palette), 4), dtype=np.uint8)
+    colors[:, 0] = palette[:, 2]
+    colors[:, 1] = palette[:, 1]
+    colors[:, 2] = palette[:, 0]
+
+    xor = pack_rows(indices, bits)
+    mask = pack_rows(transparent, 1)
+    # 高度为XOR和AND两部分之和
+    header = struct.pack("<IiiHHIIiiII", 40, width, height * 2, 1, bits, 0,
+                         len(xor) + len(mask), 0, 0, len(colors), 0)
+    return header + colors.tobytes() + xor + mask
+
+
+def encode_palette_png(img, bits, dither=DITHER_NONE):
+    """把图像编码为调色板PNG (透明像素独占调色板第0项，并标记为透明)"""
+    palette, indices, transparent = quantize(img, bits, dither, exclusive=True)
+    out = Image.fromarray(indices, "P")
+    out.putpalette(palette.tobytes())
+    buffer = io.BytesIO()
+    if transparent.any():
+        out.save(buffer, format="PNG", optimize=True, transparency=0)
+    else:
+        out.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def decode_palette_entry(data):
+    """解码调色板BMP条目为RGBA图像 (用于预览量化效果和校验)"""
+    _, width, height2, _, bits, _, _, _, _, used, _ = struct.unpack_from("<IiiHHIIiiII", data)
+    height = height2 // 2
+    colors = np.frombuffer(data, dtype=np.uint8, count=(used or 1 << bits) * 4, offset=40).reshape(-1, 4)
+    offset = 40 + len(colors) * 4
+
+    def unpack(offset, bits):
+        stride = (width * bits + 31) // 32 * 4
+        rows = np.frombuffer(data, dtype=np.uint8, count=stride * height, offset=offset)
+        rows = rows.reshape(height, stride)[::-1]
+        if bits == 8:
+            values = rows[:, :width]
+        elif bits == 4:
+            values = np.stack([rows >> 4, rows & 15], axis=2).reshape(height, -1)[:, :width]
+        else:
+            values = np.unpackbits(rows, axis=1)[:, :width]
+        return values, offset + stride * height
+
+    indices, offset = unpack(offset, bits)
+    transparent, _ = unpack(offset, 1)
+    rgba = np.zeros((height, width, 4), dtype=np.uint8)
+    rgba[..., 0] = colors[indices, 2]
+    rgba[..., 1] = colors[indices, 1]
+    rgba[..., 2] = colors[indices, 0]
+    rgba[..., 3] = np.where(transparent, 0, 255)
+    return Image.fromarray(rgba, "RGBA")
@@ -0,0 +1,189 @@
+"""
+asyncio 接口
+
+供基于asyncio的服务嵌入图标生成功能，CPU密集的渲染在线程池中执行，不阻塞事件循环。
+
+用法:
+    icons = await render_icon_set({"type": "text", "text": "AB", "sizes": [16, 32, 48]})
+
+    renderer = AsyncIconRenderer(max_concurrency=2, max_pending=32)
+    job = await renderer.submit(spec)      # 排队任务已满时等待 (背压)
+    async for done, total in job:          # 进度
+        ...
+    icons = await job                      # 结果 (IconSet 或 AnimatedIconSet)
+
+spec的格式与 icon_render.render_icon_set 相同。
+取消等待中的任务 (或调用 job.cancel()) 会抛出 asyncio.CancelledError，
+执行线程在处理完当前尺寸后停止，不会继续占用CPU。
+"""
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from icon_render import render_icon_set as render_icon_set_sync
+from instrumentation import COUNTERS
+
+# 每个进程最多同时执行的渲染数量 (所有渲染器共用一个线程池)
+MAX_PROCESS_RENDERS = os.cpu_count() or 1
+
+# 渲染器默认的并发数和排队上限
+DEFAULT_CONCURRENCY = MAX_PROCESS_RENDERS
+DEFAULT_MAX_PENDING = 64
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def shared_executor():
+    """进程内共用的渲染线程池 (Pillow的缩放、滤镜等操作会释放GIL)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(MAX_PROCESS_RENDERS, thread_name_prefix="icon-render")
+        return _executor
+
+
+class RenderCancelled(Exception):
+    """任务已取消，在执行线程中抛出以提前结束渲染"""
+
+
+class RenderJob:
+    """一个已提交的渲染任务: await 得到结果，async for 得到进度 (已完成数, 总数)"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self._loop = asyncio.get_running_loop()
+        self._progress = asyncio.Queue()
+        self._cancelled = threading.Event()
+        self._task = None
+
+    def report(self, done, total):
+        """进度回调 (在执行线程中调用)"""
+        if self._cancelled.is_set():
+            raise RenderCancelled()
+        self._loop.call_soon_threadsafe(self._progress.put_nowait, (done, total))
+
+    def __await__(self):
+        return self._task.__await__()
+
+    async def __aiter__(self):
+        while True:
+            getter = asyncio.ensure_future(self._progress.get())
+            await asyncio.wait({getter, self._task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+                continue
+            getter.cancel()
+            # 任务结束前已报告但尚未读取的进度
+            while not self._progress.empty():
+                yield self._progress.get_nowait()
+            return
+
+    def cancel(self):
+        """取消任务"""
+        self._cancelled.set()
+        self._task.cancel()
+
+    def done(self):
+        return self._task.done()
+
+
+class AsyncIconRenderer:
+    """限制并发数和排队数量的异步渲染器
+
+    max_concurrency: 本渲染器同时执行的任务数 (进程内总数另受 MAX_PROCESS_RENDERS 限制)
+    max_pending:     已提交但未完成的任务上限，超过时 submit() 等待，submit_nowait() 抛出 asyncio.QueueFull
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_CONCURRENCY, max_pending=DEFAULT_MAX_PENDING, executor=None):
+        if max_concurrency < 1 or max_pending < 1:
+            raise ValueError("并发数和排队上限必须大于0")
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self._executor = executor
+        self._running = asyncio.Semaphore(max_concurrency)
+        self._slots = asyncio.Condition()
+        self._jobs = set()
+
+    @property
+    def pending(self):
+        """已提交但未完成的任务数"""
+        return len(self._jobs)
+
+    async def submit(self, spec):
+        """提交任务，排队任务已满时等待"""
+        async with self._slots:
+            await self._slots.wait_for(lambda: len(self._jobs) < self.max_pending)
+            return self._start(spec)
+
+    def submit_nowait(self, spec):
+        """提交任务，排队任务已满时抛出 asyncio.QueueFull"""
+        if len(self._jobs) >= self.max_pending:
+            COUNTERS.incr("async.rejected")
+            raise asyncio.QueueFull(f"排队任务已达上限 ({self.max_pending})")
+        return self._start(spec)
+
+    def _start(self, spec):
+        job = RenderJob(spec)
+        job._task = asyncio.ensure_future(self._run(job))
+        self._jobs.add(job)
+        COUNTERS.incr("async.submitted")
+        return job
+
+    async def _run(self, job):
+        try:
+            async with self._running:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(
+                    self._executor or shared_executor(), render_icon_set_sync, job.spec, job.report
+                )
+                try:
+                    return await future
+                except asyncio.CancelledError:
+                    # 执行线程在下一次报告进度时停止
+                    job._cancelled.set()
+                    COUNTERS.incr("async.cancelled")
+                    raise
+        finally:
+            self._jobs.discard(job)
+            async with self._slots:
+                self._slots.notify()
+
+    async def render(self, spec):
+        """提交任务并等待结果"""
+        job = await self.submit(spec)
+        return await job
+
+    async def cancel_all(self):
+        """取消所有未完成的任务"""
+        jobs = list(self._jobs)
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*(job._task for job in jobs), return_exceptions=True)
+
+
+# 每个事件循环一个默认渲染器 (asyncio同步原语不能跨事件循环使用)
+_default_renderers = weakref.WeakKeyDictionary()
+
+
+def default_renderer():
+    """当前事件循环的默认渲染器"""
+    loop = asyncio.get_running_loop()
+    renderer = _default_renderers.get(loop)
+    if renderer is None:
+        renderer = _default_renderers[loop] = AsyncIconRenderer()
+    return renderer
+
+
+async def render_icon_set(spec, progress=None):
+    """异步渲染一组图标
+
+    progress: 可选回调 progress(已完成数, 总数)，在事件循环中调用
+    """
+    job = await default_renderer().submit(spec)
+    if progress is not None:
+        async for done, total in job:
+            progress(done, total)
+    return await job
@@ -0,0 +1,279 @@
+"""
+读取现有的ICO/ICNS图标
+
+用mmap只解析文件头和目录 (ICO的16字节目录项、ICNS的类型/长度块)，不解码任何条目，
+即可列出所有尺寸和位深；PNG条目的真实尺寸和位深从IHDR读取，BMP条目从BITMAPINFOHEADER读取。
+需要图像时只解码选中的一个条目 (默认最大、位深最高的条目)，可以作为生成图标的源图。
+"""
+import mmap
+import os
+import struct
+from io import BytesIO
+
+from PIL import Image
+
+from input_limits import check_pixels, open_image
+from instrumentation import COUNTERS
+
+# 按扩展名识别的图标文件
+ICON_EXTENSIONS = (".ico", ".cur", ".icns")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# JPEG 2000 (ICNS大尺寸条目可能使用) 的两种签名
+JPEG2000_SIGNATURES = (b"\x00\x00\x00\x0cjP  \r\n\x87\n", b"\xff\x4f\xff\x51")
+
+# PNG颜色类型 -> 每像素通道数
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# ICNS图像类型 -> (边长, 缩放倍数, 格式)；"png" 类型的实际格式按数据签名判断 (PNG或JPEG 2000)
+ICNS_TYPES = {
+    b"is32": (16, 1, "rle"),
+    b"il32": (32, 1, "rle"),
+    b"ih32": (48, 1, "rle"),
+    b"it32": (128, 1, "rle"),
+    b"icp4": (16, 1, "png"),
+    b"icp5": (32, 1, "png"),
+    b"icp6": (64, 1, "png"),
+    b"ic07": (128, 1, "png"),
+    b"ic08": (256, 1, "png"),
+    b"ic09": (512, 1, "png"),
+    b"ic10": (512, 2, "png"),
+    b"ic11": (16, 2, "png"),
+    b"ic12": (32, 2, "png"),
+    b"ic13": (128, 2, "png"),
+    b"ic14": (256, 2, "png"),
+    b"ic04": (16, 1, "argb"),
+    b"ic05": (32, 1, "argb"),
+}
+
+# ICNS中24位RLE条目对应的8位透明度蒙版
+ICNS_MASKS = {b"is32": b"s8mk", b"il32": b"l8mk", b"ih32": b"h8mk", b"it32": b"t8mk"}
+
+# 可以解码的条目格式 ("argb" 为较少见的压缩格式，Pillow不支持)
+DECODABLE_FORMATS = ("png", "bmp", "rle", "jpeg2000")
+
+
+class IconFormatError(ValueError):
+    """文件不是有效的ICO/ICNS"""
+
+
+class IconEntry:
+    """图标文件中的一个条目 (只含目录信息，未解码)
+
+    offset/length: 条目数据在文件中的位置；ICNS的RLE条目另有透明度蒙版的位置 mask
+    """
+
+    __slots__ = ("width", "height", "bits", "format", "offset", "length", "kind", "scale", "mask")
+
+    def __init__(self, width, height, bits, format, offset, length, kind=None, scale=1, mask=None):
+        self.width = width
+        self.height = height
+        self.bits = bits
+        self.format = format
+        self.offset = offset
+        self.length = length
+        self.kind = kind
+        self.scale = scale
+        self.mask = mask
+
+    @property
+    def decodable(self):
+        return self.format in DECODABLE_FORMATS
+
+    def to_dict(self):
+        return {"width": self.width, "height": self.height, "bits": self.bits,
+                "format": self.format, "bytes": self.length}
+
+    def __repr__(self):
+        return f"IconEntry({self.width}x{self.height}, {self.bits}位, {self.format})"
+
+
+def icon_format(data):
+    """按文件头判断格式: "ico"、"cur"、"icns" 或 None"""
+    if data[:4] == b"icns":
+        return "icns"
+    if data[:4] == b"\x00\x00\x01\x00":
+        return "ico"
+    if data[:4] == b"\x00\x00\x02\x00":
+        return "cur"
+    return None
+
+
+def is_icon_file(path):
+    """按扩展名判断是否为图标文件"""
+    return path.lower().endswith(ICON_EXTENSIONS)
+
+
+def peek_format(data, offset):
+    """按条目数据的签名判断编码格式"""
+    head = bytes(data[offset:offset + 12])
+    if head.startswith(PNG_SIGNATURE):
+        return "png"
+    if head.startswith(JPEG2000_SIGNATURES):
+        return "jpeg2000"
+    return None
+
+
+def read_ico_entries(data):
+    """解析ICO/CUR目录，返回条目列表"""
+    if len(data) < 6:
+        raise IconFormatError("ICO文件头不完整")
+    count = struct.unpack_from("<H", data, 4)[0]
+    if len(data) < 6 + 16 * count:
+        raise IconFormatError("ICO目录不完整")
+    entries = []
+    for i in range(count):
+        width, height, _, _, _, bits, length, offset = struct.unpack_from("<BBBBHHII", data, 6 + 16 * i)
+        if offset + length > len(data) or length < 8:
+            raise IconFormatError(f"ICO条目 {i} 超出文件范围")
+        # 目录中的宽高为0表示256；位深可能未填写 (CUR中该字段为热点坐标)，以数据头为准
+        width, height = width or 256, height or 256
+        if peek_format(data, offset) == "png":
+            if length < 33:
+                raise IconFormatError(f"ICO条目 {i} 的PNG数据不完整")
+            width, height, depth, color_type = struct.unpack_from(">IIBB", data, offset + 16)
+            entries.append(IconEntry(width, height, depth * PNG_CHANNELS.get(color_type, 4), "png",
+                                     offset, length))
+        else:
+            if length < 16:
+                raise IconFormatError(f"ICO条目 {i} 的BMP数据不完整")
+            # BITMAPINFOHEADER: 高度为XOR图像与AND蒙版之和
+            _, bmp_width, bmp_height, _, bmp_bits = struct.unpack_from("<IiiHH", data, offset)
+            entries.append(IconEntry(bmp_width or width, abs(bmp_height) // 2 or height, bmp_bits or bits,
+                                     "bmp", offset, length))
+    return entries
+
+
+def read_icns_entries(data):
+    """解析ICNS的类型/长度块，返回条目列表 (蒙版块并入对应的RLE条目)"""
+    if len(data) < 8:
+        raise IconFormatError("ICNS文件头不完整")
+    end = min(len(data), struct.unpack_from(">I", data, 4)[0])
+    blocks = {}
+    position = 8
+    while position + 8 <= end:
+        kind, length = struct.unpack_from(">4sI", data, position)
+        if length < 8 or position + length > end:
+            raise IconFormatError(f"ICNS数据块 {kind!r} 超出文件范围")
+        blocks[kind] = (position + 8, length - 8)
+        position += length
+
+    entries = []
+    for kind, (offset, length) in blocks.items():
+        if kind not in ICNS_TYPES:
+            continue
+        size, scale, fmt = ICNS_TYPES[kind]
+        bits = 32
+        mask = None
+        if fmt == "png":
+            fmt = peek_format(data, offset) or "unknown"
+            if fmt == "png" and length >= 26:
+                depth, color_type = struct.unpack_from(">BB", data, offset + 24)
+                bits = depth * PNG_CHANNELS.get(color_type, 4)
+        elif fmt == "rle":
+            mask = blocks.get(ICNS_MASKS[kind])
+            bits = 32 if mask else 24
+        entries.append(IconEntry(size * scale, size * scale, bits, fmt, offset, length,
+                                 kind=kind.decode("latin-1"), scale=scale, mask=mask))
+    return entries
+
+
+def read_icon_data(data):
+    """解析内存中的ICO/CUR/ICNS数据，返回 (格式, 条目列表)"""
+    fmt = icon_format(data)
+    if fmt is None:
+        raise IconFormatError("不是ICO或ICNS文件")
+    entries = read_icns_entries(data) if fmt == "icns" else read_ico_entries(data)
+    return fmt, entries
+
+
+def read_icon_directory(path):
+    """读取图标文件的目录，返回 (格式, 条目列表)，不解码任何条目"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise IconFormatError("文件为空")
+        # 用mmap按需读取，只有文件头和各条目开头的几个字节会被读入
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            COUNTERS.incr("icon_import.directories")
+            return read_icon_data(data)
+
+
+def best_entry(entries, target=None):
+    """选择条目: 默认为面积最大、位深最高的可解码条目；
+    给出 target 时选择不小于 target 的最小条目 (没有时选最大的)，用于生成缩略图
+    """
+    candidates = [e for e in entries if e.decodable]
+    if not candidates:
+        raise IconFormatError("没有可以解码的条目")
+    if target is not None:
+        large = [e for e in candidates if min(e.width, e.height) >= target]
+        if large:
+            return min(large, key=lambda e: (e.width * e.height, -e.bits))
+    return max(candidates, key=lambda e: (e.width * e.height, e.bits))
+
+
+def entry_data(data, fmt, entry):
+    """把单个条目包装为只含该条目的最小ICO/ICNS文件，交给Pillow解码
+
+    PNG条目直接交给Pillow的PNG解码器 (ICO插件会丢掉调色板PNG条目的tRNS透明度)。
+    """
+    payload = bytes(data[entry.offset:entry.offset + entry.length])
+    if entry.format in ("png", "jpeg2000"):
+        return payload
+    if fmt in ("ico", "cur"):
+        header = struct.pack("<HHH", 0, 1, 1)
+        directory = struct.pack("<BBBBHHII", entry.width % 256, entry.height % 256, 0, 0, 1, entry.bits,
+                                len(payload), 22)
+        return header + directory + payload
+    blocks = [struct.pack(">4sI", entry.kind.encode("latin-1"), len(payload) + 8) + payload]
+    if entry.mask is not None:
+        offset, length = entry.mask
+        blocks.append(struct.pack(">4sI", ICNS_MASKS[entry.kind.encode("latin-1")], length + 8)
+                      + bytes(data[offset:offset + length]))
+    body = b"".join(blocks)
+    return b"icns" + struct.pack(">I", len(body) + 8) + body
+
+
+def decode_entry(data, fmt, entry):
+    """从内存中的图标数据只解码一个条目，返回RGBA图像 (目录中的尺寸超出像素上限时不解码)"""
+    check_pixels(entry.width, entry.height, "图标条目")
+    img = Image.open(BytesIO(entry_data(data, fmt, entry)))
+    # 条目数据头中的尺寸可能与目录不一致，以实际数据为准再检查一次
+    check_pixels(img.width, img.height, "图标条目")
+    img.load()
+    COUNTERS.incr("icon_import.extracted")
+    return img.convert("RGBA")
+
+
+def extract_entry(path, entry):
+    """只解码一个条目，返回RGBA图像"""
+    with open(path, "rb") as f:
+        fmt = icon_format(f.read(4))
+        f.seek(0)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return decode_entry(data, fmt, entry)
+
+
+def extract_best(path, target=None):
+    """解码图标文件中最合适的一个条目 (见 best_entry)"""
+    _, entries = read_icon_directory(path)
+    return extract_entry(path, best_entry(entries, target))
+
+
+def open_source_image(path, target=None):
+    """打开源图: ICO/ICNS只解码最合适的一个条目，其他格式交给Pillow"""
+    if is_icon_file(path):
+        return extract_best(path, target)
+    return open_image(path)
+
+
+def describe_entries(fmt, entries):
+    """条目的简短说明，例如 "ICO: 16×16 (32位)，256×256 (32位 PNG)" """
+    parts = []
+    for entry in sorted(entries, key=lambda e: (e.width * e.height, e.bits)):
+        text = f"{entry.width}×{entry.height} ({entry.bits}位"
+        if entry.format != "bmp":
+            text += f" {entry.format.upper()}"
+        parts.append(text + ")")
+    return f"{fmt.upper()}: " + "，".join(parts)
@@ -0,0 +1,285 @@
+"""
+图标库索引
+
+把一个或多个目录下现有的ICO/CUR/ICNS文件的目录信息 (各条目的尺寸、位深、编码格式) 和小缩略图
+记录到本地SQLite数据库，用于查找和检查 (例如缺少256px条目、只有低位深条目的图标)。
+再次索引时按文件的修改时间和大小增量更新: 未变化的文件不重新读取，已删除的文件从库中移除。
+目录信息用 icon_import 的mmap解析得到，只有生成缩略图时才解码一个条目。
+
+用法:
+    python icon_library.py index 图标目录 [更多目录...]
+    python icon_library.py find --missing 256
+    python icon_library.py find --name logo --max-bits 8
+    python icon_library.py show 文件.ico
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+from icon_import import best_entry, describe_entries, extract_entry, is_icon_file, read_icon_directory
+from instrumentation import COUNTERS
+
+# 缩略图的最大边长
+THUMBNAIL_SIZE = 48
+
+# 数据库结构版本，变化时重建
+LIBRARY_VERSION = 1
+
+LIBRARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    format TEXT,
+    entry_count INTEGER NOT NULL DEFAULT 0,
+    max_size INTEGER NOT NULL DEFAULT 0,
+    max_bits INTEGER NOT NULL DEFAULT 0,
+    thumbnail BLOB,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    bits INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_path ON entries(path);
+CREATE INDEX IF NOT EXISTS entries_width ON entries(width);
+"""
+
+
+def default_library_path():
+    """图标库数据库文件位置"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "AdvancedIconGenerator", "icon_library.sqlite3")
+
+
+def iter_icon_files(roots):
+    """列出若干文件或目录 (递归) 中的图标文件"""
+    for root in roots:
+        if os.path.isfile(root):
+            if is_icon_file(root):
+                yield os.path.abspath(root)
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if is_icon_file(name):
+                    yield os.path.abspath(os.path.join(dirpath, name))
+
+
+def make_thumbnail(path, entries):
+    """用最接近缩略图尺寸的条目生成PNG缩略图"""
+    img = extract_entry(path, best_entry(entries, THUMBNAIL_SIZE))
+    img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class IconLibrary:
+    """图标库的SQLite索引 (可在多个线程中使用)"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or default_library_path()
+        if self.db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA foreign_keys = ON")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != LIBRARY_VERSION:
+            self._db.executescript("DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS files;")
+            self._db.execute(f"PRAGMA user_version = {LIBRARY_VERSION}")
+        self._db.executescript(LIBRARY_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, roots, progress=None):
+        """索引若干文件或目录，按修改时间和大小增量更新，返回统计
+
+        统计: {"scanned", "added", "updated", "unchanged", "removed", "failed"}
+        progress(已处理数, 路径) 在每个文件处理后调用。
+        """
+        roots = [os.path.abspath(root) for root in roots]
+        stats = dict.fromkeys(("scanned", "added", "updated", "unchanged", "removed", "failed"), 0)
+        with self._lock, self._db:
+            known = {row["path"]: (row["mtime_ns"], row["size"])
+                     for row in self._db.execute("SELECT path, mtime_ns, size FROM files")}
+            seen = set()
+            for path in iter_icon_files(roots):
+                if path in seen:
+                    continue
+                seen.add(path)
+                stats["scanned"] += 1
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                stamp = (st.st_mtime_ns, st.st_size)
+                if known.get(path) == stamp:
+                    stats["unchanged"] += 1
+                else:
+                    stats["updated" if path in known else "added"] += 1
+                    if not self.index_file(path, stamp):
+                        stats["failed"] += 1
+                if progress:
+                    progress(stats["scanned"], path)
+
+            # 移除索引范围内已不存在的文件
+            for path in known:
+                if path not in seen and any(path == root or path.startswith(os.path.join(root, ""))
+                                            for root in roots):
+                    self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+                    stats["removed"] += 1
+        COUNTERS.incr("icon_library.indexed", stats["added"] + stats["updated"])
+        COUNTERS.incr("icon_library.unchanged", stats["unchanged"])
+        return stats
+
+    def index_file(self, path, stamp):
+        """读取一个文件并写入索引 (调用方持有锁和事务)，无法解析的文件记录错误信息"""
+        self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+        try:
+            fmt, entries = read_icon_directory(path)
+            thumbnail = make_thumbnail(path, entries)
+        except (OSError, ValueError, SyntaxError) as e:
+            # 记录错误，文件修改前不再重试
+            self._db.execute("INSERT INTO files (path, mtime_ns, size, error) VALUES (?, ?, ?, ?)",
+                             (path, stamp[0], stamp[1], str(e) or type(e).__name__))
+            return False
+        self._db.execute(
+            "INSERT INTO files (path, mtime_ns, size, format, entry_count, max_size, max_bits, thumbnail)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, stamp[0], stamp[1], fmt, len(entries),
+             max(max(e.width, e.height) for e in entries), max(e.bits for e in entries), thumbnail)
+        )
+        self._db.executemany(
+            "INSERT INTO entries (path, width, height, bits, format, bytes) VALUES (?, ?, ?, ?, ?, ?)",
+            [(path, e.width, e.height, e.bits, e.format, e.length) for e in entries]
+        )
+        return True
+
+    def find(self, name=None, has_size=None, missing_size=None, max_bits=None, errors=False):
+        """查找图标，返回文件记录 (字典，不含缩略图) 列表
+
+        name:         文件名包含的文字
+        has_size:     包含该边长的条目
+        missing_size: 不包含该边长的条目
+        max_bits:     所有条目的位深都不超过该值
+        errors:       只列出无法解析的文件
+        """
+        where = ["error IS NOT NULL" if errors else "error IS NULL"]
+        params = []
+        if name:
+            where.append("path LIKE ?")
+            params.append(f"%{name}%")
+        if has_size is not None:
+            where.append("EXISTS (SELECT 1 FROM entries e WHERE e.path = files.path AND e.width = ?)")
+            params.append(has_size)
+        if missing_size is not None:
+            where.append("NOT EXISTS (SELECT 1 FROM entries e WHERE e.path = files.path AND e.width = ?)")
+            params.append(missing_size)
+        if max_bits is not None:
+            where.append("max_bits <= ?")
+            params.append(max_bits)
+        sql = ("SELECT path, format, entry_count, max_size, max_bits, error FROM files"
+               f" WHERE {' AND '.join(where)} ORDER BY path")
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+    def entries(self, path):
+        """文件的条目记录列表"""
+        with self._lock:
+            rows = self._db.execute("SELECT width, height, bits, format, bytes FROM entries WHERE path = ?"
+                                    " ORDER BY width * height, bits", (os.path.abspath(path),))
+            return [dict(row) for row in rows]
+
+    def thumbnail(self, path):
+        """文件的缩略图 (PIL图像)，未索引时返回None"""
+        with self._lock:
+            row = self._db.execute("SELECT thumbnail FROM files WHERE path = ?",
+                                   (os.path.abspath(path),)).fetchone()
+        if row is None or row["thumbnail"] is None:
+            return None
+        return Image.open(BytesIO(row["thumbnail"]))
+
+    def summary(self):
+        """库中的文件数、条目数和无法解析的文件数"""
+        with self._lock:
+            files, failed = self._db.execute(
+                "SELECT COUNT(*), COUNT(error) FROM files").fetchone()
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"files": files, "entries": entries, "failed": failed}
+
+
+def print_rows(rows):
+    for row in rows:
+        if row["error"]:
+            print(f"{row['path']}: 错误 {row['error']}")
+        else:
+            print(f"{row['path']}: {row['format'].upper()} {row['entry_count']}个条目，"
+                  f"最大 {row['max_size']}px，最高 {row['max_bits']}位")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="索引和查找现有的ICO/ICNS图标")
+    parser.add_argument("--db", help="数据库文件 (默认在用户缓存目录)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index = commands.add_parser("index", help="索引目录中的图标 (增量更新)")
+    index.add_argument("roots", nargs="+", help="图标文件或目录")
+
+    find = commands.add_parser("find", help="在索引中查找图标")
+    find.add_argument("--name", help="文件名包含的文字")
+    find.add_argument("--has", type=int, help="包含该边长的条目")
+    find.add_argument("--missing", type=int, help="缺少该边长的条目")
+    find.add_argument("--max-bits", type=int, help="所有条目的位深都不超过该值")
+    find.add_argument("--errors", action="store_true", help="只列出无法解析的文件")
+
+    show = commands.add_parser("show", help="直接读取图标文件的目录 (不使用索引)")
+    show.add_argument("files", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "show":
+        for path in args.files:
+            try:
+                fmt, entries = read_icon_directory(path)
+            except (OSError, ValueError) as e:
+                print(f"{path}: 错误 {e}")
+                continue
+            print(f"{path}: {describe_entries(fmt, entries)}")
+        return 0
+
+    with IconLibrary(args.db) as library:
+        if args.command == "index":
+            stats = library.update(args.roots)
+            summary = library.summary()
+            print(f"扫描 {stats['scanned']} 个文件: 新增 {stats['added']}，更新 {stats['updated']}，"
+                  f"未变化 {stats['unchanged']}，移除 {stats['removed']}，无法解析 {stats['failed']}")
+            print(f"库中共 {summary['files']} 个文件，{summary['entries']} 个条目")
+        else:
+            rows = library.find(args.name, args.has, args.missing, args.max_bits, args.errors)
+            print_rows(rows)
+            print(f"共 {len(rows)} 个文件")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
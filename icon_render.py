@@ -0,0 +1,699 @@
+"""
+图标渲染
+
+与界面无关的图像处理和渲染函数，界面、监视模式和批处理都使用这里的实现。
+处理函数只接收设置快照 (普通字典)，不访问Tk变量，可以在任意线程中调用。
+"""
+import functools
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import warnings
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+
+from animation import AnimatedIconSet, is_animated, iter_frames, process_frames
+from effects import apply_effects, chain_cost, split_chain
+from emoji_renderer import EMOJI_RENDERER
+from font_index import FONT_INDEX
+from icon_import import open_source_image
+from icon_store import IconSet
+from input_limits import check_image, check_svg
+from instrumentation import COUNTERS, MEMORY, memory_stage
+
+# 图片处理的默认设置 (与界面控件的初始值一致)
+DEFAULT_IMAGE_SETTINGS = {
+    'brightness': 1.0,
+    'contrast': 1.0,
+    'saturation': 1.0,
+    'alpha': 1.0,
+    'effect': "无",
+    'shape': "方形",
+    'radius': 20,
+    'size_settings': {},
+}
+
+# 文字图标的默认设置
+DEFAULT_TEXT_SETTINGS = {
+    'font_family': "微软雅黑",
+    'font_style': "normal",
+    'font_size': 100,
+    'text_color': "#000000",
+    'bg_type': "纯色",
+    'bg_color': "#FFFFFF",
+    'bg_color2': "#CCCCCC",
+    'gradient_dir': "水平",
+    'bg_alpha': 1.0,
+    'shape': "方形",
+    'radius': 20,
+}
+
+# Unicode符号图标的默认设置
+DEFAULT_UNICODE_SETTINGS = {
+    'font_family': "Arial Unicode MS",
+    'font_color': "#000000",
+    'bg_color': "#FFFFFF",
+    'alpha': 1.0,
+}
+
+# Emoji图标的默认设置
+DEFAULT_EMOJI_SETTINGS = {
+    'bg_color': "#FFFFFF",
+    'alpha': 1.0,
+}
+
+# SVG渲染的默认背景
+DEFAULT_SVG_BACKGROUND = "#FFFFFF"
+
+# SVG是否在可终止的沙箱子进程中光栅化 (环境变量 ICON_SVG_SANDBOX=0 时在当前进程中渲染)
+SVG_IN_SANDBOX = os.environ.get("ICON_SVG_SANDBOX", "1") != "0"
+
+# SVG光栅化结果缓存的字节预算
+SVG_CACHE_BYTES = 64 * 1024 * 1024
+
+# 连续空白 (规范化SVG文本时合并为一个空格)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# 缓存的已加载字体数量 (按文件、序号和字号)
+FONT_CACHE_SIZE = 64
+
+# 图表的默认类型
+DEFAULT_CHART_TYPE = "折线图"
+
+
+def calculate_star_points(spikes, cx, cy, outer_radius, inner_radius):
+    """计算星形点坐标"""
+    import numpy as np
+
+    points = []
+    step = 2 * np.pi / spikes
+    rot = np.pi / 2 * 3
+
+    for i in range(spikes * 2):
+        r = outer_radius if i % 2 == 0 else inner_radius
+        x = cx + np.cos(i * step + rot) * r
+        y = cy + np.sin(i * step + rot) * r
+        points.extend([x, y])
+
+    return points
+
+
+def calculate_heart_points(cx, cy, size):
+    """计算心形点坐标"""
+    import numpy as np
+
+    points = []
+    for t in np.linspace(0, 2*np.pi, 30):
+        x = 16 * np.sin(t)**3
+        y = 13 * np.cos(t) - 5 * np.cos(2*t) - 2 * np.cos(3*t) - np.cos(4*t)
+        points.extend([cx + x*size/16, cy - y*size/16])
+    return points
+
+
+def apply_alpha(img, alpha):
+    """应用透明度到图像"""
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+
+    # 创建一个新的alpha通道
+    alpha_channel = img.split()[3]
+    alpha_channel = ImageEnhance.Brightness(alpha_channel).enhance(alpha)
+
+    # 合并回图像
+    r, g, b, _ = img.split()
+    img = Image.merge('RGBA', (r, g, b, alpha_channel))
+
+    return img
+
+
+def apply_shape_mask(img, shape, radius=20):
+    """应用形状蒙版到图像"""
+    if shape == "方形":
+        return img
+
+    # 创建蒙版
+    mask = Image.new('L', img.size, 0)
+    draw = ImageDraw.Draw(mask)
+
+    if shape == "圆形":
+        draw.ellipse((0, 0, img.size[0], img.size[1]), fill=255)
+    elif shape == "圆角矩形":
+        draw.rounded_rectangle((0, 0, img.size[0], img.size[1]), radius=radius, fill=255)
+    elif shape == "星形":
+        points = calculate_star_points(5, img.size[0]//2, img.size[1]//2, img.size[0]//2-5, img.size[0]//4)
+        draw.polygon(points, fill=255)
+    elif shape == "心形":
+        points = calculate_heart_points(img.size[0]//2, img.size[1]//2, img.size[0]//2-5)
+        draw.polygon(points, fill=255)
+    elif shape == "三角形":
+        points = [img.size[0]//2, 5, img.size[0]-5, img.size[1]-5, 5, img.size[1]-5]
+        draw.polygon(points, fill=255)
+
+    # 应用蒙版
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+
+    img.putalpha(mask)
+    return img
+
+
+def process_image(img, sizes, settings, scale=1.0):
+    """对图片 (或动画的一帧) 应用调整和效果，逐个尺寸产出图标
+
+    scale: 图片相对于原图的缩放比例 (降采样解码时小于1)，依赖分辨率的效果按该比例缩放参数
+    """
+    # 应用全局调整
+    if settings['brightness'] != 1.0:
+        img = ImageEnhance.Brightness(img).enhance(settings['brightness'])
+    if settings['contrast'] != 1.0:
+        img = ImageEnhance.Contrast(img).enhance(settings['contrast'])
+    if settings['saturation'] != 1.0:
+        img = ImageEnhance.Color(img).enhance(settings['saturation'])
+
+    # 应用效果: 不依赖分辨率的末尾效果 (如颜色变换) 在图标比原图小时改为缩小后执行，成本更低
+    effect = settings['effect']
+    head, tail = split_chain(effect)
+    deferred = (bool(tail) and not settings['size_settings'] and settings['alpha'] >= 1.0
+                and chain_cost(tail, sum(size * size for size in sizes)) < chain_cost(tail, img.width * img.height))
+    with memory_stage("效果"):
+        img = apply_effects(img, head if deferred else effect, scale)
+
+    for size in sizes:
+        # 应用尺寸特定的调整
+        size_settings = settings['size_settings'].get(size)
+        if size_settings:
+            temp_img = img.copy()
+
+            if size_settings['brightness'] != 1.0:
+                temp_img = ImageEnhance.Brightness(temp_img).enhance(size_settings['brightness'])
+            if size_settings['contrast'] != 1.0:
+                temp_img = ImageEnhance.Contrast(temp_img).enhance(size_settings['contrast'])
+            if size_settings['saturation'] != 1.0:
+                temp_img = ImageEnhance.Color(temp_img).enhance(size_settings['saturation'])
+            if size_settings['alpha'] < 1.0:
+                temp_img = apply_alpha(temp_img, size_settings['alpha'])
+
+            icon = temp_img.resize((size, size), Image.Resampling.LANCZOS)
+        else:
+            # 应用全局透明度
+            if settings['alpha'] < 1.0:
+                temp_img = apply_alpha(img, settings['alpha'])
+                icon = temp_img.resize((size, size), Image.Resampling.LANCZOS)
+            else:
+                icon = img.resize((size, size), Image.Resampling.LANCZOS)
+
+        if deferred:
+            icon = apply_effects(icon, tail)
+
+        # 应用形状蒙版
+        yield apply_shape_mask(icon, settings['shape'], settings['radius'])
+
+
+class SvgDocument:
+    """解析后的SVG文档，渲染多个尺寸时只解析一次
+
+    依次尝试cairosvg和svglib解析，都不可用时渲染为占位图。
+    """
+
+    def __init__(self, svg_code):
+        self.code = svg_code
+        self.tree = None
+        self.drawing = None
+        try:
+            # 方法1：cairosvg
+            from cairosvg.parser import Tree
+
+            self.tree = Tree(bytestring=svg_code.encode('utf-8'))
+            return
+        except Exception as e:
+            warnings.warn(f"使用cairosvg解析失败，尝试备用方法: {str(e)}")
+
+        try:
+            # 方法2：svglib (只能从文件读取，先保存到临时文件)
+            fd, temp_svg = tempfile.mkstemp(suffix=".svg")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(svg_code)
+
+                from svglib.svglib import svg2rlg
+
+                self.drawing = svg2rlg(temp_svg)
+            finally:
+                os.remove(temp_svg)
+        except Exception as e:
+            warnings.warn(f"备用方法也失败，使用简单渲染: {str(e)}")
+
+
+def render_svg(svg, size):
+    """把SVG (代码或已解析的SvgDocument) 渲染为指定尺寸的图像
+
+    依次尝试cairosvg、svglib，都不可用时绘制占位图。
+    """
+    doc = svg if isinstance(svg, SvgDocument) else SvgDocument(svg)
+    if doc.tree is not None:
+        try:
+            from cairosvg.surface import PNGSurface
+
+            output = BytesIO()
+            PNGSurface(doc.tree, output, 96, output_width=size, output_height=size).finish()
+            return Image.open(output)
+        except Exception as e:
+            warnings.warn(f"使用cairosvg渲染失败: {str(e)}")
+
+    if doc.drawing is not None:
+        try:
+            from reportlab.graphics import renderPM
+
+            return renderPM.drawToPIL(doc.drawing, dpi=72 * size / doc.drawing.width)
+        except Exception as e:
+            warnings.warn(f"使用svglib渲染失败: {str(e)}")
+
+    img = Image.new("RGBA", (size, size), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    draw.text((10, 10), "SVG预览", fill="black")
+    # 尝试简单解析SVG中的矩形和圆形
+    try:
+        if "<rect" in doc.code:
+            draw.rectangle([10, 30, size-10, size-10], outline="red")
+        if "<circle" in doc.code:
+            draw.ellipse([10, 30, size-10, size-10], outline="blue")
+    except:
+        pass
+    return img
+
+
+def parse_svg(svg_code, optimize=False):
+    """检查输入限制后解析SVG (在当前进程中渲染时使用)，optimize 时先精简文档"""
+    if optimize:
+        from svg_optimize import optimize_svg
+
+        return SvgDocument(optimize_svg(svg_code)[0])
+    check_svg(svg_code)
+    return SvgDocument(svg_code)
+
+
+def normalize_svg(svg_code):
+    """规范化SVG文本用于缓存: 连续空白合并为一个空格 (默认的 xml:space 下渲染结果相同)"""
+    text = svg_code.strip()
+    if "xml:space" in text:
+        return text
+    return WHITESPACE_PATTERN.sub(" ", text)
+
+
+def svg_cache_key(svg_code):
+    """SVG文档的缓存键 (规范化文本的哈希)，只改动缩进或换行时不变"""
+    return hashlib.sha1(normalize_svg(svg_code).encode("utf-8")).hexdigest()
+
+
+class SvgRasterCache:
+    """按字节预算缓存SVG的光栅化结果 (LRU)，键为 (文档的缓存键, 尺寸)
+
+    缓存的是未加背景的图像，修改背景色或透明度时只需重新合成，不必重新光栅化。
+    """
+
+    def __init__(self, budget=SVG_CACHE_BYTES):
+        self.budget = budget
+        self.used = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key, size):
+        """返回缓存图像的副本，未缓存时返回None"""
+        with self._lock:
+            img = self._items.get((key, size))
+            if img is None:
+                COUNTERS.incr("svg_cache.misses")
+                return None
+            self._items.move_to_end((key, size))
+        COUNTERS.incr("svg_cache.hits")
+        return img.copy()
+
+    def put(self, key, size, img):
+        nbytes = img.width * img.height * 4
+        if nbytes > self.budget:
+            return
+        with self._lock:
+            old = self._items.pop((key, size), None)
+            if old is not None:
+                self.used -= old.width * old.height * 4
+            self._items[(key, size)] = img
+            self.used += nbytes
+            while self.used > self.budget:
+                _, evicted = self._items.popitem(last=False)
+                self.used -= evicted.width * evicted.height * 4
+                COUNTERS.incr("svg_cache.evicted")
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.used = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+# 全局共享的SVG光栅化缓存 (界面的实时预览和生成预览共用)
+SVG_RASTER_CACHE = SvgRasterCache()
+
+
+def rasterize_svg(svg, sizes, progress=None, sandbox=None, optimize=False):
+    """光栅化SVG的各尺寸 (不含背景)，返回RGBA图像列表；已缓存的尺寸不再光栅化
+
+    svg:      SVG代码或已解析的SvgDocument
+    sandbox:  是否在沙箱子进程中光栅化，默认见 SVG_IN_SANDBOX (已解析的文档总在当前进程中渲染)
+    optimize: 光栅化之前先精简文档 (见 svg_optimize，已解析的文档不再处理)
+    progress: 可选回调 progress(已完成数, 总数)
+    """
+    doc = svg if isinstance(svg, SvgDocument) else None
+    code = svg.code if doc is not None else svg
+    optimize = optimize and doc is None
+    key = svg_cache_key(code) + ("-optimized" if optimize else "")
+    images = {size: SVG_RASTER_CACHE.get(key, size) for size in sizes}
+    missing = [size for size, img in images.items() if img is None]
+
+    def report(done):
+        if progress:
+            progress(len(images) - len(missing) + done, len(images))
+
+    if not missing:
+        report(0)
+        return [images[size] for size in sizes]
+
+    if sandbox is None:
+        sandbox = SVG_IN_SANDBOX
+    if optimize:
+        # 精简后的文档交给渲染器 (同时检查输入限制)
+        from svg_optimize import optimize_svg
+
+        code = optimize_svg(code)[0]
+    elif doc is None:
+        # 光栅化之前检查输入限制 (缓存命中的文档已经检查过)
+        check_svg(code)
+    if doc is None and sandbox:
+        from mpl_sandbox import SVG_SANDBOX
+
+        rendered = SVG_SANDBOX.render_svg(code, missing, progress=report)
+    else:
+        # 各尺寸共用同一次解析结果
+        doc = doc or SvgDocument(code)
+        rendered = []
+        for size in missing:
+            rendered.append(render_svg(doc, size).convert("RGBA"))
+            report(len(rendered))
+    for size, img in zip(missing, rendered):
+        SVG_RASTER_CACHE.put(key, size, img.copy())
+        images[size] = img
+    return [images[size] for size in sizes]
+
+
+def composite_background(img, color=DEFAULT_SVG_BACKGROUND, alpha=1.0):
+    """为渲染结果添加背景 (白色且不透明时保持原样)"""
+    if color == DEFAULT_SVG_BACKGROUND and alpha >= 1.0:
+        return img
+    bg = Image.new("RGBA", img.size, color)
+    if alpha < 1.0:
+        bg.putalpha(int(255 * alpha))
+    return Image.alpha_composite(bg, img.convert("RGBA"))
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_truetype(path, index, size):
+    """加载字体 (相同文件、序号和字号只加载一次)"""
+    return ImageFont.truetype(path, size, index=index)
+
+
+def load_font(family, style, text, size):
+    """按字体名和样式加载能显示text的字体，失败时使用默认字体"""
+    try:
+        font_path, font_index = FONT_INDEX.resolve(family, style, text)
+        return load_truetype(font_path, font_index, size)
+    except:
+        return ImageFont.load_default()
+
+
+def create_background(size, color, alpha=1.0):
+    """创建背景 ("透明" 或颜色)，并应用背景透明度"""
+    if color == "透明":
+        img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    else:
+        img = Image.new("RGB", (size, size), color)
+
+    # 应用背景透明度
+    if alpha < 1.0 and img.mode == 'RGBA':
+        img = apply_alpha(img, alpha)
+    return img
+
+
+def create_gradient_image(size, color1, color2, direction="水平"):
+    """创建渐变背景图像"""
+    img = Image.new("RGB", (size, size))
+    draw = ImageDraw.Draw(img)
+
+    def hex_to_rgb(hex_color):
+        hex_color = hex_color.lstrip('#')
+        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+
+    r1, g1, b1 = hex_to_rgb(color1)
+    r2, g2, b2 = hex_to_rgb(color2)
+
+    if direction == "水平":
+        for x in range(size):
+            ratio = x / size
+            r = int(r1 + (r2 - r1) * ratio)
+            g = int(g1 + (g2 - g1) * ratio)
+            b = int(b1 + (b2 - b1) * ratio)
+            draw.line([(x, 0), (x, size)], fill=(r, g, b))
+    elif direction == "垂直":
+        for y in range(size):
+            ratio = y / size
+            r = int(r1 + (r2 - r1) * ratio)
+            g = int(g1 + (g2 - g1) * ratio)
+            b = int(b1 + (b2 - b1) * ratio)
+            draw.line([(0, y), (size, y)], fill=(r, g, b))
+    else:  # 对角
+        for y in range(size):
+            for x in range(size):
+                ratio = (x + y) / (size * 2)
+                r = int(r1 + (r2 - r1) * ratio)
+                g = int(g1 + (g2 - g1) * ratio)
+                b = int(b1 + (b2 - b1) * ratio)
+                draw.point((x, y), fill=(r, g, b))
+
+    return img
+
+
+def draw_centered_text(img, text, font, fill):
+    """在图像中央绘制文字"""
+    draw = ImageDraw.Draw(img)
+    size = img.size[0]
+
+    # 计算文字位置
+    try:
+        # 新版Pillow使用textbbox
+        bbox = draw.textbbox((0, 0), text, font=font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+    except AttributeError:
+        try:
+            # 旧版使用textsize
+            text_width, text_height = draw.textsize(text, font=font)
+        except AttributeError:
+            # 如果都不支持，使用字体对象的getsize
+            text_width, text_height = font.getsize(text)
+
+    position = ((size - text_width) // 2, (size - text_height) // 2)
+    draw.text(position, text, fill=fill, font=font)
+    return img
+
+
+def font_requests(kind, text, sizes, settings):
+    """文字类图标渲染各尺寸时会加载的字体: [(字体名, 样式, 文本, 字号)] (供批处理预先加载)"""
+    if kind == "text":
+        return [(settings['font_family'], settings['font_style'], text, int(settings['font_size'] * (size/256)))
+                for size in sizes]
+    if kind == "unicode":
+        return [(settings['font_family'], "regular", text, int(size * 0.8)) for size in sizes]
+    return []
+
+
+def render_text(text, size, settings):
+    """渲染一个尺寸的文字图标"""
+    # 创建背景
+    if settings['bg_type'] == "透明":
+        img = create_background(size, "透明", settings['bg_alpha'])
+    elif settings['bg_type'] == "渐变":
+        img = create_gradient_image(size, settings['bg_color'], settings['bg_color2'], settings['gradient_dir'])
+    else:  # 纯色
+        img = create_background(size, settings['bg_color'], settings['bg_alpha'])
+
+    font = load_font(settings['font_family'], settings['font_style'], text,
+                     int(settings['font_size'] * (size/256)))
+    draw_centered_text(img, text, font, settings['text_color'])
+
+    # 应用形状蒙版
+    return apply_shape_mask(img, settings['shape'], settings['radius'])
+
+
+def render_unicode(char, size, settings):
+    """渲染一个尺寸的Unicode符号图标"""
+    img = create_background(size, settings['bg_color'], settings['alpha'])
+    font = load_font(settings['font_family'], "regular", char, int(size * 0.8))
+    return draw_centered_text(img, char, font, settings['font_color'])
+
+
+def render_emoji(char, size, settings):
+    """渲染一个尺寸的Emoji图标 (从缓存的原生尺寸位图缩放)"""
+    img = create_background(size, settings['bg_color'], settings['alpha'])
+    glyph = EMOJI_RENDERER.render(char, size)
+    img.paste(glyph, (0, 0), glyph)
+    return img
+
+
+def render_sizes(render, sizes, progress=None):
+    """逐个尺寸渲染并压缩存储"""
+    icons = IconSet()
+    for i, size in enumerate(sizes):
+        icons.append(render(size))
+        if progress:
+            progress(i + 1, len(sizes))
+    return icons
+
+
+def decode_within_budget(img, max_size):
+    """解码源图片；预计超出软内存上限时静态JPG按最大图标尺寸的2倍降采样解码 (不生成全尺寸像素)
+
+    返回 (图像, 相对原图的缩放比例)。
+    """
+    width = img.width
+    if (not is_animated(img) and img.format == "JPEG" and min(img.size) > 2 * max_size
+            and MEMORY.under_pressure(img.width * img.height * 4)):
+        MEMORY.downgrade("降采样解码")
+        img.draft(img.mode, (2 * max_size, 2 * max_size))
+    img.load()
+    return img, img.width / width
+
+
+def render_image_spec(spec, progress=None):
+    """渲染图片源: 静态图片产出IconSet，动画图片逐帧处理产出AnimatedIconSet"""
+    settings = dict(DEFAULT_IMAGE_SETTINGS, **spec.get("settings", {}))
+    sizes = spec["sizes"]
+    # 批处理时可以传入已解码的静态图片 ("image")，多个图标共用
+    img = spec.get("image")
+    scale = 1.0
+    if img is None:
+        with memory_stage("解码"):
+            # ICO/ICNS只解码最大的一个条目；解码前检查像素数
+            img = check_image(open_source_image(spec["source"]))
+            img, scale = decode_within_budget(img, max(sizes))
+
+    if is_animated(img):
+        def process(item):
+            frame, duration = item
+            return IconSet(process_image(frame, sizes, settings)), duration
+
+        anim = AnimatedIconSet(loop=img.info.get("loop", 0))
+        for i, (frame_set, duration) in enumerate(process_frames(iter_frames(img), process)):
+            anim.append(frame_set, duration)
+            if progress:
+                progress(i + 1, img.n_frames)
+        return anim
+
+    icons = IconSet()
+    with memory_stage("处理"):
+        for i, icon in enumerate(process_image(img, sizes, settings, scale)):
+            icons.append(icon)
+            if progress:
+                progress(i + 1, len(sizes))
+    return icons
+
+
+def render_svg_spec(spec, progress=None):
+    """渲染SVG源 (spec中的svg为代码，否则从source文件读取；批处理时可传入已解析的svg_document)
+
+    光栅化之前检查元素数量、嵌套深度等限制；默认在沙箱子进程中光栅化，超时的任务被终止并报错。
+    光栅化结果按文档和尺寸缓存，背景在缓存之后合成；spec中的 optimize_svg 为真时先精简文档。
+    """
+    svg = spec.get("svg_document")
+    if svg is None:
+        svg = spec.get("svg")
+        if svg is None:
+            with open(spec["source"], "r", encoding="utf-8") as f:
+                svg = f.read()
+    bg_color = spec.get("bg_color", DEFAULT_SVG_BACKGROUND)
+    alpha = spec.get("alpha", 1.0)
+    images = rasterize_svg(svg, spec["sizes"], progress, optimize=spec.get("optimize_svg", False))
+    return IconSet([composite_background(img, bg_color, alpha) for img in images])
+
+
+def render_text_spec(spec, progress=None):
+    settings = dict(DEFAULT_TEXT_SETTINGS, **spec.get("settings", {}))
+    return render_sizes(lambda size: render_text(spec["text"], size, settings), spec["sizes"], progress)
+
+
+def render_unicode_spec(spec, progress=None):
+    settings = dict(DEFAULT_UNICODE_SETTINGS, **spec.get("settings", {}))
+    return render_sizes(lambda size: render_unicode(spec["text"], size, settings), spec["sizes"], progress)
+
+
+def render_emoji_spec(spec, progress=None):
+    settings = dict(DEFAULT_EMOJI_SETTINGS, **spec.get("settings", {}))
+    return render_sizes(lambda size: render_emoji(spec["text"], size, settings), spec["sizes"], progress)
+
+
+def render_css_spec(spec, progress=None):
+    # 解析CSS并编译为渲染计划 (只解析一次，各尺寸直接执行计划)
+    from css_engine import compile_css
+
+    plan = compile_css(spec["css"])
+    return render_sizes(plan.render, spec["sizes"], progress)
+
+
+def render_matplotlib_spec(spec, progress=None):
+    """在沙箱子进程中执行图表代码并渲染各尺寸"""
+    from mpl_sandbox import MPL_SANDBOX
+
+    sizes = spec["sizes"]
+    images = MPL_SANDBOX.render(
+        spec["code"], spec.get("chart_type", DEFAULT_CHART_TYPE), sizes,
+        bg_color=spec.get("bg_color", "#FFFFFF"), alpha=spec.get("alpha", 1.0),
+        progress=(lambda done: progress(done, len(sizes))) if progress else None
+    )
+    return IconSet(images)
+
+
+# 按源类型选择渲染函数
+RENDERERS = {
+    "image": render_image_spec,
+    "svg": render_svg_spec,
+    "text": render_text_spec,
+    "unicode": render_unicode_spec,
+    "emoji": render_emoji_spec,
+    "css": render_css_spec,
+    "matplotlib": render_matplotlib_spec,
+}
+
+
+def source_type(path):
+    """根据扩展名判断源文件类型"""
+    return "svg" if path.lower().endswith(".svg") else "image"
+
+
+def render_icon_set(spec, progress=None):
+    """按规格渲染一组图标
+
+    spec: {"type": 源类型, "sizes": [...], 以及该类型的输入和设置}
+        image: "source" 图片路径，"settings" 见 DEFAULT_IMAGE_SETTINGS
+        svg:   "svg" 代码或 "source" 文件路径，"bg_color"、"alpha"、"optimize_svg"
+        text/unicode/emoji: "text" 内容，"settings" 见对应的 DEFAULT_*_SETTINGS
+        css:   "css" 样式代码
+        matplotlib: "code" 图表代码，"chart_type"、"bg_color"、"alpha"
+    progress: 可选回调 progress(已完成数, 总数)
+    """
+    kind = spec.get("type") or source_type(spec["source"])
+    if kind not in RENDERERS:
+        raise ValueError(f"不支持的源类型: {kind}")
+    return RENDERERS[kind](spec, progress)
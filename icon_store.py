@@ -0,0 +1,312 @@
+"""
+图标集存储
+
+生成的各尺寸图标不再以解码后的PIL图像常驻内存，而是紧凑存储:
+- "png": 每个尺寸保存为无损PNG字节 (默认，体积最小，导出PNG/ICO时直接写出，不重新编码)
+- "raw": 所有尺寸的原始像素连续存放在一个bytearray中，按偏移读取 (解码最快)
+
+访问某个尺寸时才解码，解码结果放入全局共享的缓存，超出内存预算时释放最久未用的图像。
+"""
+import io
+import itertools
+import struct
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from PIL import Image
+
+from instrumentation import COUNTERS
+
+# 解码图像缓存的内存预算 (所有图标集共享)
+DECODED_BUDGET = 64 * 1024 * 1024
+
+# 存储PNG时的压缩级别 (与Pillow默认一致)
+PNG_COMPRESS_LEVEL = 6
+
+# ICO文件中单个图标的最大尺寸
+ICO_MAX_SIZE = 256
+
+# ICO位深策略: ([(最大边长, 位深)], 调色板条目格式)
+# 规则按顺序匹配，未匹配的尺寸使用32位PNG条目；调色板条目为 "bmp" (含AND蒙版，兼容XP) 或 "png"
+ICO_DEPTH_POLICIES = {
+    "32位 (全部)": ((), "bmp"),
+    "8位BMP (≤32px)": (((32, 8),), "bmp"),
+    "4位BMP (≤16px) + 8位BMP (≤32px)": (((16, 4), (32, 8)), "bmp"),
+    "1位BMP (≤16px) + 8位BMP (≤32px)": (((16, 1), (32, 8)), "bmp"),
+    "8位PNG (≤48px)": (((48, 8),), "png"),
+}
+
+# 调色板条目的抖动方式
+DITHER_NONE = "none"
+DITHER_ORDERED = "ordered"
+DITHER_FLOYD_STEINBERG = "floyd-steinberg"
+DITHER_MODES = (DITHER_NONE, DITHER_ORDERED, DITHER_FLOYD_STEINBERG)
+
+# 界面中抖动选项的显示名称
+DITHER_NAMES = {
+    "无": DITHER_NONE,
+    "有序 (Bayer)": DITHER_ORDERED,
+    "Floyd–Steinberg": DITHER_FLOYD_STEINBERG,
+}
+
+# 原始像素每像素字节数
+MODE_BYTES = {"1": 1, "L": 1, "P": 1, "LA": 2, "RGB": 3, "RGBA": 4, "CMYK": 4}
+
+
+class DecodedCache:
+    """按内存预算缓存解码后的图像 (LRU)"""
+
+    def __init__(self, budget=DECODED_BUDGET):
+        self.budget = budget
+        self.used = 0
+        self._lock = threading.Lock()
+        self._images = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+            return img
+
+    def put(self, key, img):
+        cost = image_bytes(img)
+        with self._lock:
+            old = self._images.pop(key, None)
+            if old is not None:
+                self.used -= image_bytes(old)
+            self._images[key] = img
+            self.used += cost
+            # 至少保留刚放入的图像
+            while self.used > self.budget and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self.used -= image_bytes(evicted)
+                COUNTERS.incr("icon_store.evicted")
+
+    def discard(self, token):
+        """释放某个图标集的全部解码图像"""
+        with self._lock:
+            for key in [k for k in self._images if k[0] == token]:
+                self.used -= image_bytes(self._images.pop(key))
+
+
+def image_bytes(img):
+    return img.size[0] * img.size[1] * MODE_BYTES.get(img.mode, 4)
+
+
+def encode_png(img):
+    """把图像编码为PNG字节"""
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+# 全局共享的解码缓存
+DECODED_CACHE = DecodedCache()
+
+_tokens = itertools.count()
+
+
+class IconSet:
+    """紧凑存储的一组多尺寸图标
+
+    用法与图像列表类似: len()、下标、迭代都会返回解码后的图像。
+    返回的图像可能被缓存共享，修改前请先copy()。
+    """
+
+    def __init__(self, images=(), storage="png", cache=None):
+        if storage not in ("png", "raw"):
+            raise ValueError(f"不支持的存储方式: {storage}")
+        self.storage = storage
+        self.cache = cache or DECODED_CACHE
+        # 每个条目: (模式, 尺寸, 偏移, 长度)，png存储时偏移为所在列表下标
+        self._entries = []
+        self._png = []
+        self._arena = bytearray()
+        self._lock = threading.Lock()
+        self._token = next(_tokens)
+        weakref.finalize(self, self.cache.discard, self._token)
+        for img in images:
+            self.append(img)
+
+    def append(self, img):
+        """压缩存储一个尺寸的图标"""
+        if self.storage == "png":
+            data = encode_png(img)
+            with self._lock:
+                self._entries.append((img.mode, img.size, len(self._png), len(data)))
+                self._png.append(data)
+        else:
+            data = img.tobytes()
+            with self._lock:
+                self._entries.append((img.mode, img.size, len(self._arena), len(data)))
+                self._arena += data
+        COUNTERS.incr("icon_store.stored")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        for i in range(len(self._entries)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._entries)))]
+        if index < 0:
+            index += len(self._entries)
+        key = (self._token, index)
+        img = self.cache.get(key)
+        if img is None:
+            img = self.decode(index)
+            self.cache.put(key, img)
+        return img
+
+    def decode(self, index):
+        """解码指定下标的图标 (不经过缓存)"""
+        mode, size, offset, length = self._entries[index]
+        COUNTERS.incr("icon_store.decoded")
+        if self.storage == "png":
+            img = Image.open(io.BytesIO(self._png[offset]))
+            img.load()
+            return img
+        with self._lock:
+            return Image.frombytes(mode, size, bytes(memoryview(self._arena)[offset:offset + length]))
+
+    @property
+    def sizes(self):
+        """各图标的 (宽, 高)，不需要解码"""
+        return [entry[1] for entry in self._entries]
+
+    @property
+    def modes(self):
+        return [entry[0] for entry in self._entries]
+
+    @property
+    def stored_bytes(self):
+        """压缩存储占用的字节数"""
+        if self.storage == "png":
+            return sum(entry[3] for entry in self._entries)
+        return len(self._arena)
+
+    def largest_index(self):
+        """最大尺寸图标的下标"""
+        return max(range(len(self._entries)), key=lambda i: self._entries[i][1][0])
+
+    def png_bytes(self, index):
+        """指定图标的PNG字节，PNG存储时直接返回已存储的数据"""
+        if self.storage == "png":
+            return self._png[self._entries[index][2]]
+        return encode_png(self.decode(index))
+
+
+def write_png(icon_set, fp, index=None, optimize=False):
+    """把一个尺寸 (默认最大尺寸) 写为PNG文件，fp为路径或可写文件对象
+
+    optimize 为真时先经过 png_optimize 无损优化 (缩减颜色类型、尝试多种过滤器和压缩策略)。
+    """
+    if index is None:
+        index = icon_set.largest_index()
+    data = icon_set.png_bytes(index)
+    if optimize:
+        from png_optimize import optimize_png
+
+        data = optimize_png(data)
+    if hasattr(fp, "write"):
+        fp.write(data)
+    else:
+        with open(fp, "wb") as f:
+            f.write(data)
+
+
+def depths_for_sizes(rules, sizes):
+    """按位深规则计算各尺寸的位深，返回 {边长: 位深} (只包含使用调色板的尺寸)"""
+    depths = {}
+    for width, _ in sizes:
+        for max_size, bits in rules:
+            if width <= max_size:
+                depths[width] = bits
+                break
+    return depths
+
+
+def write_ico(icon_set, fp, depths=None, dither=DITHER_NONE, palette_format="bmp", optimize=False):
+    """把所有不超过256px的尺寸写入一个ICO文件，返回各条目的报告
+
+    默认写为32位PNG条目 (Vista及以上支持)，已存储的PNG字节直接写出，不重新编码。
+    depths 为 {边长: 位深}，其中的尺寸写为1/4/8位调色板条目，palette_format 为
+    "bmp" (含AND蒙版) 或 "png"，dither 为调色板条目的抖动方式 (见 DITHER_MODES)。
+    optimize 为真时所有PNG条目 (32位和调色板PNG) 在同一个时间预算内并行无损优化，
+    条目保持原有颜色类型 (32位条目仍为RGBA)，与目录中的位深一致。
+    报告: [{"size", "bits", "bytes", "png_bytes", "ms"}]，png_bytes 为未优化的32位PNG条目的大小。
+    """
+    depths = depths or {}
+    items = []
+    report = []
+    for i, (mode, (width, height)) in enumerate(zip(icon_set.modes, icon_set.sizes)):
+        if width > ICO_MAX_SIZE or height > ICO_MAX_SIZE:
+            continue
+        start = time.perf_counter()
+        bits = depths.get(width, 32)
+        if bits < 32:
+            import ico_palette
+
+            if palette_format == "png":
+                data = ico_palette.encode_palette_png(icon_set[i], bits, dither)
+            else:
+                data = ico_palette.encode_palette_entry(icon_set[i], bits, dither)
+        elif mode == "RGBA":
+            data = icon_set.png_bytes(i)
+        else:
+            # ICO中的PNG条目应为32位RGBA
+            data = encode_png(icon_set[i].convert("RGBA"))
+        items.append((width, height, bits, data))
+        report.append({
+            "size": width,
+            "bits": bits,
+            "bytes": len(data),
+            "png_bytes": len(data) if bits == 32 else len(icon_set.png_bytes(i)),
+            "ms": (time.perf_counter() - start) * 1000,
+        })
+    if not items:
+        raise ValueError("没有可写入ICO的尺寸 (ICO最大支持256x256)")
+
+    if optimize:
+        from png_optimize import PNG_SIGNATURE, optimize_pngs
+
+        png_items = [i for i, item in enumerate(items) if item[3].startswith(PNG_SIGNATURE)]
+        start = time.perf_counter()
+        optimized = optimize_pngs([items[i][3] for i in png_items], reduce=False)
+        # 并行优化的耗时平均计入各PNG条目
+        share = (time.perf_counter() - start) * 1000 / max(1, len(png_items))
+        for i, data in zip(png_items, optimized):
+            items[i] = items[i][:3] + (data,)
+            report[i]["bytes"] = len(data)
+            report[i]["ms"] += share
+
+    # 文件头 + 目录 + 各图标数据
+    header = struct.pack("<HHH", 0, 1, len(items))
+    offset = len(header) + 16 * len(items)
+    directory = []
+    for width, height, bits, data in items:
+        # 宽高为256时按规范写0，颜色数只对少于256色的条目填写
+        color_count = 1 << bits if bits < 8 else 0
+        directory.append(struct.pack("<BBBBHHII", width % 256, height % 256, color_count, 0, 1, bits,
+                                     len(data), offset))
+        offset += len(data)
+
+    def write(f):
+        f.write(header)
+        for entry in directory:
+            f.write(entry)
+        for _, _, _, data in items:
+            f.write(data)
+
+    if hasattr(fp, "write"):
+        write(fp)
+    else:
+        with open(fp, "wb") as f:
+            write(f)
+    return report
@@ -0,0 +1,149 @@
+"""
+输入限制
+
+在真正解码或光栅化之前检查输入的规模，拒绝可能耗尽内存或长时间占满CPU的异常输入
+(解压缩炸弹图片、层级极深或元素极多的SVG、实体展开、超大的画布尺寸)，
+给出明确的错误信息，而不是让任务卡住。
+运行时间的上限由沙箱子进程的超时保证 (见 mpl_sandbox)，超时的子进程直接终止。
+"""
+import math
+import os
+import re
+from xml.parsers import expat
+
+from PIL import Image
+
+from instrumentation import COUNTERS
+
+# 解码后的最大像素数 (环境变量 ICON_MAX_PIXELS 以百万像素为单位，默认1亿像素，RGBA约400MB)
+MAX_DECODED_PIXELS = int(float(os.environ.get("ICON_MAX_PIXELS") or 100) * 1000 * 1000)
+
+# Pillow自身的解压缩炸弹检查 (超过其上限2倍时打开即报错) 不比这里的上限更严格
+if Image.MAX_IMAGE_PIXELS and Image.MAX_IMAGE_PIXELS < MAX_DECODED_PIXELS:
+    Image.MAX_IMAGE_PIXELS = MAX_DECODED_PIXELS
+
+# SVG文档的最大字节数
+MAX_SVG_BYTES = 16 * 1024 * 1024
+
+# SVG的最大元素数量
+MAX_SVG_ELEMENTS = 20000
+
+# SVG元素的最大嵌套深度
+MAX_SVG_DEPTH = 64
+
+# SVG根元素 width/height/viewBox 的最大数值 (用户单位)
+MAX_SVG_EXTENT = 1000000
+
+# 长度属性开头的数值部分 (忽略单位)
+NUMBER_PATTERN = re.compile(r"\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)")
+
+
+class InputLimitError(ValueError):
+    """输入超出处理限制"""
+
+
+def check_pixels(width, height, what="图片"):
+    """解码前检查像素数"""
+    if width <= 0 or height <= 0:
+        COUNTERS.incr("limits.rejected_pixels")
+        raise InputLimitError(f"{what}尺寸无效: {width}×{height}")
+    if width * height > MAX_DECODED_PIXELS:
+        COUNTERS.incr("limits.rejected_pixels")
+        raise InputLimitError(f"{what}过大: {width}×{height} 超过 {MAX_DECODED_PIXELS / 1e6:g} 百万像素的上限")
+
+
+def open_image(path):
+    """打开图片 (只读取文件头)，远超上限的图片Pillow在打开时就会拒绝，统一为 InputLimitError"""
+    try:
+        return Image.open(path)
+    except Image.DecompressionBombError as e:
+        COUNTERS.incr("limits.rejected_pixels")
+        raise InputLimitError(f"图片过大，超过 {MAX_DECODED_PIXELS / 1e6:g} 百万像素的上限 ({e})")
+
+
+def check_image(img, what="图片"):
+    """检查已打开 (只读取了文件头、尚未解码) 的图片的像素数，返回图片本身"""
+    check_pixels(img.width, img.height, what)
+    return img
+
+
+def parse_extent(value, name):
+    """解析根元素的长度属性，非有限值或超出上限时报错；百分比和无法解析的值返回None"""
+    if value is None or value.strip().endswith("%"):
+        return None
+    match = NUMBER_PATTERN.match(value)
+    if not match:
+        return None
+    number = float(match.group(1))
+    if not math.isfinite(number) or abs(number) > MAX_SVG_EXTENT:
+        raise InputLimitError(f"SVG的 {name} 超出范围: {value.strip()}")
+    return number
+
+
+def check_svg_root(attrs):
+    """检查根元素的画布尺寸"""
+    parse_extent(attrs.get("width"), "width")
+    parse_extent(attrs.get("height"), "height")
+    view_box = attrs.get("viewBox")
+    if view_box:
+        values = view_box.replace(",", " ").split()
+        try:
+            values = [float(v) for v in values]
+        except ValueError:
+            return
+        if len(values) != 4:
+            return
+        if not all(math.isfinite(v) and abs(v) <= MAX_SVG_EXTENT for v in values):
+            raise InputLimitError(f"SVG的 viewBox 超出范围: {view_box}")
+        if values[2] <= 0 or values[3] <= 0:
+            raise InputLimitError(f"SVG的 viewBox 尺寸无效: {view_box}")
+
+
+def check_svg(svg_code):
+    """光栅化之前流式扫描SVG，检查大小、元素数量、嵌套深度、实体声明和画布尺寸
+
+    超出限制时立即停止扫描并抛出 InputLimitError；格式错误的文档不在这里报错 (交给渲染器处理)。
+    返回 {"elements": 元素数量, "depth": 最大嵌套深度}。
+    """
+    data = svg_code.encode("utf-8") if isinstance(svg_code, str) else svg_code
+    if len(data) > MAX_SVG_BYTES:
+        COUNTERS.incr("limits.rejected_svg")
+        raise InputLimitError(f"SVG文档过大: {len(data) / 1024 / 1024:.1f} MB，上限为 "
+                              f"{MAX_SVG_BYTES / 1024 / 1024:g} MB")
+
+    stats = {"elements": 0, "depth": 0}
+    depth = 0
+
+    def start(name, attrs):
+        nonlocal depth
+        depth += 1
+        stats["elements"] += 1
+        stats["depth"] = max(stats["depth"], depth)
+        if stats["elements"] > MAX_SVG_ELEMENTS:
+            raise InputLimitError(f"SVG元素过多: 超过 {MAX_SVG_ELEMENTS} 个")
+        if depth > MAX_SVG_DEPTH:
+            raise InputLimitError(f"SVG嵌套过深: 超过 {MAX_SVG_DEPTH} 层")
+        if stats["elements"] == 1:
+            check_svg_root(attrs)
+
+    def end(name):
+        nonlocal depth
+        depth -= 1
+
+    def entity(name, *args):
+        # 实体可以指数级展开 ("billion laughs")，SVG图标不需要实体
+        raise InputLimitError(f"SVG中不允许声明实体: {name}")
+
+    parser = expat.ParserCreate()
+    parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.EntityDeclHandler = entity
+    try:
+        parser.Parse(data, True)
+    except InputLimitError:
+        COUNTERS.incr("limits.rejected_svg")
+        raise
+    except expat.ExpatError:
+        pass
+    return stats
@@ -0,0 +1,345 @@
+"""
+性能计数器和内存统计
+
+供界面和后台线程共用的轻量计数器，用于统计帧数、对象分配次数等，
+便于验证优化效果。
+
+内存统计按生成任务和任务内的阶段 (解码、处理、编码等) 记录峰值和保留的内存:
+- "rss": 后台线程按固定间隔采样进程常驻内存 (包括Pillow、NumPy等C扩展的分配)
+- "tracemalloc": 统计Python分配的内存 (较慢，不包括Pillow的图像内存)
+结果显示在状态栏，并可逐行追加到JSON文件中；设置软内存上限后，预计超出上限的处理会降级
+(大图解码时按目标尺寸降采样，邻域效果改为分块处理)。
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# 内存统计方式: "rss"、"tracemalloc" 或 "off" (环境变量 ICON_MEMORY_PROFILE，默认关闭)
+# tracemalloc的峰值是进程级的，该方式下各任务依次执行 (见 MemoryProfiler.job)
+MEMORY_PROFILE = os.environ.get("ICON_MEMORY_PROFILE", "off")
+
+# 每个任务的内存记录逐行追加写入的JSON文件 (环境变量 ICON_MEMORY_TRACE，未设置时不写)
+MEMORY_TRACE = os.environ.get("ICON_MEMORY_TRACE") or None
+
+# 软内存上限 (字节，环境变量 ICON_MEMORY_BUDGET 以MB为单位，0为不限制)
+MEMORY_BUDGET = int(float(os.environ.get("ICON_MEMORY_BUDGET") or 0) * 1024 * 1024)
+
+# RSS采样间隔 (秒)
+RSS_SAMPLE_INTERVAL = 0.005
+
+
+class PerfCounters:
+    """线程安全的命名计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def incr(self, name, amount=1):
+        """计数器加一 (或加指定数量)"""
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def get(self, name):
+        """读取单个计数器"""
+        with self._lock:
+            return self._counts.get(name, 0)
+
+    def snapshot(self):
+        """返回所有计数器的副本"""
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self, prefix=None):
+        """清零计数器，可只清除指定前缀的计数器"""
+        with self._lock:
+            if prefix is None:
+                self._counts.clear()
+            else:
+                for name in [n for n in self._counts if n.startswith(prefix)]:
+                    del self._counts[name]
+
+
+# 全局计数器实例
+COUNTERS = PerfCounters()
+
+
+def current_rss():
+    """当前进程的常驻内存 (字节)，无法获取时返回None"""
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                    "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.WinDLL("kernel32")
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        if kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def format_bytes(n):
+    """把字节数格式化为 KB/MB/GB"""
+    for unit in ("B", "KB", "MB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.2f} GB"
+
+
+class MemoryMeasurement:
+    """一段时间内的内存峰值和结束时保留的内存 (相对于开始时，单位字节)"""
+
+    def __init__(self, name, mode):
+        self.name = name
+        self.mode = mode
+        self.peak = 0
+        self.retained = 0
+        self.ms = 0.0
+        # tracemalloc方式下阶段开始时相对任务开始已分配的内存
+        self.offset = 0
+        self._start_time = time.perf_counter()
+        self._base = self.read()
+        self._max = self._base
+
+    def read(self):
+        if self.mode == "tracemalloc":
+            return tracemalloc.get_traced_memory()[0]
+        if self.mode == "rss":
+            return current_rss() or 0
+        return 0
+
+    def sample(self, value):
+        if value > self._max:
+            self._max = value
+
+    def stop(self):
+        end = self.read()
+        if self.mode == "tracemalloc":
+            # tracemalloc的峰值从阶段开始时重置 (见 MemoryProfiler.stage)
+            self.sample(tracemalloc.get_traced_memory()[1])
+        self.sample(end)
+        self.peak = self._max - self._base
+        self.retained = end - self._base
+        self.ms = (time.perf_counter() - self._start_time) * 1000
+
+    def to_dict(self):
+        return {"name": self.name, "peak": self.peak, "retained": self.retained, "ms": round(self.ms, 1)}
+
+
+class JobMemory(MemoryMeasurement):
+    """一个生成任务的内存记录，包含各阶段的记录和发生的降级"""
+
+    def __init__(self, name, mode, info=None):
+        super().__init__(name, mode)
+        self.info = info or {}
+        self.stages = []
+        self.downgrades = []
+        # 其他进程中测得的最高峰值
+        self.external = 0
+
+    def add_stage(self, name, peak, retained=0, ms=0.0):
+        """记录在其他进程中测得的阶段 (例如图表沙箱子进程)，其峰值与本进程的峰值相加计入任务峰值"""
+        stage = MemoryMeasurement(name, "off")
+        stage.peak, stage.retained, stage.ms = peak, retained, ms
+        self.stages.append(stage)
+        self.external = max(self.external, peak)
+
+    def stop(self):
+        super().stop()
+        self.peak += self.external
+
+    def summary(self):
+        """状态栏中显示的简短说明"""
+        if self.mode == "off":
+            return ""
+        text = f"内存峰值 {format_bytes(self.peak)}，保留 {format_bytes(self.retained)}"
+        stages = [s for s in self.stages if s.peak > 0]
+        if stages:
+            top = max(stages, key=lambda s: s.peak)
+            text += f" (最高阶段: {top.name} {format_bytes(top.peak)})"
+        if self.downgrades:
+            text += f"，已降级: {'、'.join(self.downgrades)}"
+        return text
+
+    def to_dict(self):
+        record = {
+            "job": self.name,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "mode": self.mode,
+            "peak": self.peak,
+            "retained": self.retained,
+            "ms": round(self.ms, 1),
+            "stages": [stage.to_dict() for stage in self.stages],
+            "downgrades": self.downgrades,
+        }
+        record.update(self.info)
+        return record
+
+
+class MemoryProfiler:
+    """按任务和阶段统计内存
+
+    任务和阶段按线程记录: 渲染函数中的 stage() 只在当前线程有进行中的任务时才统计，否则没有开销。
+    tracemalloc方式下每个阶段都会重置进程级的峰值，所以任务之间互斥，并行的批处理任务在统计时依次执行。
+    """
+
+    def __init__(self, mode=MEMORY_PROFILE, trace_path=MEMORY_TRACE, budget=MEMORY_BUDGET):
+        self.mode = mode
+        self.trace_path = trace_path
+        self.budget = budget
+        self.last = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._active = set()
+        self._wake = threading.Event()
+        self._sampler = None
+        self._tracing = 0
+        # tracemalloc方式下同一时间只统计一个任务
+        self._trace_job = threading.Lock()
+
+    def current_job(self):
+        return getattr(self._local, "job", None)
+
+    def start_sampler(self):
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self.sample_loop, name="memory-sampler", daemon=True)
+            self._sampler.start()
+
+    def sample_loop(self):
+        """采样线程: 有进行中的测量时按间隔读取RSS，更新各测量的峰值"""
+        while True:
+            self._wake.wait()
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._wake.clear()
+                    continue
+            rss = current_rss()
+            if rss is not None:
+                for measurement in active:
+                    measurement.sample(rss)
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+    def begin(self, name, factory):
+        if self.mode == "tracemalloc":
+            with self._lock:
+                if self._tracing == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                self._tracing += 1
+            tracemalloc.reset_peak()
+        measurement = factory()
+        if self.mode == "rss":
+            with self._lock:
+                self._active.add(measurement)
+                self.start_sampler()
+                self._wake.set()
+        return measurement
+
+    def end(self, measurement):
+        with self._lock:
+            self._active.discard(measurement)
+        measurement.stop()
+        if self.mode == "tracemalloc":
+            with self._lock:
+                self._tracing -= 1
+                if self._tracing == 0:
+                    tracemalloc.stop()
+
+    @contextmanager
+    def job(self, name, **info):
+        """统计一个生成任务，结束后写入JSON记录；info为记录中附加的字段"""
+        if self.mode == "off" or self.current_job() is not None:
+            # 不统计或嵌套在其他任务中 (例如批处理中的单个图标) 时沿用外层任务
+            yield self.current_job() or JobMemory(name, "off", info)
+            return
+        if self.mode == "tracemalloc":
+            self._trace_job.acquire()
+        job = self.begin(name, lambda: JobMemory(name, self.mode, info))
+        self._local.job = job
+        try:
+            yield job
+        finally:
+            self._local.job = None
+            self.end(job)
+            if self.mode == "tracemalloc":
+                # tracemalloc的峰值按阶段重置，任务峰值取各阶段峰值 (相对任务开始) 的最大值
+                job.peak = max([job.peak] + [s.peak + s.offset for s in job.stages])
+            if self.mode == "tracemalloc":
+                self._trace_job.release()
+            self.last = job
+            COUNTERS.incr("memory.jobs")
+            self.write_trace(job)
+
+    @contextmanager
+    def stage(self, name):
+        """统计当前任务中的一个阶段 (当前线程没有进行中的任务时不统计)"""
+        job = self.current_job()
+        if job is None or job.mode == "off":
+            yield None
+            return
+        stage = self.begin(name, lambda: MemoryMeasurement(name, self.mode))
+        if self.mode == "tracemalloc":
+            stage.offset = stage._base - job._base
+        try:
+            yield stage
+        finally:
+            self.end(stage)
+            job.stages.append(stage)
+
+    def write_trace(self, job):
+        if not self.trace_path:
+            return
+        try:
+            with self._lock, open(self.trace_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(job.to_dict(), ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+    def under_pressure(self, extra_bytes):
+        """再分配 extra_bytes 后是否会超出软内存上限"""
+        if not self.budget:
+            return False
+        rss = current_rss()
+        return rss is not None and rss + extra_bytes > self.budget
+
+    def downgrade(self, what):
+        """记录一次降级 (计入当前任务)"""
+        COUNTERS.incr("memory.downgrades")
+        job = self.current_job()
+        if job is not None and what not in job.downgrades:
+            job.downgrades.append(what)
+
+
+# 全局内存统计实例
+MEMORY = MemoryProfiler()
+
+
+def memory_stage(name):
+    """统计当前任务的一个阶段 (没有进行中的任务时为空操作)"""
+    if MEMORY.current_job() is None:
+        return nullcontext()
+    return MEMORY.stage(name)
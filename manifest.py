@@ -0,0 +1,627 @@
+"""
+批量清单
+
+用一个JSON或TOML清单描述大量图标 (源、生成方式、尺寸、导出目标)，一次生成全部。
+
+用法:
+    python manifest.py 清单.toml [-j 线程数] [--memory MB] [--only 名称...] [--watch]
+
+清单格式 (TOML，JSON的结构相同):
+    [defaults]
+    sizes = [16, 32, 48, 256]
+    out_dir = "build/icons"          # 相对于清单所在目录
+    outputs = ["ico"]
+
+    [[icons]]
+    name = "app"
+    type = "image"                   # image/svg/text/unicode/emoji/css/matplotlib，有source时可省略
+    source = "art/app.png"
+    settings = { effect = "棕褐色", shape = "圆角矩形" }
+    outputs = ["ico", { format = "png", size = 256 }, { format = "webp", target_ssim = 0.97 }]
+
+各类型的输入: image为source；svg为source或svg；text/unicode/emoji为text；
+css为css或source；matplotlib为code或source，以及chart_type。
+svg可以指定 optimize_svg = true，光栅化前先精简文档 (见 svg_optimize)。
+导出目标: ico (可选 ico_depth、dither)、png (可选 size)、webp/jpg (可选 size、quality 或 target_ssim)，
+都可以指定 path 和 optimize (PNG无损优化)。
+
+清单先被转换为工作图再执行，多个图标共用的工作只做一次:
+- 同一个源图片只解码一次 (静态图片)
+- 同一个字体文件只加载一次 (按字号预先加载后各图标共用)
+- 内容相同的SVG只解析一次
+- 源和设置完全相同的图标只渲染一次，再分别导出
+共享结果在最后一个使用者完成后释放；渲染在线程池中执行，
+同时进行的任务的估计内存不超过预算。
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import tomllib
+except ImportError:  # Python 3.10及以下
+    tomllib = None
+
+from PIL import Image
+
+from icon_import import open_source_image
+from input_limits import MAX_DECODED_PIXELS, check_image
+from instrumentation import COUNTERS, MEMORY, format_bytes, memory_stage
+from watch import DEFAULT_SIZES, WATCH_DEBOUNCE, WATCH_INTERVAL, Watcher
+
+# 支持的图标类型
+MANIFEST_TYPES = ("image", "svg", "text", "unicode", "emoji", "css", "matplotlib")
+
+# 导出格式 -> 扩展名
+OUTPUT_FORMATS = {"ico": ".ico", "png": ".png", "webp": ".webp", "jpg": ".jpg"}
+
+# 同时进行的渲染任务的估计内存上限
+MANIFEST_MEMORY_BUDGET = 512 * 1024 * 1024
+
+# 默认线程数
+DEFAULT_MANIFEST_WORKERS = os.cpu_count() or 1
+
+
+class ManifestError(Exception):
+    """清单格式错误"""
+
+
+class IconJob:
+    """清单中的一个图标: 渲染规格、导出目标和依赖的源文件"""
+
+    def __init__(self, name, spec, outputs, inputs):
+        self.name = name
+        self.spec = spec
+        self.outputs = outputs
+        self.inputs = inputs
+
+
+def read_manifest_data(path):
+    """读取清单文件 (.toml 或 .json)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.lower().endswith(".toml"):
+        if tomllib is None:
+            raise ManifestError("读取TOML清单需要Python 3.11及以上，或改用JSON清单")
+        try:
+            return tomllib.loads(data.decode("utf-8"))
+        except tomllib.TOMLDecodeError as e:
+            raise ManifestError(f"TOML格式错误: {e}")
+    try:
+        return json.loads(data.decode("utf-8"))
+    except json.JSONDecodeError as e:
+        raise ManifestError(f"JSON格式错误: {e}")
+
+
+def parse_sizes(value, where):
+    if not isinstance(value, list) or not value:
+        raise ManifestError(f"{where}: sizes 必须是非空的整数列表")
+    if not all(isinstance(size, int) and size > 0 for size in value):
+        raise ManifestError(f"{where}: 无效的尺寸 {value}")
+    return sorted(set(value))
+
+
+def read_text_file(path, where):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError as e:
+        raise ManifestError(f"{where}: 无法读取 {path}: {e}")
+
+
+def parse_settings(kind, settings, where):
+    """检查设置名称 (未知的名称通常是拼写错误)"""
+    from icon_render import (DEFAULT_EMOJI_SETTINGS, DEFAULT_IMAGE_SETTINGS, DEFAULT_TEXT_SETTINGS,
+                             DEFAULT_UNICODE_SETTINGS)
+
+    defaults = {
+        "image": DEFAULT_IMAGE_SETTINGS,
+        "text": DEFAULT_TEXT_SETTINGS,
+        "unicode": DEFAULT_UNICODE_SETTINGS,
+        "emoji": DEFAULT_EMOJI_SETTINGS,
+    }.get(kind)
+    if not settings:
+        return {}
+    if defaults is None:
+        raise ManifestError(f"{where}: {kind} 类型没有 settings")
+    if not isinstance(settings, dict):
+        raise ManifestError(f"{where}: settings 必须是表/对象")
+    unknown = sorted(set(settings) - set(defaults))
+    if unknown:
+        raise ManifestError(f"{where}: 未知的设置 {', '.join(unknown)}")
+    if settings.get("effect"):
+        from effects import parse_chain
+
+        try:
+            parse_chain(settings["effect"])
+        except (TypeError, ValueError) as e:
+            raise ManifestError(f"{where}: 效果 {settings['effect']!r} 无效: {e}")
+    return dict(settings)
+
+
+def parse_output(item, name, out_dir, sizes, where):
+    """把导出目标统一为字典: {"format", "path", "size", "quality", "target_ssim", "optimize", ...}"""
+    from icon_store import DITHER_NAMES, ICO_DEPTH_POLICIES
+
+    if isinstance(item, str):
+        item = {"format": item}
+    if not isinstance(item, dict):
+        raise ManifestError(f"{where}: 导出目标必须是格式名或表/对象")
+    output = dict(item)
+    fmt = str(output.get("format", "")).lower()
+    fmt = "jpg" if fmt == "jpeg" else fmt
+    if fmt not in OUTPUT_FORMATS:
+        raise ManifestError(f"{where}: 不支持的导出格式 {output.get('format')!r}")
+    output["format"] = fmt
+
+    size = output.get("size")
+    if size is not None and size not in sizes:
+        raise ManifestError(f"{where}: 导出尺寸 {size} 不在 sizes 中")
+    if fmt == "ico":
+        depth = output.setdefault("ico_depth", next(iter(ICO_DEPTH_POLICIES)))
+        dither = output.setdefault("dither", next(iter(DITHER_NAMES)))
+        if depth not in ICO_DEPTH_POLICIES:
+            raise ManifestError(f"{where}: 未知的ICO位深策略 {depth!r}")
+        if dither not in DITHER_NAMES:
+            raise ManifestError(f"{where}: 未知的抖动方式 {dither!r}")
+    output.setdefault("optimize", False)
+
+    default_name = name if size is None or fmt == "ico" else f"{name}-{size}"
+    output["path"] = os.path.join(out_dir, output.get("path") or default_name + OUTPUT_FORMATS[fmt])
+    return output
+
+
+def parse_entry(entry, defaults, base, index):
+    """把清单中的一项转换为IconJob"""
+    from icon_render import DEFAULT_CHART_TYPE, DEFAULT_SVG_BACKGROUND, source_type
+
+    where = f"icons[{index}]"
+    if not isinstance(entry, dict):
+        raise ManifestError(f"{where}: 必须是表/对象")
+    source = entry.get("source")
+    if source is not None:
+        source = os.path.normpath(os.path.join(base, source))
+    name = entry.get("name") or (source and os.path.splitext(os.path.basename(source))[0])
+    if not name:
+        raise ManifestError(f"{where}: 缺少 name")
+    where = f"{where} ({name})"
+
+    kind = entry.get("type") or (source and source_type(source))
+    if kind not in MANIFEST_TYPES:
+        raise ManifestError(f"{where}: 未知的类型 {kind!r} (可选: {', '.join(MANIFEST_TYPES)})")
+
+    sizes = parse_sizes(entry.get("sizes", defaults.get("sizes", list(DEFAULT_SIZES))), where)
+    spec = {"type": kind, "sizes": sizes}
+    inputs = [source] if source else []
+
+    if kind == "image":
+        if not source:
+            raise ManifestError(f"{where}: image 类型需要 source")
+        spec["source"] = source
+    elif kind in ("svg", "css", "matplotlib"):
+        field = {"svg": "svg", "css": "css", "matplotlib": "code"}[kind]
+        code = entry.get(field)
+        if code is None:
+            if not source:
+                raise ManifestError(f"{where}: 需要 {field} 或 source")
+            code = read_text_file(source, where)
+        spec[field] = code
+    else:
+        if not entry.get("text"):
+            raise ManifestError(f"{where}: 需要 text")
+        spec["text"] = entry["text"]
+
+    if kind == "svg" and entry.get("optimize_svg"):
+        spec["optimize_svg"] = True
+    if kind in ("svg", "matplotlib"):
+        spec["bg_color"] = entry.get("bg_color", DEFAULT_SVG_BACKGROUND)
+        spec["alpha"] = entry.get("alpha", 1.0)
+    if kind == "matplotlib":
+        spec["chart_type"] = entry.get("chart_type", DEFAULT_CHART_TYPE)
+    settings = parse_settings(kind, entry.get("settings"), where)
+    if settings:
+        spec["settings"] = settings
+
+    out_dir = os.path.join(base, entry.get("out_dir", defaults.get("out_dir", ".")))
+    outputs = [
+        parse_output(item, name, out_dir, sizes, where)
+        for item in entry.get("outputs", defaults.get("outputs", ["ico"]))
+    ]
+    if not outputs:
+        raise ManifestError(f"{where}: 没有导出目标")
+    return IconJob(name, spec, outputs, inputs)
+
+
+def load_manifest(path):
+    """读取并检查清单，返回 [IconJob]"""
+    data = read_manifest_data(path)
+    if not isinstance(data, dict):
+        raise ManifestError("清单顶层必须是表/对象")
+    defaults = data.get("defaults", {})
+    icons = data.get("icons")
+    if not isinstance(icons, list) or not icons:
+        raise ManifestError("清单中没有 icons 列表")
+
+    base = os.path.dirname(os.path.abspath(path))
+    jobs = [parse_entry(entry, defaults, base, i) for i, entry in enumerate(icons)]
+    names = Counter(job.name for job in jobs)
+    duplicates = sorted(name for name, count in names.items() if count > 1)
+    if duplicates:
+        raise ManifestError(f"图标名称重复: {', '.join(duplicates)}")
+    paths = Counter(output["path"] for job in jobs for output in job.outputs)
+    duplicates = sorted(path for path, count in paths.items() if count > 1)
+    if duplicates:
+        raise ManifestError(f"导出路径重复: {', '.join(duplicates)}")
+    return jobs
+
+
+class SharedWork:
+    """只计算一次的共享结果 (解码的图片、加载的字体、解析的SVG)
+
+    按预先登记的使用次数计数，最后一个使用者释放后丢弃结果，限制内存占用。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._uses = Counter()
+
+    def add_use(self, key):
+        self._uses[key] += 1
+
+    def acquire(self, key, compute):
+        """取得共享结果，第一个使用者负责计算，其余使用者等待"""
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if owner:
+            COUNTERS.incr(f"manifest.{key[0]}_computed")
+            try:
+                future.set_result(compute())
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            COUNTERS.incr(f"manifest.{key[0]}_reused")
+        return future.result()
+
+    def release(self, key):
+        with self._lock:
+            self._uses[key] -= 1
+            if self._uses[key] <= 0:
+                self._futures.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._futures)
+
+
+def decode_image(path):
+    img = check_image(open_source_image(path))
+    img.load()
+    return img
+
+
+def preload_fonts(requests):
+    """按字号加载字体 (结果进入 icon_render 的字体缓存，渲染时直接使用)"""
+    from icon_render import load_font
+
+    for family, style, text, size in requests:
+        load_font(family, style, text, size)
+    return len(requests)
+
+
+class RenderNode:
+    """工作图中的渲染节点: 一个渲染规格及使用该结果的所有导出目标"""
+
+    def __init__(self, key, spec):
+        self.key = key
+        self.spec = spec
+        # [(共享结果的键, 计算函数, 放入spec的字段名或None)]
+        self.shared = []
+        # [(图标名称, 导出目标)]
+        self.outputs = []
+        self.estimate = sum(size * size * 4 for size in spec["sizes"]) * 2
+
+
+def spec_key(spec):
+    data = json.dumps(spec, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def build_graph(jobs):
+    """把图标任务转换为工作图，返回 (渲染节点列表, SharedWork)"""
+    from font_index import FONT_INDEX
+    from icon_render import (DEFAULT_TEXT_SETTINGS, DEFAULT_UNICODE_SETTINGS, SVG_IN_SANDBOX, font_requests,
+                             parse_svg)
+
+    shared = SharedWork()
+    nodes = {}
+    # 字体文件 -> 需要加载的字号，以及使用该字体的节点
+    font_requests_by_file = {}
+    font_users = {}
+    for job in jobs:
+        key = spec_key(job.spec)
+        node = nodes.get(key)
+        if node is None:
+            node = nodes[key] = RenderNode(key, job.spec)
+            spec = job.spec
+            kind = spec["type"]
+            if kind == "image":
+                path = spec["source"]
+                try:
+                    with Image.open(path) as probe:
+                        width, height = probe.size
+                        animated = getattr(probe, "n_frames", 1) > 1
+                        oversized = width * height > MAX_DECODED_PIXELS
+                except Image.DecompressionBombError:
+                    oversized = True
+                except OSError as e:
+                    raise ManifestError(f"{job.name}: 无法读取图片 {path}: {e}")
+                # 超出像素上限的图片不预先解码，渲染时报告该图标的错误；动画逐帧读取，不共用解码结果
+                if not oversized and not animated:
+                    node.shared.append((("decode", path), lambda path=path: decode_image(path), "image"))
+                    node.estimate += width * height * 4
+            elif kind == "svg" and not SVG_IN_SANDBOX:
+                # 在沙箱中渲染时由各子进程解析，不共用解析结果
+                code = spec["svg"]
+                optimize = spec.get("optimize_svg", False)
+                digest = hashlib.sha1(code.encode("utf-8")).hexdigest()
+                node.shared.append((("svg", digest, optimize),
+                                    lambda code=code, optimize=optimize: parse_svg(code, optimize), "svg_document"))
+            elif kind in ("text", "unicode"):
+                defaults = DEFAULT_TEXT_SETTINGS if kind == "text" else DEFAULT_UNICODE_SETTINGS
+                settings = dict(defaults, **spec.get("settings", {}))
+                for request in font_requests(kind, spec["text"], spec["sizes"], settings):
+                    font = ("font",) + tuple(FONT_INDEX.resolve(request[0], request[1], request[2]))
+                    font_requests_by_file.setdefault(font, set()).add(request)
+                    font_users.setdefault(font, set()).add(key)
+        node.outputs.append((job.name, job.outputs))
+
+    # 每个字体文件一个共享节点，一次加载该字体被用到的所有字号
+    for font, requests in font_requests_by_file.items():
+        for key in font_users[font]:
+            nodes[key].shared.append((font, lambda requests=sorted(requests): preload_fonts(requests), None))
+
+    for node in nodes.values():
+        for key, _, _ in node.shared:
+            shared.add_use(key)
+
+    # 使用相同共享结果的节点相邻执行，共享结果可以尽早释放
+    ordered = sorted(nodes.values(), key=lambda node: [str(key) for key, _, _ in node.shared])
+    return ordered, shared
+
+
+def write_output(icons, output):
+    """把渲染结果写为一个导出目标，返回输出路径"""
+    from animation import AnimatedIconSet
+    from icon_store import DITHER_NAMES, ICO_DEPTH_POLICIES, depths_for_sizes, write_ico, write_png
+
+    if isinstance(icons, AnimatedIconSet):
+        # 静态格式使用第一帧
+        icons = icons.first_frame
+    path = output["path"]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fmt = output["format"]
+    size = output.get("size")
+    index = icons.largest_index() if size is None else icons.sizes.index((size, size))
+
+    if fmt == "ico":
+        rules, palette_format = ICO_DEPTH_POLICIES[output["ico_depth"]]
+        write_ico(icons, path, depths=depths_for_sizes(rules, icons.sizes),
+                  dither=DITHER_NAMES[output["dither"]], palette_format=palette_format,
+                  optimize=output["optimize"])
+    elif fmt == "png":
+        write_png(icons, path, index, optimize=output["optimize"])
+    else:
+        img = icons[index]
+        encoder_format = "jpeg" if fmt == "jpg" else fmt
+        if output.get("target_ssim"):
+            from quality_encode import encode_for_quality
+
+            data, _, _ = encode_for_quality(img, encoder_format, output["target_ssim"])
+            with open(path, "wb") as f:
+                f.write(data)
+        else:
+            if encoder_format == "jpeg" and img.mode == "RGBA":
+                img = img.convert("RGB")
+            img.save(path, format=encoder_format, quality=output.get("quality", 95))
+    return path
+
+
+class ManifestRunner:
+    """执行工作图: 线程池并行渲染，同时进行的任务的估计内存不超过预算"""
+
+    def __init__(self, workers=DEFAULT_MANIFEST_WORKERS, memory_budget=MANIFEST_MEMORY_BUDGET):
+        self.workers = workers
+        self.memory_budget = memory_budget
+        # 最近一次执行的工作图统计: 图标数、渲染次数、共享结果数及其被使用的次数
+        self.stats = {}
+        self._in_use = 0
+        self._memory = threading.Condition()
+
+    def run(self, jobs, progress=None):
+        """生成所有图标，返回每个图标的结果 [{"name", "paths", "ms", "error", "memory"}]
+
+        memory 为渲染该图标的内存峰值 (字节，并行渲染时包含同时进行的其他任务的用量)。
+
+        progress: 可选回调 progress(已完成的图标数, 总数)
+        """
+        from icon_render import render_icon_set
+
+        nodes, shared = build_graph(jobs)
+        self.stats = {
+            "icons": len(jobs),
+            "renders": len(nodes),
+            "shared": len({key for node in nodes for key, _, _ in node.shared}),
+            "shared_uses": sum(len(node.shared) for node in nodes),
+        }
+        results = []
+        results_lock = threading.Lock()
+
+        def run_node(node):
+            start = time.perf_counter()
+            paths = {}
+            error = None
+            names = [name for name, _ in node.outputs]
+            try:
+                with MEMORY.job("+".join(names), type=node.spec["type"]) as usage:
+                    spec = dict(node.spec)
+                    with memory_stage("共享输入"):
+                        for key, compute, field in node.shared:
+                            value = shared.acquire(key, compute)
+                            if field:
+                                spec[field] = value
+                    with memory_stage("渲染"):
+                        icons = render_icon_set(spec)
+                    with memory_stage("写出"):
+                        for name, outputs in node.outputs:
+                            paths[name] = [write_output(icons, output) for output in outputs]
+            except Exception as e:
+                usage = None
+                error = str(e)
+                COUNTERS.incr("manifest.errors")
+            finally:
+                for key, _, _ in node.shared:
+                    shared.release(key)
+                with self._memory:
+                    self._in_use -= node.estimate
+                    self._memory.notify_all()
+
+            elapsed = (time.perf_counter() - start) * 1000
+            with results_lock:
+                for name, _ in node.outputs:
+                    results.append({"name": name, "paths": paths.get(name, []), "ms": elapsed, "error": error,
+                                    "memory": usage.peak if usage is not None else None})
+                done = len(results)
+            if progress:
+                progress(done, len(jobs))
+
+        COUNTERS.incr("manifest.renders", len(nodes))
+        COUNTERS.incr("manifest.icons", len(jobs))
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = []
+            for node in nodes:
+                # 超出内存预算时等待已提交的任务完成 (只有一个任务时总是允许)
+                with self._memory:
+                    self._memory.wait_for(
+                        lambda: self._in_use == 0 or self._in_use + node.estimate <= self.memory_budget
+                    )
+                    self._in_use += node.estimate
+                futures.append(pool.submit(run_node, node))
+            for future in futures:
+                future.result()
+        order = {job.name: i for i, job in enumerate(jobs)}
+        return sorted(results, key=lambda result: order[result["name"]])
+
+
+def ensure_fonts():
+    """批处理时同步加载字体索引 (界面中由后台线程加载)"""
+    from font_index import FONT_INDEX
+
+    if not FONT_INDEX.ready:
+        FONT_INDEX.load()
+
+
+def run_manifest(path, names=None, workers=DEFAULT_MANIFEST_WORKERS, memory_budget=MANIFEST_MEMORY_BUDGET):
+    """读取清单并生成，返回 (全部图标任务, 结果, 工作图统计)
+
+    names: 只生成这些图标 (None表示全部)
+    """
+    all_jobs = load_manifest(path)
+    jobs = all_jobs
+    if names is not None:
+        unknown = sorted(set(names) - {job.name for job in all_jobs})
+        if unknown:
+            raise ManifestError(f"清单中没有这些图标: {', '.join(unknown)}")
+        jobs = [job for job in all_jobs if job.name in names]
+    ensure_fonts()
+    runner = ManifestRunner(workers, memory_budget)
+    results = runner.run(jobs) if jobs else []
+    return all_jobs, results, runner.stats
+
+
+def print_results(results, stats, elapsed):
+    failed = 0
+    for result in results:
+        if result["error"]:
+            failed += 1
+            print(f"失败 {result['name']}: {result['error']}", file=sys.stderr)
+        else:
+            memory = f" (内存峰值 {format_bytes(result['memory'])})" if result.get("memory") else ""
+            print(f"已生成 {result['name']}: {', '.join(result['paths'])}{memory}")
+    if stats:
+        print(f"共 {stats['icons']} 个图标，失败 {failed} 个；渲染 {stats['renders']} 次，"
+              f"共享结果 {stats['shared']} 个 (被使用 {stats['shared_uses']} 次)，耗时 {elapsed:.2f} 秒")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按清单批量生成图标")
+    parser.add_argument("manifest", help="JSON或TOML清单文件")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_MANIFEST_WORKERS, help="线程数")
+    parser.add_argument("--memory", type=int, default=MANIFEST_MEMORY_BUDGET // (1024 * 1024),
+                        help="同时进行的任务的内存预算 (MB)")
+    parser.add_argument("--soft-limit", type=int, metavar="MB",
+                        help="进程的软内存上限 (MB)，预计超出时大图降采样解码、邻域效果分块处理")
+    parser.add_argument("--only", nargs="+", metavar="名称", help="只生成这些图标")
+    parser.add_argument("--watch", action="store_true", help="生成后继续监视清单和源文件，变化时重新生成受影响的图标")
+    args = parser.parse_args(argv)
+    budget = args.memory * 1024 * 1024
+    if args.soft_limit:
+        MEMORY.budget = args.soft_limit * 1024 * 1024
+
+    start = time.perf_counter()
+    try:
+        jobs, results, stats = run_manifest(args.manifest, args.only, args.workers, budget)
+    except ManifestError as e:
+        print(f"清单错误: {e}", file=sys.stderr)
+        return 2
+    failed = print_results(results, stats, time.perf_counter() - start)
+    if not args.watch:
+        return 1 if failed else 0
+
+    manifest_path = os.path.abspath(args.manifest)
+    state = {"jobs": jobs}
+
+    def watched_paths():
+        return [manifest_path] + [path for job in state["jobs"] for path in job.inputs]
+
+    def handle(paths, changed_at=None):
+        start = time.perf_counter()
+        if manifest_path in paths:
+            # 清单本身变化: 重新读取并生成全部 (仍受 --only 限制)
+            names = args.only
+        else:
+            # 只重新生成使用了变化源文件的图标
+            names = [job.name for job in state["jobs"]
+                     if set(job.inputs) & set(paths) and (not args.only or job.name in args.only)]
+        try:
+            jobs, results, stats = run_manifest(manifest_path, names, args.workers, budget)
+        except ManifestError as e:
+            print(f"清单错误: {e}", file=sys.stderr)
+            return
+        state["jobs"] = jobs
+        watcher.set_paths(watched_paths())
+        print_results(results, stats, time.perf_counter() - start)
+
+    watcher = Watcher(watched_paths(), handle, WATCH_INTERVAL, WATCH_DEBOUNCE)
+    print(f"正在监视清单和 {len(watcher.paths) - 1} 个源文件，按 Ctrl+C 停止")
+    try:
+        while True:
+            time.sleep(watcher.interval)
+            watcher.run_cycle()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,459 @@
+"""
+Matplotlib图表沙箱
+
+用户输入的图表代码不在界面进程中执行，而是交给预热好的子进程池:
+子进程启动时就导入matplotlib (Agg后端) 和numpy，之后每个任务只需执行代码和绘图。
+每个任务有超时和内存上限，超时的进程直接终止并重新启动，
+渲染结果通过共享内存传回，不经过管道序列化。
+
+同样的子进程池也用于SVG光栅化 (SVG_SANDBOX，不预先导入matplotlib)，
+异常的SVG文档 (use引用爆炸、巨大的滤镜区域等) 超时后同样直接终止，不会卡住渲染线程。
+"""
+import builtins
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from instrumentation import COUNTERS, MEMORY, MemoryProfiler
+
+# 沙箱进程数量 (一个留给实时预览，一个留给生成预览)
+SANDBOX_WORKERS = 2
+
+# 单个任务的默认超时 (秒)
+CHART_TIMEOUT = 10
+
+# 单个SVG光栅化任务的默认超时 (秒)
+SVG_TIMEOUT = 10
+
+# 各类任务超时的错误信息
+TIMEOUT_MESSAGES = {
+    "chart": "图表代码运行超过 {} 秒，已终止",
+    "svg": "SVG渲染超过 {} 秒，已终止",
+}
+
+# 子进程启动 (导入matplotlib) 的超时 (秒)，不计入任务超时
+STARTUP_TIMEOUT = 60
+
+# 每个子进程在预热之后可额外使用的内存上限
+MEMORY_LIMIT = 1024 * 1024 * 1024
+
+# 用户代码未定义数据时使用的默认值
+DEFAULT_X = [1, 2, 3, 4, 5]
+DEFAULT_Y = [2, 3, 5, 7, 11]
+
+
+class ChartSandboxError(Exception):
+    """图表代码执行失败"""
+
+
+class ChartTimeoutError(ChartSandboxError):
+    """图表代码运行超时"""
+
+
+def apply_memory_limit(limit):
+    """限制当前进程可使用的内存，超出时用户代码会得到MemoryError"""
+    if not limit:
+        return
+    if os.name == "nt":
+        limit_job_memory(limit)
+        return
+    try:
+        import resource
+        with open("/proc/self/statm") as f:
+            used = int(f.read().split()[0]) * resource.getpagesize()
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        soft = used + limit
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+    except (ImportError, OSError, ValueError):
+        # macOS等系统没有/proc，也不强制RLIMIT_AS，只能不设上限
+        pass
+
+
+def limit_job_memory(limit):
+    """Windows: 把当前进程放入设置了内存上限的作业对象"""
+    import ctypes
+    from ctypes import wintypes
+
+    class IO_COUNTERS(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_ulonglong) for name in (
+            "ReadOperationCount", "WriteOperationCount", "OtherOperationCount",
+            "ReadTransferCount", "WriteTransferCount", "OtherTransferCount")]
+
+    class JOBOBJECT_BASIC_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ("PerProcessUserTimeLimit", ctypes.c_int64),
+            ("PerJobUserTimeLimit", ctypes.c_int64),
+            ("LimitFlags", wintypes.DWORD),
+            ("MinimumWorkingSetSize", ctypes.c_size_t),
+            ("MaximumWorkingSetSize", ctypes.c_size_t),
+            ("ActiveProcessLimit", wintypes.DWORD),
+            ("Affinity", ctypes.c_size_t),
+            ("PriorityClass", wintypes.DWORD),
+            ("SchedulingClass", wintypes.DWORD),
+        ]
+
+    class JOBOBJECT_EXTENDED_LIMIT_INFORMATION(ctypes.Structure):
+        _fields_ = [
+            ("BasicLimitInformation", JOBOBJECT_BASIC_LIMIT_INFORMATION),
+            ("IoInfo", IO_COUNTERS),
+            ("ProcessMemoryLimit", ctypes.c_size_t),
+            ("JobMemoryLimit", ctypes.c_size_t),
+            ("PeakProcessMemoryUsed", ctypes.c_size_t),
+            ("PeakJobMemoryUsed", ctypes.c_size_t),
+        ]
+
+    JobObjectExtendedLimitInformation = 9
+    JOB_OBJECT_LIMIT_PROCESS_MEMORY = 0x100
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+            (name, ctypes.c_size_t) for name in (
+                "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+
+    # 上限按已提交内存计算，加上预热后的用量
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    kernel32.K32GetProcessMemoryInfo(
+        kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+
+    job = kernel32.CreateJobObjectW(None, None)
+    if not job:
+        return
+    info = JOBOBJECT_EXTENDED_LIMIT_INFORMATION()
+    info.BasicLimitInformation.LimitFlags = JOB_OBJECT_LIMIT_PROCESS_MEMORY
+    info.ProcessMemoryLimit = counters.PagefileUsage + limit
+    if kernel32.SetInformationJobObject(
+            job, JobObjectExtendedLimitInformation, ctypes.byref(info), ctypes.sizeof(info)):
+        kernel32.AssignProcessToJobObject(job, kernel32.GetCurrentProcess())
+
+
+def attach_shared_memory(name):
+    """子进程打开父进程创建的共享内存 (由父进程负责释放)
+
+    子进程与父进程共用同一个资源跟踪进程，重复登记不会导致共享内存被提前删除。
+    """
+    return shared_memory.SharedMemory(name=name)
+
+
+def buffer_size(sizes):
+    """存放各尺寸RGBA图像所需的共享内存大小 (每边多留1像素余量)"""
+    return sum((size + 1) * (size + 1) * 4 for size in sizes)
+
+
+def draw_chart(ax, np, chart_type, x, y, y1=None):
+    """按图表类型绘制数据"""
+    if chart_type == "折线图":
+        ax.plot(x, y, marker='o')
+        if y1 is not None:
+            ax.plot(x, y1, marker='o')
+    elif chart_type == "柱状图":
+        ax.bar(x, y)
+        if y1 is not None:
+            ax.bar(x, y1, bottom=y)
+    elif chart_type == "饼图":
+        ax.pie(y, labels=x, autopct='%1.1f%%')
+    elif chart_type == "散点图":
+        ax.scatter(x, y)
+    elif chart_type == "雷达图":
+        theta = np.linspace(0, 2*np.pi, len(x), endpoint=False)
+        ax.plot(theta, y)
+        ax.fill(theta, y, alpha=0.25)
+        ax.set_xticks(theta)
+        ax.set_xticklabels(x)
+    elif chart_type == "面积图":
+        ax.stackplot(x, y)
+
+
+def run_chart_job(conn, job, matplotlib, np, plt, FigureCanvasAgg):
+    """在子进程中执行一个图表任务，图像写入共享内存，返回各图像尺寸"""
+    shm = attach_shared_memory(job["shm"])
+    try:
+        # 用户代码有独立的命名空间，样式设置也只在本任务内有效
+        namespace = {"__builtins__": builtins, "np": np, "plt": plt, "matplotlib": matplotlib}
+        shapes = []
+        offset = 0
+        with plt.style.context('ggplot'), plt.rc_context({'axes.facecolor': job["bg_color"]}):
+            exec(job["code"], namespace)
+
+            x = namespace.get('x', DEFAULT_X)
+            y = namespace.get('y', DEFAULT_Y)
+            y1 = namespace.get('y1', None)
+
+            for i, size in enumerate(job["sizes"]):
+                fig, ax = plt.subplots(figsize=(size/100, size/100), dpi=100)
+                draw_chart(ax, np, job["chart_type"], x, y, y1)
+
+                ax.set_facecolor(job["bg_color"])
+                fig.patch.set_alpha(job["alpha"])
+
+                canvas = FigureCanvasAgg(fig)
+                canvas.draw()
+                pixels = np.asarray(canvas.buffer_rgba())
+                height, width = pixels.shape[:2]
+
+                view = np.ndarray((height, width, 4), dtype=np.uint8, buffer=shm.buf, offset=offset)
+                view[:] = pixels
+                del view
+
+                shapes.append((width, height, offset))
+                offset += (size + 1) * (size + 1) * 4
+                plt.close(fig)
+                conn.send(("progress", i + 1))
+        return shapes
+    finally:
+        plt.close("all")
+        shm.close()
+
+
+def run_svg_job(conn, job):
+    """在子进程中光栅化SVG的各尺寸，图像写入共享内存，返回各图像尺寸 (背景由父进程合成)
+
+    svglib按宽度缩放，纵向较长的文档得到的图像超出为每个尺寸预留的空间，
+    这样的图像直接随结果通过管道传回 (位置处为像素数据)，与在当前进程中渲染的结果一致。
+    """
+    from icon_render import SvgDocument, render_svg
+
+    shm = attach_shared_memory(job["shm"])
+    try:
+        # 各尺寸共用同一次解析结果
+        doc = SvgDocument(job["svg"])
+        shapes = []
+        offset = 0
+        for i, size in enumerate(job["sizes"]):
+            img = render_svg(doc, size).convert("RGBA")
+            data = img.tobytes()
+            if img.width * img.height > (size + 1) * (size + 1):
+                shapes.append((img.width, img.height, data))
+            else:
+                shm.buf[offset:offset + len(data)] = data
+                shapes.append((img.width, img.height, offset))
+            offset += (size + 1) * (size + 1) * 4
+            conn.send(("progress", i + 1))
+        return shapes
+    finally:
+        shm.close()
+
+
+def load_chart_modules():
+    """导入绘图库 (Agg后端)"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import numpy as np
+    from matplotlib import pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    return matplotlib, np, plt, FigureCanvasAgg
+
+
+def worker_main(conn, memory_limit, preload=True):
+    """沙箱子进程入口: 预先导入绘图库 (preload为False时在第一个图表任务时导入)，然后循环执行任务"""
+    modules = load_chart_modules() if preload else None
+
+    apply_memory_limit(memory_limit)
+    # 子进程自己统计每个任务的内存峰值，随结果返回 (不写JSON记录，由父进程记入调用方的任务)
+    profiler = MemoryProfiler(trace_path=None)
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        try:
+            with profiler.job(job["kind"]) as usage:
+                if job["kind"] == "svg":
+                    shapes = run_svg_job(conn, job)
+                else:
+                    if modules is None:
+                        modules = load_chart_modules()
+                    shapes = run_chart_job(conn, job, *modules)
+            conn.send(("ok", shapes, {"peak": usage.peak, "retained": usage.retained, "ms": usage.ms}))
+        except (Exception, SystemExit) as e:
+            message = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            conn.send(("error", message))
+
+
+class ChartWorker:
+    """一个沙箱子进程及其通信管道"""
+
+    def __init__(self, context, memory_limit, preload=True):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(child_conn, memory_limit, preload), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self, timeout):
+        """等待子进程完成预热"""
+        if self.ready:
+            return
+        if not self.conn.poll(timeout):
+            raise ChartSandboxError("图表进程启动超时")
+        msg = self.conn.recv()
+        if msg[0] != "ready":
+            raise ChartSandboxError("图表进程启动失败")
+        self.ready = True
+
+    def run(self, job, timeout, progress=None):
+        """执行任务，返回 (各图像的 (宽, 高, 共享内存中的偏移或像素数据), 子进程的内存统计)"""
+        self.conn.send(job)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.conn.poll(remaining):
+                raise ChartTimeoutError(TIMEOUT_MESSAGES[job["kind"]].format(timeout))
+            msg = self.conn.recv()
+            if msg[0] == "progress":
+                if progress:
+                    progress(msg[1])
+            elif msg[0] == "ok":
+                return msg[1], msg[2]
+            else:
+                raise ChartSandboxError(msg[1])
+
+    def kill(self):
+        """强制结束子进程"""
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(1)
+
+
+class ChartSandbox:
+    """预热的图表子进程池
+
+    preload: 子进程启动时是否预先导入matplotlib (只做SVG光栅化的进程池不需要)
+    """
+
+    def __init__(self, workers=SANDBOX_WORKERS, timeout=CHART_TIMEOUT, memory_limit=MEMORY_LIMIT,
+                 preload=True):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.preload = preload
+        # spawn方式启动，不复制界面进程的Tk状态
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._started = False
+
+    def start(self):
+        """启动并预热子进程 (重复调用无影响)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.workers):
+            self._idle.put(self.spawn())
+
+    def spawn(self):
+        COUNTERS.incr("mpl_sandbox.spawned")
+        return ChartWorker(self._context, self.memory_limit, self.preload)
+
+    def render(self, code, chart_type, sizes, bg_color="#FFFFFF", alpha=1.0,
+               timeout=None, progress=None):
+        """在沙箱中执行图表代码并按各尺寸渲染，返回RGBA图像列表
+
+        progress 为可选的进度回调 (参数为已完成的尺寸数)，在调用线程中执行。
+        """
+        job = {
+            "kind": "chart",
+            "code": code,
+            "chart_type": chart_type,
+            "sizes": list(sizes),
+            "bg_color": bg_color,
+            "alpha": alpha,
+        }
+        return self.run(job, timeout, progress, "图表子进程")
+
+    def render_svg(self, svg_code, sizes, timeout=None, progress=None):
+        """在沙箱中光栅化SVG的各尺寸，返回RGBA图像列表 (不含背景)，超时时终止子进程"""
+        job = {"kind": "svg", "svg": svg_code, "sizes": list(sizes)}
+        return self.run(job, timeout, progress, "SVG子进程")
+
+    def run(self, job, timeout, progress, stage):
+        """把任务交给空闲的子进程执行，从共享内存取回图像"""
+        self.start()
+        timeout = timeout or self.timeout
+
+        shm = shared_memory.SharedMemory(create=True, size=buffer_size(job["sizes"]))
+        worker = self._idle.get()
+        try:
+            worker.wait_ready(STARTUP_TIMEOUT)
+            job["shm"] = shm.name
+            COUNTERS.incr("mpl_sandbox.jobs")
+            shapes, memory = worker.run(job, timeout, progress)
+            usage = MEMORY.current_job()
+            if usage is not None and usage.mode != "off":
+                usage.add_stage(stage, **memory)
+            return [
+                Image.frombytes("RGBA", (width, height),
+                                location if isinstance(location, bytes)
+                                else bytes(shm.buf[location:location + width * height * 4]))
+                for width, height, location in shapes
+            ]
+        except ChartTimeoutError:
+            COUNTERS.incr("mpl_sandbox.timeouts")
+            worker = self.restart(worker)
+            raise
+        except (EOFError, OSError):
+            # 子进程崩溃或超出内存上限被系统结束
+            worker = self.restart(worker)
+            raise ChartSandboxError("沙箱进程异常退出 (可能超出内存上限)")
+        except ChartSandboxError:
+            if not worker.ready:
+                # 启动超时或失败: 子进程没有完成预热，不能交给下一个任务
+                worker = self.restart(worker)
+            # 否则为子进程报告的错误: 该任务的消息已全部读完，子进程可以继续使用
+            raise
+        except BaseException:
+            # 读完结果之前被中断 (例如进度回调中取消任务): 管道中还留有该任务的消息，
+            # 子进程不能交给下一个任务
+            worker = self.restart(worker)
+            raise
+        finally:
+            self._idle.put(worker)
+            shm.close()
+            shm.unlink()
+
+    def restart(self, worker):
+        """结束出问题的子进程并启动新进程替换"""
+        worker.kill()
+        return self.spawn()
+
+    def shutdown(self):
+        """结束所有空闲子进程"""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.kill()
+        self._started = False
+
+
+# 全局共享的图表沙箱
+MPL_SANDBOX = ChartSandbox()
+
+# 全局共享的SVG光栅化沙箱 (第一次使用时启动)
+SVG_SANDBOX = ChartSandbox(timeout=SVG_TIMEOUT, preload=False)
@@ -0,0 +1,245 @@
+"""
+PNG体积优化
+
+对PNG数据做无损重新编码，在时间预算内并行尝试多种组合并保留最小的结果:
+- 颜色类型缩减: 不透明时去掉alpha，R=G=B时使用灰度，不超过256色时使用调色板 (含tRNS)
+- 行过滤器: 无、Sub、Up、Average、Paeth，以及按行自适应选择 (最小绝对值和)，全部向量化计算
+- zlib: 多种压缩策略 (默认、filtered、RLE)，最高压缩级别
+输出只包含必要的数据块 (IHDR、PLTE、tRNS、IDAT、IEND)，去掉文本、时间、gAMA等附加块。
+"""
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from instrumentation import COUNTERS
+
+# 一次优化 (可包含多张图像) 的默认时间预算 (秒)
+PNG_OPTIMIZE_BUDGET = 0.5
+
+# 尝试的zlib压缩策略和级别
+ZLIB_STRATEGIES = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE)
+ZLIB_LEVEL = 9
+
+# 行过滤器: 0-4 为PNG规范中的过滤器，"adaptive" 为按行选择
+PNG_FILTERS = ("adaptive", 0, 1, 2, 4)
+
+# PNG颜色类型
+COLOR_GRAY = 0
+COLOR_RGB = 2
+COLOR_PALETTE = 3
+COLOR_GRAY_ALPHA = 4
+COLOR_RGBA = 6
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+_executor = None
+
+
+def optimizer_executor():
+    """优化使用的线程池 (zlib压缩和numpy运算会释放GIL)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix="png-optimize")
+    return _executor
+
+
+class RawImage:
+    """一种颜色类型下待过滤的原始扫描行"""
+
+    def __init__(self, color_type, bit_depth, rows, bpp, palette=None, trns=None):
+        self.color_type = color_type
+        self.bit_depth = bit_depth
+        # (高, 每行字节数) uint8
+        self.rows = rows
+        # 过滤时使用的每像素字节数 (不足1字节按1计算)
+        self.bpp = bpp
+        self.palette = palette
+        self.trns = trns
+
+
+def pack_indices(indices, bit_depth):
+    """把调色板下标按位深打包为扫描行"""
+    if bit_depth == 8:
+        return indices
+    h, w = indices.shape
+    per_byte = 8 // bit_depth
+    padded = np.zeros((h, -(-w // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :w] = indices
+    groups = padded.reshape(h, -1, per_byte)
+    packed = np.zeros(groups.shape[:2], dtype=np.uint8)
+    for i in range(per_byte):
+        packed |= groups[:, :, i] << (8 - bit_depth * (i + 1))
+    return packed
+
+
+def color_variants(img, reduce=True):
+    """列出图像可无损使用的颜色类型 (最小的放在前面)
+
+    reduce 为假时保持原有颜色类型 (调色板图像仍为调色板，其余为RGBA)，只优化过滤器和压缩。
+    """
+    rgba = np.asarray(img.convert("RGBA"))
+    h, w = rgba.shape[:2]
+    alpha = rgba[..., 3]
+    opaque = bool((alpha == 255).all())
+    gray = bool(((rgba[..., 0] == rgba[..., 1]) & (rgba[..., 1] == rgba[..., 2])).all())
+    variants = []
+
+    # 调色板 (不超过256种RGBA颜色)
+    packed = rgba.view(np.uint32).reshape(h, w)
+    colors, inverse = np.unique(packed, return_inverse=True)
+    if len(colors) <= 256 and (reduce or img.mode == "P"):
+        entries = colors.view(np.uint8).reshape(-1, 4)
+        # 透明颜色排在前面，tRNS可以只写到最后一个不透明度不为255的颜色
+        order = np.argsort(entries[:, 3] == 255, kind="stable")
+        entries = entries[order]
+        remap = np.empty(len(order), dtype=np.uint8)
+        remap[order] = np.arange(len(order), dtype=np.uint8)
+        indices = remap[inverse.reshape(h, w)]
+        bit_depth = next(d for d in (1, 2, 4, 8) if len(colors) <= 1 << d)
+        translucent = int((entries[:, 3] < 255).sum())
+        variants.append(RawImage(
+            COLOR_PALETTE, bit_depth, pack_indices(indices, bit_depth), 1,
+            palette=entries[:, :3].tobytes(),
+            trns=entries[:translucent, 3].tobytes() if translucent else None
+        ))
+
+    if not reduce:
+        if not variants:
+            variants.append(RawImage(COLOR_RGBA, 8, rgba.reshape(h, w * 4), 4))
+    elif gray:
+        if opaque:
+            variants.append(RawImage(COLOR_GRAY, 8, np.ascontiguousarray(rgba[..., 0]), 1))
+        else:
+            variants.append(RawImage(COLOR_GRAY_ALPHA, 8, rgba[..., [0, 3]].reshape(h, w * 2), 2))
+    elif opaque:
+        variants.append(RawImage(COLOR_RGB, 8, rgba[..., :3].reshape(h, w * 3), 3))
+    else:
+        variants.append(RawImage(COLOR_RGBA, 8, rgba.reshape(h, w * 4), 4))
+    return variants
+
+
+def filter_rows(rows, bpp, filter_type):
+    """对所有扫描行应用过滤器，返回带过滤类型字节的数据"""
+    raw = rows.astype(np.int16)
+    h, stride = raw.shape
+    left = np.zeros_like(raw)
+    left[:, bpp:] = raw[:, :-bpp]
+    up = np.zeros_like(raw)
+    up[1:] = raw[:-1]
+
+    def paeth():
+        upper_left = np.zeros_like(raw)
+        upper_left[1:, bpp:] = raw[:-1, :-bpp]
+        p = left + up - upper_left
+        pa = np.abs(p - left)
+        pb = np.abs(p - up)
+        pc = np.abs(p - upper_left)
+        return np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upper_left))
+
+    predictors = {
+        0: lambda: 0,
+        1: lambda: left,
+        2: lambda: up,
+        3: lambda: (left + up) >> 1,
+        4: paeth,
+    }
+
+    if filter_type == "adaptive":
+        candidates = np.stack([(raw - predictors[f]()) & 0xFF for f in range(5)])
+        # 按有符号字节绝对值之和最小选择每行的过滤器
+        signed = np.where(candidates > 127, 256 - candidates, candidates)
+        choice = signed.sum(axis=2).argmin(axis=0)
+        filtered = candidates[choice, np.arange(h)]
+        types = choice
+    else:
+        filtered = (raw - predictors[filter_type]()) & 0xFF
+        types = np.full(h, filter_type)
+
+    out = np.empty((h, stride + 1), dtype=np.uint8)
+    out[:, 0] = types
+    out[:, 1:] = filtered
+    return out.tobytes()
+
+
+def chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def assemble_png(raw, width, height, idat):
+    """组装只含必要数据块的PNG"""
+    parts = [PNG_SIGNATURE,
+             chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, raw.bit_depth, raw.color_type, 0, 0, 0))]
+    if raw.palette is not None:
+        parts.append(chunk(b"PLTE", raw.palette))
+    if raw.trns is not None:
+        parts.append(chunk(b"tRNS", raw.trns))
+    parts.append(chunk(b"IDAT", idat))
+    parts.append(chunk(b"IEND", b""))
+    return b"".join(parts)
+
+
+def encode_candidate(raw, width, height, filter_type, strategy):
+    """按一种过滤器和压缩策略编码，返回PNG字节"""
+    compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS, 9, strategy)
+    data = filter_rows(raw.rows, raw.bpp, filter_type)
+    idat = compressor.compress(data) + compressor.flush()
+    return assemble_png(raw, width, height, idat)
+
+
+def optimize_pngs(items, budget=PNG_OPTIMIZE_BUDGET, reduce=True):
+    """无损优化多个PNG (字节或图像)，返回每个的最小编码
+
+    所有组合共用一个线程池和时间预算，超时未完成的组合放弃，
+    结果不会比原始数据 (图像则为Pillow默认编码) 更大。
+    reduce 为假时不改变颜色类型 (见 color_variants)。
+    """
+    deadline = time.perf_counter() + budget
+    best = []
+    futures = {}
+    executor = optimizer_executor()
+    for index, item in enumerate(items):
+        if isinstance(item, (bytes, bytearray)):
+            data = bytes(item)
+            img = Image.open(BytesIO(data))
+        else:
+            img = item
+            buffer = BytesIO()
+            img.save(buffer, format="PNG")
+            data = buffer.getvalue()
+        best.append(data)
+        width, height = img.size
+        # 颜色类型小的优先提交，预算不足时也能先得到收益最大的结果
+        for raw in color_variants(img, reduce):
+            for filter_type in (PNG_FILTERS if raw.color_type != COLOR_PALETTE or raw.bit_depth == 8
+                                else (0, "adaptive")):
+                for strategy in ZLIB_STRATEGIES:
+                    future = executor.submit(encode_candidate, raw, width, height, filter_type, strategy)
+                    futures[future] = index
+
+    pending = set(futures)
+    while pending:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            data = future.result()
+            index = futures[future]
+            if len(data) < len(best[index]):
+                best[index] = data
+    for future in pending:
+        future.cancel()
+    COUNTERS.incr("png_optimize.candidates", len(futures) - len(pending))
+    COUNTERS.incr("png_optimize.timed_out", len(pending))
+    return best
+
+
+def optimize_png(item, budget=PNG_OPTIMIZE_BUDGET, reduce=True):
+    """无损优化单个PNG，返回最小的编码"""
+    return optimize_pngs([item], budget, reduce)[0]
@@ -0,0 +1,190 @@
+"""
+按目标画质编码 JPG/WebP
+
+给定目标SSIM，对每张图像二分查找满足目标的最低编码质量，得到满足画质要求的最小文件:
+- SSIM用积分图计算窗口均值，全部为NumPy向量化运算；比较亮度通道，带透明度时同时比较alpha通道，取较低者
+- 图标尺寸较小 (16~256px)，多尺度SSIM的下采样层级不足，因此使用单尺度SSIM
+- 查找结果按 (图像内容哈希, 格式, 目标) 缓存，相同图像再次保存时只编码一次
+- 多张图像的查找在线程池中并行进行 (Pillow编码和NumPy运算会释放GIL)
+"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from instrumentation import COUNTERS
+
+# 默认目标SSIM
+DEFAULT_TARGET_SSIM = 0.97
+
+# 二分查找的编码质量范围
+QUALITY_MIN = 5
+QUALITY_MAX = 100
+
+# SSIM窗口边长 (图像更小时使用图像边长)
+SSIM_WINDOW = 7
+
+# SSIM常数 (8位图像)
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# 查找结果缓存的条目数
+QUALITY_CACHE_SIZE = 512
+
+# 支持的格式: 格式名 -> 编码时使用的颜色模式
+QUALITY_FORMATS = {"jpeg": "RGB", "webp": "RGBA"}
+
+
+def window_mean(x, size):
+    """用积分图计算所有 size×size 窗口 (不越界) 的均值"""
+    integral = np.zeros((x.shape[0] + 1, x.shape[1] + 1))
+    integral[1:, 1:] = x.cumsum(axis=0).cumsum(axis=1)
+    total = (integral[size:, size:] - integral[:-size, size:]
+             - integral[size:, :-size] + integral[:-size, :-size])
+    return total / (size * size)
+
+
+def ssim_channel(a, b, window=SSIM_WINDOW):
+    """单通道平均SSIM，a、b为形状相同的二维数组"""
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    size = max(1, min(window, a.shape[0], a.shape[1]))
+    mu_a = window_mean(a, size)
+    mu_b = window_mean(b, size)
+    var_a = window_mean(a * a, size) - mu_a * mu_a
+    var_b = window_mean(b * b, size) - mu_b * mu_b
+    cov = window_mean(a * b, size) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + SSIM_C1) * (2 * cov + SSIM_C2)
+                / ((mu_a ** 2 + mu_b ** 2 + SSIM_C1) * (var_a + var_b + SSIM_C2)))
+    return float(ssim_map.mean())
+
+
+def luminance(rgba):
+    """按alpha预乘后的亮度 (完全透明像素的颜色不影响结果)"""
+    rgb = rgba[..., :3].astype(np.float64) * (rgba[..., 3:4] / 255.0)
+    return rgb @ np.array([0.299, 0.587, 0.114])
+
+
+def ssim(reference, distorted):
+    """两张图像的SSIM: 亮度通道，带透明度时再与alpha通道取较低者"""
+    a = np.asarray(reference.convert("RGBA"))
+    b = np.asarray(distorted.convert("RGBA"))
+    score = ssim_channel(luminance(a), luminance(b))
+    if (a[..., 3] < 255).any() or (b[..., 3] < 255).any():
+        score = min(score, ssim_channel(a[..., 3], b[..., 3]))
+    return score
+
+
+def prepare(img, fmt):
+    """转换为编码器使用的颜色模式"""
+    if fmt not in QUALITY_FORMATS:
+        raise ValueError(f"不支持按目标画质编码的格式: {fmt}")
+    mode = QUALITY_FORMATS[fmt]
+    if mode == "RGBA" and img.mode in ("RGB", "RGBA"):
+        return img
+    return img.convert(mode)
+
+
+def encode(img, fmt, quality):
+    """按指定质量编码，返回字节 (quality为None时WebP使用无损编码)"""
+    buffer = io.BytesIO()
+    if quality is None:
+        img.save(buffer, format="WEBP", lossless=True)
+    else:
+        img.save(buffer, format=fmt.upper(), quality=quality)
+    return buffer.getvalue()
+
+
+def content_key(img, fmt, target):
+    digest = hashlib.sha1()
+    digest.update(f"{fmt}:{target}:{img.mode}:{img.size}".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+class QualityCache:
+    """查找结果的LRU缓存: 内容哈希 -> (质量, SSIM)"""
+
+    def __init__(self, capacity=QUALITY_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+QUALITY_CACHE = QualityCache()
+
+
+def search_quality(img, fmt, target):
+    """二分查找满足目标SSIM的最低质量，返回 (数据, 质量, SSIM, 编码次数)
+
+    质量最高时仍达不到目标的，WebP改用无损编码 (质量为None)，JPG使用最高质量。
+    """
+    lo, hi = QUALITY_MIN, QUALITY_MAX
+    best = None
+    encodes = 0
+    while lo <= hi:
+        quality = (lo + hi) // 2
+        data = encode(img, fmt, quality)
+        encodes += 1
+        score = ssim(img, Image.open(io.BytesIO(data)))
+        if score >= target:
+            best = (data, quality, score)
+            hi = quality - 1
+        else:
+            lo = quality + 1
+    if best is None:
+        quality = None if fmt == "webp" else QUALITY_MAX
+        data = encode(img, fmt, quality)
+        encodes += 1
+        best = (data, quality, ssim(img, Image.open(io.BytesIO(data))))
+    return best + (encodes,)
+
+
+def encode_for_quality(img, fmt, target=DEFAULT_TARGET_SSIM):
+    """以满足目标SSIM的最小体积编码图像，返回 (数据, 质量, SSIM)
+
+    fmt: "jpeg" 或 "webp"；相同内容的查找结果会被缓存，命中时只编码一次。
+    """
+    img = prepare(img, fmt)
+    key = content_key(img, fmt, target)
+    cached = QUALITY_CACHE.get(key)
+    if cached is not None:
+        COUNTERS.incr("quality_search.hits")
+        quality, score = cached
+        return encode(img, fmt, quality), quality, score
+    COUNTERS.incr("quality_search.misses")
+    data, quality, score, encodes = search_quality(img, fmt, target)
+    COUNTERS.incr("quality_search.encodes", encodes)
+    QUALITY_CACHE.put(key, (quality, score))
+    return data, quality, score
+
+
+def encode_all_for_quality(images, fmt, target=DEFAULT_TARGET_SSIM, workers=None):
+    """并行按目标画质编码多张图像 (例如一个图标集的各个尺寸)，结果顺序与输入一致"""
+    if len(images) <= 1:
+        return [encode_for_quality(img, fmt, target) for img in images]
+    with ThreadPoolExecutor(min(len(images), workers or os.cpu_count() or 1)) as executor:
+        return list(executor.map(lambda img: encode_for_quality(img, fmt, target), images))
@@ -0,0 +1,511 @@
+"""
+本地HTTP渲染服务
+
+用法:
+    python render_server.py [--host 127.0.0.1] [--port 8765] [--workers N]
+
+接口:
+    GET  /render/<类型>?text=A&size=64&format=png
+    POST /render/<类型>   请求体为JSON参数 (与查询参数合并，SVG/CSS代码较长时使用)
+    GET  /metrics         Prometheus文本格式的运行指标
+
+类型: text、unicode、emoji、svg、css
+格式: png、webp (单个尺寸，size参数)，ico (多个尺寸，sizes=16,32,48)
+其余参数为该类型的设置，见 icon_render 中的 DEFAULT_*_SETTINGS，
+例如 /render/text?text=AB&size=128&bg_color=%23336699&text_color=%23FFFFFF&shape=圆形
+
+渲染在进程池中进行。完全相同的并发请求只渲染一次 (合并到同一个任务)，
+最近的结果保存在内存LRU中；结果由请求参数唯一确定，ETag直接取参数的哈希，
+客户端带 If-None-Match 时不需要渲染即可返回304。
+渲染进程崩溃后换新的进程池；超时的任务还在排队时取消，已在执行时记入 overdue 指标，
+所有渲染进程都被超时的任务占用时结束这些进程并换新的进程池。
+超出输入限制的请求 (见 input_limits) 返回413，SVG在沙箱子进程中光栅化，超时返回504。
+"""
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from input_limits import InputLimitError
+from instrumentation import COUNTERS
+from mpl_sandbox import ChartTimeoutError
+
+# 默认监听地址和端口 (只监听本机)
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# 渲染进程数量
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+# 结果缓存的内存上限
+RESULT_CACHE_BYTES = 32 * 1024 * 1024
+
+# 单个图标的最大边长，以及ICO中最多的尺寸数量
+MAX_SIZE = 1024
+MAX_SIZES = 16
+
+# 请求体最大字节数
+MAX_BODY = 1024 * 1024
+
+# 单次渲染超时 (秒)
+RENDER_TIMEOUT = 30
+
+# 支持的类型和输出格式
+RENDER_TYPES = ("text", "unicode", "emoji", "svg", "css")
+CONTENT_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "ico": "image/x-icon",
+}
+
+# 默认ICO尺寸
+DEFAULT_ICO_SIZES = (16, 24, 32, 48, 64, 128, 256)
+
+
+class RequestError(ValueError):
+    """请求参数错误 (返回400)"""
+
+
+def parse_size(value, limit=MAX_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"无效的尺寸: {value}")
+    if not 1 <= size <= limit:
+        raise RequestError(f"尺寸必须在 1 到 {limit} 之间")
+    return size
+
+
+def parse_quality(value):
+    try:
+        quality = int(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"无效的质量: {value}")
+    if not 1 <= quality <= 100:
+        raise RequestError("质量必须在 1 到 100 之间")
+    return quality
+
+
+def convert_setting(name, value, default):
+    """把查询参数转换为默认值的类型"""
+    if isinstance(value, str) and not isinstance(default, str):
+        try:
+            return type(default)(value)
+        except ValueError:
+            raise RequestError(f"参数 {name} 的值无效: {value}")
+    return value
+
+
+def build_job(kind, params):
+    """把请求参数转换为 (渲染规格, 输出格式, 质量)"""
+    from icon_render import (DEFAULT_EMOJI_SETTINGS, DEFAULT_SVG_BACKGROUND, DEFAULT_TEXT_SETTINGS,
+                             DEFAULT_UNICODE_SETTINGS)
+    from icon_store import ICO_MAX_SIZE
+
+    if kind not in RENDER_TYPES:
+        raise RequestError(f"不支持的类型: {kind}")
+    params = dict(params)
+    fmt = str(params.pop("format", "png")).lower()
+    if fmt not in CONTENT_TYPES:
+        raise RequestError(f"不支持的格式: {fmt}")
+    quality = parse_quality(params.pop("quality", 90)) if fmt == "webp" else None
+
+    if fmt == "ico":
+        sizes = params.pop("sizes", DEFAULT_ICO_SIZES)
+        if isinstance(sizes, str):
+            sizes = sizes.split(",")
+        # ICO最大支持256x256，更大的尺寸写入时会被丢弃
+        sizes = sorted({parse_size(s, ICO_MAX_SIZE) for s in sizes})
+        if len(sizes) > MAX_SIZES:
+            raise RequestError(f"最多 {MAX_SIZES} 个尺寸")
+        params.pop("size", None)
+    else:
+        sizes = [parse_size(params.pop("size", 64))]
+        params.pop("sizes", None)
+
+    spec = {"type": kind, "sizes": sizes}
+    if kind == "svg":
+        if not params.get("svg"):
+            raise RequestError("缺少参数: svg")
+        spec["svg"] = params.pop("svg")
+        spec["bg_color"] = params.pop("bg_color", DEFAULT_SVG_BACKGROUND)
+        spec["alpha"] = convert_setting("alpha", params.pop("alpha", 1.0), 1.0)
+    elif kind == "css":
+        if not params.get("css"):
+            raise RequestError("缺少参数: css")
+        spec["css"] = params.pop("css")
+    else:
+        if not params.get("text"):
+            raise RequestError("缺少参数: text")
+        spec["text"] = params.pop("text")
+        defaults = {
+            "text": DEFAULT_TEXT_SETTINGS,
+            "unicode": DEFAULT_UNICODE_SETTINGS,
+            "emoji": DEFAULT_EMOJI_SETTINGS,
+        }[kind]
+        spec["settings"] = {
+            name: convert_setting(name, params.pop(name), default)
+            for name, default in defaults.items() if name in params
+        }
+
+    if params:
+        raise RequestError(f"未知参数: {', '.join(sorted(params))}")
+    return spec, fmt, quality
+
+
+def job_key(spec, fmt, quality):
+    """任务的唯一标识 (同时用作ETag)"""
+    data = json.dumps([spec, fmt, quality], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def init_worker():
+    """渲染进程启动时加载字体索引 (spawn启动的进程不继承主进程的状态，未加载时只能使用默认字体)"""
+    from font_index import FONT_INDEX
+
+    FONT_INDEX.load()
+
+
+def terminate_pool(pool):
+    """结束进程池及其所有渲染进程 (包括正在执行的任务)
+
+    ProcessPoolExecutor没有结束正在执行的任务的公开接口，这里直接结束其子进程，
+    进程池中未完成的任务随后以 BrokenProcessPool 结束。
+    """
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def render_job(spec, fmt, quality):
+    """在渲染进程中执行: 渲染并编码为指定格式，返回字节"""
+    from icon_render import render_icon_set
+    from icon_store import write_ico
+
+    icons = render_icon_set(spec)
+    if fmt == "ico":
+        buffer = io.BytesIO()
+        write_ico(icons, buffer)
+        return buffer.getvalue()
+    if fmt == "webp":
+        buffer = io.BytesIO()
+        icons[0].save(buffer, format="WEBP", quality=quality)
+        return buffer.getvalue()
+    return icons.png_bytes(0)
+
+
+class ResultCache:
+    """按字节预算缓存最近的渲染结果 (LRU)"""
+
+    def __init__(self, budget=RESULT_CACHE_BYTES):
+        self.budget = budget
+        self.used = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.budget:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.used -= len(old)
+            self._items[key] = data
+            self.used += len(data)
+            while self.used > self.budget:
+                _, evicted = self._items.popitem(last=False)
+                self.used -= len(evicted)
+                COUNTERS.incr("server.cache_evicted")
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RenderService:
+    """进程池渲染，合并相同的并发请求，缓存最近的结果"""
+
+    def __init__(self, workers=DEFAULT_WORKERS, cache_bytes=RESULT_CACHE_BYTES):
+        self.workers = workers
+        self.cache = ResultCache(cache_bytes)
+        self._pool = None
+        self._lock = threading.Lock()
+        # 进行中的渲染: 任务标识 -> Future
+        self._inflight = {}
+        # 已超时但仍在渲染进程中执行的任务
+        self._overdue = set()
+        self.render_seconds = 0.0
+
+    def start(self):
+        if self._pool is None:
+            # 与图表沙箱一致使用spawn，各平台行为相同
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=init_worker)
+
+    def _swap_pool(self, pool):
+        """(持有锁时调用) 用新的进程池替换pool，返回被替换的进程池；pool已被替换时返回None"""
+        if pool is not self._pool:
+            return None
+        self._pool = None
+        self.start()
+        COUNTERS.incr("server.pool_restarts")
+        return pool
+
+    def replace_pool(self, pool, terminate=False):
+        """进程池损坏 (渲染进程崩溃) 或被超时的任务占满时换一个新的进程池"""
+        with self._lock:
+            if self._swap_pool(pool) is None:
+                return
+        if terminate:
+            terminate_pool(pool)
+        else:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def render(self, key, spec, fmt, quality):
+        """返回渲染结果字节，相同任务进行中时等待同一个结果"""
+        data = self.cache.get(key)
+        if data is not None:
+            COUNTERS.incr("server.cache_hits")
+            return data
+
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                self.start()
+                pool = self._pool
+                try:
+                    future = pool.submit(render_job, spec, fmt, quality)
+                except BrokenProcessPool:
+                    # 之前的任务使渲染进程崩溃，进程池已不可用
+                    self._swap_pool(pool).shutdown(wait=False, cancel_futures=True)
+                    pool = self._pool
+                    future = pool.submit(render_job, spec, fmt, quality)
+                future.pool = pool
+                future.started = time.perf_counter()
+                self._inflight[key] = future
+                future.add_done_callback(lambda f: self._finish(key, f))
+                COUNTERS.incr("server.renders")
+            else:
+                COUNTERS.incr("server.coalesced")
+        try:
+            return future.result(RENDER_TIMEOUT)
+        except FutureTimeoutError:
+            self._timed_out(future)
+            raise
+        except BrokenProcessPool:
+            self.replace_pool(future.pool)
+            raise
+
+    def _timed_out(self, future):
+        """等待超时: 还在排队的任务直接取消；已在执行的任务记为超时未结束，
+        所有渲染进程都被这样的任务占用时结束这些进程，换新的进程池
+        """
+        if future.cancel():
+            return
+        with self._lock:
+            if future.done() or future.pool is not self._pool:
+                return
+            self._overdue.add(future)
+            stuck = sum(1 for f in self._overdue if f.pool is future.pool)
+        if stuck >= self.workers:
+            self.replace_pool(future.pool, terminate=True)
+
+    def _finish(self, key, future):
+        # 先放入缓存再移出进行中列表，之间到达的相同请求不会重复渲染
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+        else:
+            COUNTERS.incr("server.render_errors")
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._overdue.discard(future)
+            self.render_seconds += time.perf_counter() - future.started
+
+    @property
+    def inflight(self):
+        with self._lock:
+            return len(self._inflight)
+
+    @property
+    def overdue(self):
+        with self._lock:
+            return len(self._overdue)
+
+    def metrics(self):
+        """Prometheus文本格式的指标"""
+        counters = COUNTERS.snapshot()
+        lines = []
+
+        def metric(name, kind, value, help_text):
+            lines.append(f"# HELP icon_server_{name} {help_text}")
+            lines.append(f"# TYPE icon_server_{name} {kind}")
+            lines.append(f"icon_server_{name} {value}")
+
+        metric("requests_total", "counter", counters.get("server.requests", 0), "Render requests")
+        metric("not_modified_total", "counter", counters.get("server.not_modified", 0),
+               "Requests answered with 304")
+        metric("cache_hits_total", "counter", counters.get("server.cache_hits", 0), "Results served from cache")
+        metric("coalesced_total", "counter", counters.get("server.coalesced", 0),
+               "Requests that joined an in-flight render")
+        metric("renders_total", "counter", counters.get("server.renders", 0), "Renders submitted to the pool")
+        metric("render_errors_total", "counter", counters.get("server.render_errors", 0), "Failed renders")
+        metric("bad_requests_total", "counter", counters.get("server.bad_requests", 0), "Rejected requests")
+        metric("rejected_inputs_total", "counter", counters.get("server.rejected", 0),
+               "Inputs over the size limits")
+        metric("timeouts_total", "counter", counters.get("server.timeouts", 0), "Renders that timed out")
+        metric("pool_restarts_total", "counter", counters.get("server.pool_restarts", 0),
+               "Render pools replaced after a crash or stuck renders")
+        metric("render_seconds_total", "counter", f"{self.render_seconds:.6f}", "Time spent rendering")
+        metric("inflight", "gauge", self.inflight, "Renders in progress")
+        metric("overdue", "gauge", self.overdue, "Timed-out renders still running in a worker")
+        metric("cache_entries", "gauge", len(self.cache), "Cached results")
+        metric("cache_bytes", "gauge", self.cache.used, "Bytes held by the result cache")
+        metric("workers", "gauge", self.workers, "Render processes")
+        return "\n".join(lines) + "\n"
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """HTTP请求处理 (server.service 为 RenderService)"""
+
+    server_version = "AdvancedIconGenerator"
+
+    def do_GET(self):
+        self.handle_request({})
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY:
+            self.send_error_text(413, "请求体过大")
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError
+        except ValueError:
+            self.send_error_text(400, "请求体必须是JSON对象")
+            return
+        self.handle_request(body)
+
+    def handle_request(self, body):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self.send_body(200, self.server.service.metrics().encode("utf-8"),
+                           "text/plain; version=0.0.4; charset=utf-8")
+            return
+
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "render":
+            self.send_error_text(404, "未知路径")
+            return
+
+        COUNTERS.incr("server.requests")
+        try:
+            params = dict(parse_qsl(url.query))
+            params.update(body)
+            spec, fmt, quality = build_job(parts[1], params)
+        except RequestError as e:
+            COUNTERS.incr("server.bad_requests")
+            self.send_error_text(400, str(e))
+            return
+
+        key = job_key(spec, fmt, quality)
+        etag = f'"{key}"'
+        if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            COUNTERS.incr("server.not_modified")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        try:
+            data = self.server.service.render(key, spec, fmt, quality)
+        except InputLimitError as e:
+            COUNTERS.incr("server.rejected")
+            self.send_error_text(413, f"输入超出限制: {e}")
+            return
+        except (ChartTimeoutError, FutureTimeoutError, CancelledError) as e:
+            COUNTERS.incr("server.timeouts")
+            self.send_error_text(504, f"渲染超时: {str(e) or f'超过 {RENDER_TIMEOUT} 秒'}")
+            return
+        except Exception as e:
+            self.send_error_text(500, f"渲染失败: {e}")
+            return
+        self.send_body(200, data, CONTENT_TYPES[fmt], etag)
+
+    def send_body(self, status, data, content_type, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "public, max-age=86400")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def send_error_text(self, status, message):
+        self.send_body(status, (message + "\n").encode("utf-8"), "text/plain; charset=utf-8")
+
+    def log_message(self, format, *args):
+        # 压测时不逐条打印请求日志
+        pass
+
+
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS):
+    """创建HTTP服务 (调用 serve_forever() 开始处理请求)"""
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.daemon_threads = True
+    server.service = RenderService(workers)
+    server.service.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="高级图标生成工具本地HTTP渲染服务")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="渲染进程数量")
+    args = parser.parse_args(argv)
+
+    server = create_server(args.host, args.port, args.workers)
+    print(f"渲染服务已启动: http://{args.host}:{server.server_address[1]}/ "
+          f"({args.workers} 个渲染进程)，按 Ctrl+C 停止")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+SVG预优化
+
+设计工具导出的SVG常带有编辑器的元数据和命名空间、未使用的<defs>、多余的分组和十位小数的坐标，
+这些都会拖慢cairosvg和svglib的解析与光栅化。光栅化之前对文档做一次精简 (渲染结果不变):
+- 删除注释、<metadata>/<title>/<desc>，以及编辑器命名空间 (Inkscape、Illustrator、Sketch等) 的元素和属性
+- 删除不可见的元素 (display:none、不透明度为0)
+- 删除未被引用的定义 (<defs>中的内容、渐变、图案、剪切路径、蒙版、滤镜等)，反复进行直到没有可删除的
+- 展开多余的分组: 没有属性 (或只有未被引用的id) 的<g>用子元素替换，只有一个子元素的<g>把可继承的属性和变换合并到子元素
+- 按画布大小把坐标和路径数据舍入到足够的精度 (渐变、图案等可能使用相对单位的定义和带缩放变换的内容不舍入)
+
+用法:
+    python svg_optimize.py 图标.svg [更多文件...] [-o 输出.svg]
+"""
+import argparse
+import functools
+import math
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from input_limits import check_svg
+from instrumentation import COUNTERS, format_bytes
+
+SVG_NS = "http://www.w3.org/2000/svg"
+XLINK_NS = "http://www.w3.org/1999/xlink"
+
+# 编辑器和元数据的命名空间 (按前缀匹配)，其中的元素和属性不影响渲染
+EDITOR_NAMESPACES = (
+    "http://www.inkscape.org/namespaces/inkscape",
+    "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd",
+    "http://ns.adobe.com/",
+    "http://www.bohemiancoding.com/sketch/ns",
+    "http://www.figma.com/figma/ns",
+    "http://www.serif.com/",
+    "http://purl.org/dc/elements/1.1/",
+    "http://creativecommons.org/ns#",
+    "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+)
+
+# 不参与渲染的元素
+NON_RENDERING_TAGS = ("metadata", "title", "desc")
+
+# 只在被引用时才起作用的元素 (其中的坐标可能是相对单位，不舍入)
+REFERENCED_TAGS = ("linearGradient", "radialGradient", "pattern", "clipPath", "mask", "filter", "marker",
+                   "symbol")
+
+# 文字内容元素 (其中的空白有意义)
+TEXT_TAGS = ("text", "tspan", "textPath", "style", "script")
+
+# 可继承的表现属性，只有一个子元素的分组可以把这些属性移到子元素上
+INHERITED_ATTRIBUTES = (
+    "fill", "fill-opacity", "fill-rule", "stroke", "stroke-width", "stroke-opacity", "stroke-linecap",
+    "stroke-linejoin", "stroke-miterlimit", "stroke-dasharray", "stroke-dashoffset", "color", "clip-rule",
+    "font-family", "font-size", "font-style", "font-weight", "text-anchor", "letter-spacing",
+    "word-spacing", "paint-order", "shape-rendering", "text-rendering", "image-rendering",
+    "color-interpolation", "visibility",
+)
+
+# 按画布大小舍入的数值属性
+COORDINATE_ATTRIBUTES = ("x", "y", "width", "height", "cx", "cy", "r", "rx", "ry", "x1", "y1", "x2", "y2",
+                         "stroke-width")
+
+# 舍入后保留的有效数字 (相对于画布边长)
+PRECISION_DIGITS = 5
+
+# 缓存的优化结果数量 (按文档文本)
+OPTIMIZE_CACHE_SIZE = 16
+
+NUMBER_PATTERN = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+# 属性或样式中对其他元素的引用: url(#id)
+URL_REFERENCE = re.compile(r"url\(\s*['\"]?#([^'\")\s]+)")
+
+# 样式表中的 #id 选择器 (颜色值也会被匹配，只会多保留定义)
+STYLE_REFERENCE = re.compile(r"#([A-Za-z_][\w.:-]*)")
+
+# 只有一个子元素的分组合并到子元素时，子元素不能是这些元素 (变换的含义不同或不支持变换)
+NO_TRANSFORM_TAGS = ("svg", "symbol", "tspan", "textPath")
+
+ET.register_namespace("", SVG_NS)
+ET.register_namespace("xlink", XLINK_NS)
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def is_editor_name(name):
+    """元素或属性名是否属于编辑器命名空间"""
+    return name.startswith("{") and name[1:].startswith(EDITOR_NAMESPACES)
+
+
+def parse_style(value):
+    """解析 style 属性为 {属性名: 值}"""
+    declarations = {}
+    for item in (value or "").split(";"):
+        name, sep, val = item.partition(":")
+        if sep:
+            declarations[name.strip()] = val.strip()
+    return declarations
+
+
+def property_value(elem, name):
+    """元素自身的样式属性值 (style优先于表现属性)"""
+    return parse_style(elem.get("style")).get(name, elem.get(name))
+
+
+def is_hidden(elem, in_clip):
+    """元素是否不可见 (剪切路径中只看 display，不透明度不影响剪切区域)"""
+    if property_value(elem, "display") == "none":
+        return True
+    if in_clip:
+        return False
+    try:
+        return float(property_value(elem, "opacity")) == 0
+    except (TypeError, ValueError):
+        return False
+
+
+def remove_child(parent, child):
+    """删除子元素，保留其后的文字"""
+    if child.tail and child.tail.strip():
+        index = list(parent).index(child)
+        if index:
+            previous = parent[index - 1]
+            previous.tail = (previous.tail or "") + child.tail
+        else:
+            parent.text = (parent.text or "") + child.tail
+    parent.remove(child)
+
+
+def strip_unrendered(elem, ids, in_clip=False):
+    """删除编辑器元素和属性、不参与渲染和不可见 (且未被引用) 的元素，以及元素之间多余的空白"""
+    for name in [name for name in elem.attrib if is_editor_name(name)]:
+        del elem.attrib[name]
+    in_clip = in_clip or local_name(elem.tag) == "clipPath"
+    keep_text = local_name(elem.tag) in TEXT_TAGS
+    if not keep_text and elem.text and not elem.text.strip():
+        elem.text = None
+    for child in list(elem):
+        tag = local_name(child.tag)
+        if (is_editor_name(child.tag) or tag in NON_RENDERING_TAGS
+                or (tag not in REFERENCED_TAGS and tag != "defs" and child.get("id") not in ids
+                    and is_hidden(child, in_clip))):
+            remove_child(elem, child)
+            continue
+        if not keep_text and child.tail and not child.tail.strip():
+            child.tail = None
+        strip_unrendered(child, ids, in_clip)
+
+
+def referenced_ids(root):
+    """文档中被引用的所有id (href、url(#id) 和样式表中的 #id)"""
+    ids = set()
+    for elem in root.iter():
+        for name, value in elem.attrib.items():
+            if local_name(name) == "href" and value.startswith("#"):
+                ids.add(value[1:])
+            elif "url(" in value:
+                ids.update(URL_REFERENCE.findall(value))
+        if local_name(elem.tag) == "style" and elem.text:
+            ids.update(STYLE_REFERENCE.findall(elem.text))
+    return ids
+
+
+def remove_unused_definitions(root):
+    """删除未被引用的定义，直到没有可删除的 (被删除的定义可能是其他定义唯一的引用者)"""
+    while True:
+        ids = referenced_ids(root)
+        removed = False
+        for parent in list(root.iter()):
+            in_defs = local_name(parent.tag) == "defs"
+            for child in list(parent):
+                tag = local_name(child.tag)
+                if tag == "defs" and not len(child):
+                    # 空的<defs> (其内容在上一轮被删除)
+                    remove_child(parent, child)
+                    removed = True
+                elif tag != "style" and (in_defs or tag in REFERENCED_TAGS) and child.get("id") not in ids:
+                    remove_child(parent, child)
+                    removed = True
+        if not removed:
+            return
+
+
+def collapse_groups(elem, ids):
+    """展开多余的分组 (自底向上)"""
+    for child in list(elem):
+        collapse_groups(child, ids)
+    if local_name(elem.tag) == "switch":
+        # <switch> 按直接子元素选择，不能改变其结构
+        return
+    index = 0
+    while index < len(elem):
+        child = elem[index]
+        if local_name(child.tag) != "g" or child.text:
+            index += 1
+            continue
+        if child.get("id") not in ids:
+            # 未被引用的id (编辑器的图层名等) 不影响渲染
+            child.attrib.pop("id", None)
+        if not child.attrib:
+            # 没有属性的分组: 用其子元素替换
+            grandchildren = list(child)
+            if grandchildren:
+                grandchildren[-1].tail = child.tail
+            elem.remove(child)
+            for offset, grandchild in enumerate(grandchildren):
+                elem.insert(index + offset, grandchild)
+            continue
+        if len(child) == 1 and merge_group(child, child[0], ids):
+            grandchild = child[0]
+            grandchild.tail = child.tail
+            elem[index] = grandchild
+        index += 1
+
+
+def merge_group(group, child, ids):
+    """把只有一个子元素的分组的属性合并到子元素，不能合并时返回False"""
+    names = set(group.attrib)
+    if not names <= set(INHERITED_ATTRIBUTES) | {"transform"}:
+        return False
+    if child.get("id") in ids or child.tail and child.tail.strip():
+        # 被引用的元素在其他位置使用时不应带上分组的属性
+        return False
+    if "transform" in names and (local_name(child.tag) in NO_TRANSFORM_TAGS
+                                 or any("url(" in value for value in child.attrib.values())):
+        # svglib对带变换的渐变填充图形处理不一致，这种情况保留分组
+        return False
+    for name, value in group.attrib.items():
+        if name == "transform":
+            own = child.get("transform")
+            child.set("transform", f"{value} {own}" if own else value)
+        elif name not in child.attrib:
+            # 子元素自身的值优先，与继承的效果相同
+            child.set(name, value)
+    return True
+
+
+def format_number(value, decimals):
+    """按小数位数格式化数值，去掉多余的0"""
+    text = f"{value:.{decimals}f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text in ("-0", "") else text
+
+
+def round_path(d, decimals):
+    """舍入路径数据中的数值 (弧线的两个标志位原样保留)；无法解析时返回原文"""
+    parts = []
+    position = 0
+    command = None
+    index = 0
+    previous_number = False
+    while position < len(d):
+        ch = d[position]
+        if ch in " \t\r\n,":
+            position += 1
+            continue
+        if ch.isalpha() and ch not in "eE":
+            command = ch
+            index = 0
+            parts.append(ch)
+            position += 1
+            previous_number = False
+            continue
+        if command is None:
+            return d
+        if command in "aA" and index % 7 in (3, 4):
+            if ch not in "01":
+                return d
+            text = ch
+            position += 1
+        else:
+            match = NUMBER_PATTERN.match(d, position)
+            if not match:
+                return d
+            text = format_number(float(match.group()), decimals)
+            position = match.end()
+        if previous_number and not text.startswith("-"):
+            parts.append(" ")
+        parts.append(text)
+        previous_number = True
+        index += 1
+    return "".join(parts)
+
+
+def round_numbers(elem, decimals):
+    """舍入坐标属性、点列表和路径数据 (带缩放的变换下、嵌套的<svg>和被引用的定义中不舍入)"""
+    tag = local_name(elem.tag)
+    transform = elem.get("transform", "")
+    if tag in REFERENCED_TAGS or tag == "svg" or "scale" in transform or "matrix" in transform:
+        return
+    for name in COORDINATE_ATTRIBUTES:
+        value = elem.get(name)
+        if value is not None:
+            try:
+                elem.set(name, format_number(float(value), decimals))
+            except ValueError:
+                pass
+    if tag == "path" and elem.get("d"):
+        elem.set("d", round_path(elem.get("d"), decimals))
+    elif tag in ("polygon", "polyline") and elem.get("points"):
+        elem.set("points", " ".join(format_number(float(n), decimals)
+                                    for n in NUMBER_PATTERN.findall(elem.get("points"))))
+    for child in elem:
+        round_numbers(child, decimals)
+
+
+def canvas_decimals(root):
+    """按画布边长决定保留的小数位数 (保留 PRECISION_DIGITS 位有效数字)"""
+    extent = None
+    view_box = (root.get("viewBox") or "").replace(",", " ").split()
+    try:
+        if len(view_box) == 4:
+            extent = max(float(view_box[2]), float(view_box[3]))
+        else:
+            extent = max(float(NUMBER_PATTERN.match(root.get(name)).group()) for name in ("width", "height"))
+    except (AttributeError, TypeError, ValueError):
+        pass
+    if not extent or extent <= 0:
+        extent = 100
+    return max(0, PRECISION_DIGITS - 1 - math.floor(math.log10(extent)))
+
+
+@functools.lru_cache(maxsize=OPTIMIZE_CACHE_SIZE)
+def optimize_svg(svg_code):
+    """精简SVG文档，返回 (优化后的文本, 统计)；先检查输入限制
+
+    统计: {"elements_before", "elements_after", "bytes_before", "bytes_after", "ms"}
+    无法解析的文档原样返回 (交给渲染器处理)。
+    """
+    start = time.perf_counter()
+    elements = check_svg(svg_code)["elements"]
+    stats = {"elements_before": elements, "elements_after": elements,
+             "bytes_before": len(svg_code.encode("utf-8")), "ms": 0.0}
+    try:
+        root = ET.fromstring(svg_code)
+    except ET.ParseError:
+        root = None
+    if root is None or local_name(root.tag) != "svg":
+        stats["bytes_after"] = stats["bytes_before"]
+        return svg_code, stats
+
+    strip_unrendered(root, referenced_ids(root))
+    remove_unused_definitions(root)
+    collapse_groups(root, referenced_ids(root))
+    # 根元素的尺寸保持原样
+    decimals = canvas_decimals(root)
+    for child in root:
+        round_numbers(child, decimals)
+    optimized = ET.tostring(root, encoding="unicode")
+
+    stats["elements_after"] = sum(1 for _ in root.iter())
+    stats["bytes_after"] = len(optimized.encode("utf-8"))
+    stats["ms"] = (time.perf_counter() - start) * 1000
+    COUNTERS.incr("svg_optimize.documents")
+    COUNTERS.incr("svg_optimize.elements_removed", stats["elements_before"] - stats["elements_after"])
+    return optimized, stats
+
+
+def describe_stats(stats):
+    """优化统计的简短说明，例如 "SVG元素 120 → 45，大小 12.3 KB → 4.1 KB" """
+    return (f"SVG元素 {stats['elements_before']} → {stats['elements_after']}，"
+            f"大小 {format_bytes(stats['bytes_before'])} → {format_bytes(stats['bytes_after'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="精简SVG文档 (删除元数据和未使用的定义、展开分组、舍入坐标)")
+    parser.add_argument("files", nargs="+", help="SVG文件")
+    parser.add_argument("-o", "--output", help="输出文件 (只能用于单个输入文件)")
+    args = parser.parse_args(argv)
+    if args.output and len(args.files) > 1:
+        parser.error("-o 只能用于单个输入文件")
+
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as f:
+            code = f.read()
+        optimized, stats = optimize_svg(code)
+        print(f"{path}: {describe_stats(stats)} ({stats['ms']:.1f} ms)")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(optimized)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
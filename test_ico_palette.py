@@ -0,0 +1,51 @@
+"""
+ICO调色板条目的测试
+
+低位深 (调色板) 条目写入ICO再读回后，透明度应与源图一致:
+第0项只给透明像素用，不透明的黑色像素不能被量化成透明。
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from icon_import import decode_entry, read_icon_data
+from icon_store import DITHER_MODES, IconSet, write_ico
+
+# 测试图标的尺寸
+SIZE = 32
+
+
+def black_next_to_transparent():
+    """左侧透明、紧挨着一列不透明的黑色，右侧为渐变和接近黑色的小方块"""
+    y, x = np.mgrid[0:SIZE, 0:SIZE]
+    rgba = np.empty((SIZE, SIZE, 4), dtype=np.uint8)
+    rgba[..., 0] = x * 255 // (SIZE - 1)
+    rgba[..., 1] = y * 255 // (SIZE - 1)
+    rgba[..., 2] = (x + y) * 4 % 256
+    rgba[..., 3] = 255
+    img = Image.fromarray(rgba, "RGBA")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, SIZE // 4 - 1, SIZE - 1), fill=(0, 0, 0, 0))
+    draw.rectangle((SIZE // 4, 0, SIZE // 2 - 1, SIZE - 1), fill=(0, 0, 0, 255))
+    draw.rectangle((SIZE // 2, SIZE // 2, SIZE // 2 + 3, SIZE // 2 + 3), fill=(8, 8, 8, 255))
+    return img
+
+
+@pytest.mark.parametrize("dither", DITHER_MODES)
+@pytest.mark.parametrize("palette_format", ["png", "bmp"])
+def test_palette_entry_keeps_black_opaque(palette_format, dither):
+    img = black_next_to_transparent()
+    buffer = io.BytesIO()
+    write_ico(IconSet([img]), buffer, depths={SIZE: 4}, dither=dither, palette_format=palette_format)
+    data = buffer.getvalue()
+
+    fmt, entries = read_icon_data(data)
+    decoded = decode_entry(data, fmt, entries[0]).convert("RGBA")
+
+    assert decoded.size == (SIZE, SIZE)
+    opaque = np.asarray(img)[..., 3] >= 128
+    alpha = np.asarray(decoded)[..., 3]
+    assert (alpha[opaque] == 255).all()
+    assert (alpha[~opaque] == 0).all()
@@ -0,0 +1,40 @@
+"""
+图表沙箱的测试
+
+任务在进度回调中被取消后，管道中还留有该任务的消息；
+同一沙箱的下一个任务应得到自己的结果，而不是上一个任务残留的消息。
+"""
+import pytest
+
+from icon_async import RenderCancelled
+from mpl_sandbox import ChartSandbox, ChartSandboxError
+
+SAMPLE_CHART = """x = [1, 2, 3, 4, 5]
+y = [2, 4, 1, 5, 3]"""
+
+
+@pytest.fixture
+def sandbox():
+    sandbox = ChartSandbox(workers=1)
+    yield sandbox
+    sandbox.shutdown()
+
+
+def test_next_job_after_cancel_gets_its_own_result(sandbox):
+    def cancel(done):
+        raise RenderCancelled()
+
+    with pytest.raises(RenderCancelled):
+        sandbox.render(SAMPLE_CHART, "折线图", [20, 40, 60, 80], progress=cancel)
+
+    images = sandbox.render(SAMPLE_CHART, "折线图", [16, 32, 48])
+    assert [img.size for img in images] == [(16, 16), (32, 32), (48, 48)]
+    assert all(img.mode == "RGBA" for img in images)
+
+
+def test_sandbox_error_keeps_worker(sandbox):
+    with pytest.raises(ChartSandboxError):
+        sandbox.render("raise ValueError('坏数据')", "折线图", [16])
+
+    images = sandbox.render(SAMPLE_CHART, "折线图", [16])
+    assert [img.size for img in images] == [(16, 16)]
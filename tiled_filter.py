@@ -0,0 +1,153 @@
+"""
+分块多进程滤镜
+
+超大图像 (例如上亿像素的扫描件) 上的邻域效果 (油画、高斯模糊、查找边缘等) 单核处理很慢。
+这里把图像切成若干块，每块向外扩展一圈与滤镜半径相同的重叠区 (halo)，在进程池中并行处理，
+只写回各块的内部区域，拼接后与整幅处理的结果一致。
+像素通过 multiprocessing.shared_memory 在进程间传递，不经过pickle序列化。
+
+任何在效果注册表中声明了 halo (邻域半径) 的效果都可以分块处理。
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from instrumentation import COUNTERS
+from mpl_sandbox import attach_shared_memory
+
+# 分块的边长 (不含重叠区)
+TILE_SIZE = 512
+
+# 效果的估计成本 (效果成本 × 百万像素) 不低于该值时才分块处理:
+# 复制到共享内存和进程调度有固定开销，Pillow的卷积滤镜很快，要到数千万像素才值得分块
+TILED_MIN_COST = 100
+
+# 分块处理时父进程每像素使用的内存 (字节): 源和结果两块共享内存，加上拼接出的结果图像
+TILED_MEMORY = 12
+
+# 默认进程数
+DEFAULT_TILE_WORKERS = os.cpu_count() or 1
+
+# 可以按通道原样存放的图像模式
+TILE_MODES = {"L": 1, "RGB": 3, "RGBA": 4}
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def tile_pool(workers=DEFAULT_TILE_WORKERS):
+    """分块处理使用的进程池 (spawn方式启动，进程数变化时重建)"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+            COUNTERS.incr("tiled.pool_started")
+        return _pool
+
+
+def shutdown_pool():
+    """关闭进程池"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+        _pool_workers = 0
+
+
+def tile_rects(width, height, tile=TILE_SIZE):
+    """把图像划分为不重叠的块，返回 [(left, top, right, bottom)]"""
+    return [
+        (left, top, min(left + tile, width), min(top + tile, height))
+        for top in range(0, height, tile)
+        for left in range(0, width, tile)
+    ]
+
+
+def filter_tile(job):
+    """在子进程中处理一块: 读取带重叠区的源像素，应用效果，把内部区域写入结果"""
+    from effects import EFFECTS
+
+    src = attach_shared_memory(job["src"])
+    dst = attach_shared_memory(job["dst"])
+    try:
+        width, height, channels = job["shape"]
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        source = np.ndarray(shape, dtype=np.uint8, buffer=src.buf)
+        result = np.ndarray(shape, dtype=np.uint8, buffer=dst.buf)
+
+        left, top, right, bottom = job["rect"]
+        halo = job["halo"]
+        x0, y0 = max(0, left - halo), max(0, top - halo)
+        x1, y1 = min(width, right + halo), min(height, bottom + halo)
+
+        tile = Image.fromarray(np.array(source[y0:y1, x0:x1]), job["mode"])
+        tile = EFFECTS[job["effect"]].apply(tile, job["scale"])
+        if tile.mode != job["mode"]:
+            tile = tile.convert(job["mode"])
+        pixels = np.asarray(tile)
+        result[top:bottom, left:right] = pixels[top - y0:bottom - y0, left - x0:right - x0]
+        del source, result
+    finally:
+        src.close()
+        dst.close()
+    return job["rect"]
+
+
+def should_tile(img, effect, workers=DEFAULT_TILE_WORKERS):
+    """是否值得对该图像和效果分块处理"""
+    return (effect.halo is not None and workers > 1
+            and effect.cost * img.width * img.height / 1e6 >= TILED_MIN_COST)
+
+
+def apply_tiled(img, effect, scale=1.0, workers=DEFAULT_TILE_WORKERS, tile=TILE_SIZE):
+    """分块并行应用一个邻域效果，结果与 effect.apply(img, scale) 一致
+
+    effect: 注册表中的效果 (必须声明 halo)
+    """
+    if effect.halo is None:
+        raise ValueError(f"效果不支持分块处理: {effect.name}")
+    if img.mode not in TILE_MODES:
+        img = img.convert("RGBA")
+    channels = TILE_MODES[img.mode]
+    width, height = img.size
+    halo = effect.tile_halo(scale)
+    size = width * height * channels
+
+    src = shared_memory.SharedMemory(create=True, size=size)
+    dst = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        np.ndarray((size,), dtype=np.uint8, buffer=src.buf)[:] = np.asarray(img).reshape(-1)
+        pool = tile_pool(workers)
+        jobs = [
+            {
+                "src": src.name,
+                "dst": dst.name,
+                "shape": (width, height, channels),
+                "mode": img.mode,
+                "rect": rect,
+                "halo": halo,
+                "effect": effect.name,
+                "scale": scale,
+            }
+            for rect in tile_rects(width, height, tile)
+        ]
+        for _ in pool.map(filter_tile, jobs):
+            pass
+        COUNTERS.incr("tiled.images")
+        COUNTERS.incr("tiled.tiles", len(jobs))
+        return Image.frombytes(img.mode, img.size, dst.buf[:size])
+    finally:
+        src.close()
+        src.unlink()
+        dst.close()
+        dst.unlink()
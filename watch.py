@@ -0,0 +1,254 @@
+"""
+监视模式
+
+源文件 (图片、SVG) 变化时自动重新生成图标。
+
+用法:
+    python watch.py 源文件... [-o 输出目录] [--sizes 16,32,48,256] [--interval 秒] [--debounce 秒]
+
+通过轮询文件的修改时间和大小发现变化 (不依赖inotify等平台接口)，
+连续写入在文件稳定 debounce 秒后才处理，并比较内容哈希:
+只touch而内容未变的文件不会重新生成，只重新生成输入确实变化的输出。
+每一轮都会报告延迟 (发现变化到处理完成)。
+"""
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from instrumentation import COUNTERS
+
+# 轮询间隔 (秒)
+WATCH_INTERVAL = 0.25
+
+# 文件停止变化多久后才处理 (秒)，合并编辑器保存时的连续写入
+WATCH_DEBOUNCE = 0.3
+
+# 保留的最近处理轮次数量
+WATCH_HISTORY = 50
+
+# 命令行默认生成的尺寸
+DEFAULT_SIZES = (16, 24, 32, 48, 64, 128, 256)
+
+
+def file_digest(path):
+    """文件内容的SHA-1哈希"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(path):
+    """文件的 (修改时间, 大小)，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class WatchedFile:
+    """单个被监视文件的状态"""
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = file_signature(path)
+        self.digest = file_digest(path) if self.signature else None
+        # 第一次发现变化的时间，None表示没有待处理的变化
+        self.changed_at = None
+        # 最近一次变化的时间，用于判断文件是否已经稳定
+        self.last_change = None
+
+
+class Watcher:
+    """轮询监视一组文件，内容变化时在后台线程中调用 callback(变化的路径列表, 最早发现变化的时间)
+
+    时间为 time.monotonic() 的值，回调可以据此计算自己的端到端延迟。
+
+    每轮处理的延迟记录在 history 中: {"paths", "debounce_ms", "handle_ms", "total_ms"}，
+    debounce_ms 为发现变化到文件稳定并确认内容变化的时间，handle_ms 为回调耗时。
+    """
+
+    def __init__(self, paths, callback, interval=WATCH_INTERVAL, debounce=WATCH_DEBOUNCE):
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self.history = deque(maxlen=WATCH_HISTORY)
+        self._files = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        """更换被监视的文件 (已监视的文件保留原有状态)"""
+        with self._lock:
+            self._files = {
+                path: self._files.get(path) or WatchedFile(path)
+                for path in dict.fromkeys(os.path.abspath(p) for p in paths)
+            }
+
+    @property
+    def paths(self):
+        with self._lock:
+            return list(self._files)
+
+    def poll(self):
+        """检查一轮，返回已确认内容变化的 [(路径, 发现变化的时间)]"""
+        now = time.monotonic()
+        changed = []
+        with self._lock:
+            files = list(self._files.values())
+        for watched in files:
+            signature = file_signature(watched.path)
+            if signature != watched.signature:
+                watched.signature = signature
+                watched.last_change = now
+                if watched.changed_at is None:
+                    watched.changed_at = now
+                continue
+            if watched.changed_at is None or now - watched.last_change < self.debounce:
+                continue
+
+            # 文件已稳定，比较内容哈希
+            changed_at = watched.changed_at
+            watched.changed_at = None
+            if signature is None:
+                continue
+            try:
+                digest = file_digest(watched.path)
+            except OSError:
+                continue
+            if digest == watched.digest:
+                COUNTERS.incr("watch.unchanged")
+                continue
+            watched.digest = digest
+            changed.append((watched.path, changed_at))
+        return changed
+
+    def run_cycle(self):
+        """检查一轮，有变化时调用回调并记录延迟，返回本轮记录 (没有变化时返回None)"""
+        changed = self.poll()
+        if not changed:
+            return None
+
+        first = min(changed_at for _, changed_at in changed)
+        detected = time.monotonic()
+        self.callback([path for path, _ in changed], first)
+        finished = time.monotonic()
+
+        cycle = {
+            "paths": [path for path, _ in changed],
+            "debounce_ms": (detected - first) * 1000,
+            "handle_ms": (finished - detected) * 1000,
+            "total_ms": (finished - first) * 1000,
+        }
+        self.history.append(cycle)
+        COUNTERS.incr("watch.cycles")
+        COUNTERS.incr("watch.changed", len(changed))
+        return cycle
+
+    def start(self):
+        """在后台线程中开始监视"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_cycle()
+            except Exception as e:
+                # 单次处理失败不影响后续监视
+                COUNTERS.incr("watch.errors")
+                print(f"监视处理出错: {e}", file=sys.stderr)
+
+
+def output_path(source, out_dir):
+    """源文件对应的输出ICO路径"""
+    name = os.path.splitext(os.path.basename(source))[0] + ".ico"
+    return os.path.join(out_dir or os.path.dirname(source), name)
+
+
+def regenerate(source, out_dir, sizes):
+    """重新生成一个源文件的ICO图标，返回输出路径"""
+    from icon_render import render_icon_set
+    from icon_store import write_ico
+
+    icons = render_icon_set({"source": source, "sizes": sizes})
+    path = output_path(source, out_dir)
+    write_ico(icons, path)
+    return path
+
+
+def parse_sizes(text):
+    sizes = sorted({int(s) for s in text.split(",") if s.strip()})
+    if not sizes or sizes[0] <= 0:
+        raise argparse.ArgumentTypeError(f"无效的尺寸: {text}")
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="监视源文件，变化时重新生成ICO图标")
+    parser.add_argument("sources", nargs="+", help="要监视的图片或SVG文件")
+    parser.add_argument("-o", "--out-dir", help="输出目录 (默认与源文件相同)")
+    parser.add_argument("--sizes", type=parse_sizes, default=list(DEFAULT_SIZES),
+                        help="逗号分隔的尺寸列表")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL, help="轮询间隔 (秒)")
+    parser.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE,
+                        help="文件稳定多久后处理 (秒)")
+    parser.add_argument("--initial", action="store_true", help="启动时先生成一次全部图标")
+    args = parser.parse_args(argv)
+
+    for source in args.sources:
+        if not os.path.isfile(source):
+            parser.error(f"文件不存在: {source}")
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    def handle(paths, changed_at=None):
+        for source in paths:
+            start = time.perf_counter()
+            try:
+                path = regenerate(source, args.out_dir, args.sizes)
+            except Exception as e:
+                print(f"生成失败 {source}: {e}", file=sys.stderr)
+                continue
+            print(f"已生成 {path} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+    if args.initial:
+        handle([os.path.abspath(s) for s in args.sources])
+
+    watcher = Watcher(args.sources, handle, args.interval, args.debounce)
+    print(f"正在监视 {len(watcher.paths)} 个文件，按 Ctrl+C 停止")
+    try:
+        while True:
+            time.sleep(watcher.interval)
+            cycle = watcher.run_cycle()
+            if cycle:
+                print(f"本轮延迟: 去抖 {cycle['debounce_ms']:.0f} ms + 生成 {cycle['handle_ms']:.0f} ms "
+                      f"= {cycle['total_ms']:.0f} ms")
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())